@@ -0,0 +1,159 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+
+class AdmissionRejected(Exception):
+    """等待佇列已滿，呼叫端應回傳 429 並附上 Retry-After。"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Admission queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """單一請求的排隊憑證。"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.enqueued_at = time.monotonic()
+        self.granted_at: float | None = None
+        self.granted = asyncio.Event()
+        self.released = False
+
+
+class AdmissionController:
+    """
+    /chat 的准入控制。
+    同時執行的 pipeline 數量有全域上限，超過的請求進入有上限的等待佇列；
+    等待佇列依 client (IP 或 session) 分組並輪流放行，避免單一 client 佔滿名額。
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_queue_per_client: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self._active = 0
+        self._waiting = 0
+        # client_id -> 該 client 的等待佇列；OrderedDict 的順序即為輪詢順序
+        self._queues: OrderedDict[str, deque[Ticket]] = OrderedDict()
+        # 最近的服務時間，用於估算 Retry-After
+        self._service_times: deque[float] = deque(maxlen=100)
+        self._wait_times: deque[float] = deque(maxlen=1000)
+        self._counters = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "abandoned": 0,
+        }
+
+    def enqueue(self, client_id: str) -> Ticket:
+        """
+        取得排隊憑證。若有空位且無人排隊則立即放行，否則排入該 client 的佇列。
+        佇列已滿時拋出 AdmissionRejected。
+        """
+        ticket = Ticket(client_id)
+        if self._active < self.max_concurrency and self._waiting == 0:
+            self._grant(ticket)
+            return ticket
+
+        client_queue = self._queues.get(client_id)
+        if self._waiting >= self.max_queue or (client_queue and len(client_queue) >= self.max_queue_per_client):
+            self._counters["rejected"] += 1
+            raise AdmissionRejected(self._estimate_retry_after())
+
+        if client_queue is None:
+            client_queue = self._queues[client_id] = deque()
+        client_queue.append(ticket)
+        self._waiting += 1
+        self._counters["queued"] += 1
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        回傳此憑證前方還有幾個請求 (0 代表下一個放行)。
+        輪詢放行時，第 i 輪會放行每個 client 的第 i 個請求。
+        """
+        if ticket.granted.is_set():
+            return 0
+        client_queue = self._queues.get(ticket.client_id)
+        if not client_queue or ticket not in client_queue:
+            return 0
+        index = client_queue.index(ticket)
+        ahead = 0
+        before_client = True
+        for client_id, queue in self._queues.items():
+            if client_id == ticket.client_id:
+                before_client = False
+                ahead += index
+                continue
+            ahead += min(len(queue), index + 1 if before_client else index)
+        return ahead
+
+    def release(self, ticket: Ticket):
+        """請求結束 (完成、失敗或連線中斷) 時呼叫，可重複呼叫。"""
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted.is_set():
+            self._active -= 1
+            self._service_times.append(time.monotonic() - ticket.granted_at)
+        else:
+            client_queue = self._queues.get(ticket.client_id)
+            if client_queue and ticket in client_queue:
+                client_queue.remove(ticket)
+                self._waiting -= 1
+                self._counters["abandoned"] += 1
+                if not client_queue:
+                    del self._queues[ticket.client_id]
+        self._dispatch()
+
+    def stats(self) -> dict:
+        wait_times = sorted(self._wait_times)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "waiting": self._waiting,
+            "waiting_clients": len(self._queues),
+            "wait_ms_p50": _percentile(wait_times, 50) * 1000,
+            "wait_ms_p95": _percentile(wait_times, 95) * 1000,
+            "wait_ms_max": (wait_times[-1] if wait_times else 0.0) * 1000,
+            **self._counters,
+        }
+
+    def _grant(self, ticket: Ticket):
+        self._active += 1
+        ticket.granted_at = time.monotonic()
+        self._wait_times.append(ticket.granted_at - ticket.enqueued_at)
+        self._counters["admitted"] += 1
+        ticket.granted.set()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._queues:
+            client_id, client_queue = next(iter(self._queues.items()))
+            ticket = client_queue.popleft()
+            self._waiting -= 1
+            # 被放行的 client 移到輪詢順序的最後
+            if client_queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            self._grant(ticket)
+
+    def _estimate_retry_after(self) -> int:
+        if self._service_times:
+            avg_service = sum(self._service_times) / len(self._service_times)
+        else:
+            avg_service = 5.0
+        # 排在最後面的請求大約需要等待 (排隊數 / 並行數) 輪服務時間
+        rounds = (self._waiting + 1) / max(self.max_concurrency, 1)
+        return max(1, math.ceil(avg_service * rounds))
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -3,6 +3,7 @@ import psycopg2
 import time
 import json
 import asyncio
+from contextlib import aclosing
 
 from openai import AsyncOpenAI
 from pymilvus import MilvusClient
@@ -12,7 +13,22 @@ import config
 from prompts import PROMPTS
 
 from auto_filter import extract_filters_from_question, filters_to_expr
+from collection_version import CollectionVersion, identity_of
+from deadline import (Deadline, SKIP_REPHRASE, SKIP_FILTER, DENSE_ONLY, REDUCED_TOP_K, INTENT_TIMEOUT, SEARCH_TIMEOUT,
+                      degraded, bounded, merge_degradations)
+from faq_store import FaqStore
+from hedging import get_caller
+from model_router import model_router, start_stage_log
+from retrieval_cache import RetrievalCache
+from index_config import for_target, load_index_config
 from intent_classification import intent_classification
+from normalization import normalize_question
+from partition_layout import CurrentLayout, routed_expr
+from rephrase_detector import needs_rephrasing
+from session_store import SessionStore
+from small_talk import small_talk_reply
+from singleflight import SingleFlight
+import vector_repr
 
 # 使用集中化的設定來初始化 clients
 openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
@@ -21,20 +37,82 @@ milvus_client = MilvusClient(
     token=config.ZILLIZ_API_KEY,
 )
 
+# 向量維度與精度必須與 ingest 時建立的 collection 一致
+vector_repr.validate(config.EMBEDDING_MODEL, config.EMBEDDING_DIM, config.VECTOR_PRECISION)
+
+# 索引與搜尋參數 (index_sweep.py 的建議設定)
+index_config = for_target(load_index_config(config.MILVUS_INDEX_CONFIG), config.MILVUS_INDEX_TARGET)
+# ingest 時以 metadata 維度分區的配置；沒有時搜尋全部 partition
+partition_layout = CurrentLayout(config.MILVUS_PARTITION_LAYOUT, config.MILVUS_COLLECTION)
+
+# 合併同時發生的相同問題，只執行一次 pipeline
+answer_flights = SingleFlight()
+
+# 用來確認預先計算的 FAQ 答案仍對應目前的資料
+collection_version = CollectionVersion(milvus_client, config.MILVUS_COLLECTION, config.COLLECTION_VERSION_TTL_SECONDS)
+faq_store = FaqStore(config.FAQ_STORE_FILE, reload_seconds=config.FAQ_RELOAD_SECONDS) if config.FAQ_ENABLED else None
+retrieval_cache = RetrievalCache(
+    max_entries=config.RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.RETRIEVAL_CACHE_TTL_SECONDS,
+) if config.RETRIEVAL_CACHE_ENABLED else None
+
+
 async def get_embedding(text):
     """產生文字向量"""
     resp = await openai_client.embeddings.create(
         input=text,
-        model=config.EMBEDDING_MODEL
+        model=config.EMBEDDING_MODEL,
+        **vector_repr.embedding_kwargs(config.EMBEDDING_MODEL, config.EMBEDDING_DIM)
     )
     return resp.data[0].embedding
 
-async def retrieve_context(question: str, lang: str = 'zh', top_k: int = 7):
-    """根據問題進行混合檢索 (Dense + Sparse) + 過濾"""
-    from pymilvus import AnnSearchRequest, RRFRanker
+def current_partition_layout() -> tuple[str | None, dict | None]:
+    """回傳 (collection 版本, 該版本對應的 partition 配置) (同步呼叫，請在 asyncio.to_thread 中執行)"""
+    version = collection_version.get()
+    return version, partition_layout.get(identity_of(version))
 
-    # 1. 產生問題的向量 (Dense)
-    question_dense_embedding = await get_embedding(question)
+async def retrieve_context(question: str, lang: str = 'zh', top_k: int = 7, deadline: Deadline | None = None):
+    """
+    根據問題進行混合檢索 (Dense + Sparse) + 過濾，回傳清理過的 contexts。
+    過濾條件擷取之後先查詢檢索快取，命中時略過 embedding 與 Milvus 檢索。
+    有 deadline 時依剩餘時間依序降級：不過濾 -> 只做 dense 檢索 -> 縮小 top_k；檢索逾時回傳空結果。
+    """
+    # 1. 從問題中提取 metadata 過濾條件 (快取 key 的一部分)
+    filters = {}
+    if not degraded(deadline, SKIP_FILTER):
+        try:
+            filters = await bounded(deadline, extract_filters_from_question(question, lang), SKIP_FILTER)
+        except asyncio.TimeoutError:
+            filters = {}
+    expr = filters_to_expr(filters) if filters else None
+    version, layout = await asyncio.to_thread(current_partition_layout)
+    # collection 以 metadata 維度分區時，只搜尋值與過濾條件有交集的 partition
+    expr, partition_tags = routed_expr(layout, filters, expr)
+    print("Milvus expr:", expr)
+    if partition_tags == []:
+        print("沒有任何 partition 符合過濾條件，略過檢索")
+        return []
+
+    cache_key = None
+    if retrieval_cache is not None:
+        # 無法確認 collection 版本時不使用快取
+        if version is not None:
+            cache_key = RetrievalCache.make_key(question, expr, top_k, version)
+            cached = retrieval_cache.get(cache_key)
+            if cached is not None:
+                print(f"⚡ 檢索快取命中 ({len(cached)} 筆)")
+                return cached
+
+    mode = "dense" if degraded(deadline, DENSE_ONLY) else "hybrid"
+    if degraded(deadline, REDUCED_TOP_K):
+        top_k = min(top_k, config.DEADLINE_REDUCED_TOP_K)
+
+    retrieval_start = time.perf_counter()
+    # 2. 產生問題的向量 (Dense)
+    try:
+        question_dense_embedding = await bounded(deadline, get_embedding(question), SEARCH_TIMEOUT, before_retrieval=False)
+    except asyncio.TimeoutError:
+        return []
 
     # 2. 產生問題的向量 (Sparse) - 嘗試使用 BM25
     # 注意：如果使用者已設定 Server-side Function，可能不需要 Client-side 生成，
@@ -69,67 +147,113 @@ async def retrieve_context(question: str, lang: str = 'zh', top_k: int = 7):
     except ImportError:
         print("⚠️ Warning: pymilvus[model] not found. Sparse vector generation might fail if not handled by server.")
 
-    # 2. 從問題中提取 metadata 過濾條件
-    filters = extract_filters_from_question(question, lang=lang)
-    expr = filters_to_expr(filters) if filters else None
-    print("Milvus expr:", expr)
-
     # 3. 執行混合檢索
-    # Dense Request
-    dense_search_params = {"metric_type": "COSINE", "params": {"nprobe": 10}}
-    dense_req = AnnSearchRequest(
-        data=[question_dense_embedding],
-        anns_field="vector",
-        param=dense_search_params,
-        limit=top_k,
-        expr=expr
+    try:
+        raw_contexts, searched_mode = await bounded(
+            deadline,
+            asyncio.to_thread(search_milvus, question, question_dense_embedding, mode=mode, top_k=top_k, expr=expr),
+            SEARCH_TIMEOUT,
+            before_retrieval=False,
+        )
+    except asyncio.TimeoutError:
+        return []
+    cleaned_contexts = log_and_clean_contexts(raw_contexts)
+    # 降級後的結果 (包含 hybrid 失敗退回 dense) 不放入快取，之後的相同問題仍會完整檢索
+    retrieval_degraded = searched_mode != mode or deadline is not None and any(
+        d in deadline.degradations for d in (SKIP_FILTER, DENSE_ONLY, REDUCED_TOP_K)
     )
+    if cache_key is not None and not retrieval_degraded:
+        retrieval_cache.put(cache_key, cleaned_contexts, (time.perf_counter() - retrieval_start) * 1000)
+    return cleaned_contexts
+
+SEARCH_OUTPUT_FIELDS = ["id", "text", "source_file", "source_url", "status", "subsidy_type", "edu_system"]
+SEARCH_MODES = ("dense", "sparse", "hybrid")
+
+def search_milvus(question: str, dense_embedding: list, mode: str = "hybrid", top_k: int = 7,
+                  expr: str | None = None, dense_params: dict | None = None) -> tuple[list, str]:
+    """
+    以已產生的向量在 Milvus 中檢索 (阻塞式呼叫，請在 thread 中執行)，回傳 (結果, 實際使用的 mode)。
+    mode 為 "dense" (向量)、"sparse" (BM25 全文檢索) 或 "hybrid" (兩者以 RRF 融合)；
+    hybrid 失敗時退回 dense，回傳的 mode 為 "dense"。
+    dense_params 可覆寫索引設定中的向量搜尋參數 (例如 {"nprobe": 32} 或 {"ef": 64})。
+    retrieve_context 與離線的檢索 benchmark 共用這個函式。
+    """
+    from pymilvus import AnnSearchRequest, RRFRanker
 
+    # Dense Request
+    dense_vector = vector_repr.to_milvus(dense_embedding, config.VECTOR_PRECISION)
+    dense_search_params = {
+        "metric_type": index_config["dense"]["metric_type"],
+        "params": index_config["dense"]["search_params"] if dense_params is None else dense_params,
+    }
     # Sparse Request
-    # 如果是 Milvus 2.5 Built-in Function，我們可能可以直接傳 Text?
-    # 目前 PyMilvus 支援 data=[text] 如果有 Function。
+    # 如果是 Milvus 2.5 Built-in Function，我們可以直接傳 Text，依賴 Server-side Function
     # 我們假設 sparse 欄位名稱為 'text_sparse' (使用者提到的)
-    sparse_search_params = {"metric_type": "BM25", "params": {}} # BM25 metric type? Or IP? Usually IP for sparse.
-    # 修正: Sparse Vector 通常用 IP 或 SPLADE 指定的 metric。BM25 也是基於 IP。
-    sparse_req = AnnSearchRequest(
-        data=[question], # 嘗試直接傳文字，依賴 Server-side Function
-        anns_field="text_sparse",
-        param={"metric_type": "BM25", "params": {}}, # 假設 metric_type 是 BM25
-        limit=top_k,
-        expr=expr
-    )
-
-    # Reranker
-    reranker = RRFRanker()
+    sparse_search_params = {
+        "metric_type": index_config["sparse"]["metric_type"],
+        "params": index_config["sparse"]["search_params"],
+    }
+
+    def _dense_search():
+        return milvus_client.search(
+            collection_name=config.MILVUS_COLLECTION,
+            data=[dense_vector],
+            anns_field="vector",
+            search_params=dense_search_params,
+            limit=top_k,
+            filter=expr if expr else None,
+            output_fields=SEARCH_OUTPUT_FIELDS,
+        )
 
-    def _milvus_hybrid_search():
+    if mode == "dense":
+        results = _dense_search()
+    elif mode == "sparse":
+        results = milvus_client.search(
+            collection_name=config.MILVUS_COLLECTION,
+            data=[question],
+            anns_field="text_sparse",
+            search_params=sparse_search_params,
+            limit=top_k,
+            filter=expr if expr else None,
+            output_fields=SEARCH_OUTPUT_FIELDS,
+        )
+    elif mode == "hybrid":
+        dense_req = AnnSearchRequest(
+            data=[dense_vector],
+            anns_field="vector",
+            param=dense_search_params,
+            limit=top_k,
+            expr=expr
+        )
+        sparse_req = AnnSearchRequest(
+            data=[question], # 嘗試直接傳文字，依賴 Server-side Function
+            anns_field="text_sparse",
+            param=sparse_search_params,
+            limit=top_k,
+            expr=expr
+        )
         try:
             # 嘗試 Hybrid Search
-            return milvus_client.hybrid_search(
+            results = milvus_client.hybrid_search(
                 collection_name=config.MILVUS_COLLECTION,
                 reqs=[dense_req, sparse_req],
-                ranker=reranker,
+                ranker=RRFRanker(),
                 limit=top_k,
-                output_fields=["id", "text", "source_file", "source_url", "status", "subsidy_type", "edu_system"]
+                output_fields=SEARCH_OUTPUT_FIELDS
             )
         except Exception as e:
             print(f"Hybrid search failed: {e}")
             print("Falling back to Dense search only.")
             # Fallback to dense search
-            return milvus_client.search(
-                collection_name=config.MILVUS_COLLECTION,
-                data=[question_dense_embedding],
-                search_params=dense_search_params,
-                limit=top_k,
-                filter=expr if expr else None,
-                output_fields=["id", "text", "source_file", "source_url", "status", "subsidy_type", "edu_system"],
-            )
+            results = _dense_search()
+            mode = "dense"
+    else:
+        raise ValueError(f"Unknown search mode: {mode}")
 
-    results = await asyncio.to_thread(_milvus_hybrid_search)
     if not results or not results[0]:
-        return []
+        return [], mode
 
-    return results[0]
+    return results[0], mode
 
 def log_and_clean_contexts(retrieved_docs: list):
     """
@@ -164,7 +288,7 @@ def log_and_clean_contexts(retrieved_docs: list):
         })
     return cleaned_contexts
 
-def log_to_db(question, rephrased_question, answer, contexts, latency_ms, usage):
+def log_to_db(question, rephrased_question, answer, contexts, latency_ms, usage, degradations=None, stage_models=None):
     """將問答資料和 token 使用量記錄到 PostgreSQL 資料庫中"""
     conn = None
     cursor = None
@@ -183,10 +307,10 @@ def log_to_db(question, rephrased_question, answer, contexts, latency_ms, usage)
         total_tokens = usage.total_tokens if usage else None
 
         insert_query = f"""INSERT INTO {config.DB_TABLE_NAME} 
-                         (question, rephrased_question, answer, retrieved_contexts, latency_ms, prompt_tokens, completion_tokens, total_tokens)
-                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;"""
+                         (question, rephrased_question, answer, retrieved_contexts, latency_ms, prompt_tokens, completion_tokens, total_tokens, degradations, stage_models)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;"""
         
-        cursor.execute(insert_query, (question, rephrased_question, answer, json.dumps(contexts, ensure_ascii=False), latency_ms, prompt_tokens, completion_tokens, total_tokens))
+        cursor.execute(insert_query, (question, rephrased_question, answer, json.dumps(contexts, ensure_ascii=False), latency_ms, prompt_tokens, completion_tokens, total_tokens, json.dumps(degradations or []), json.dumps(stage_models or {})))
         log_id = cursor.fetchone()[0]
         conn.commit()
         print(f"\n[DB] 本次問答紀錄已成功儲存到 PostgreSQL 資料庫，ID: {log_id}。")
@@ -198,27 +322,34 @@ def log_to_db(question, rephrased_question, answer, contexts, latency_ms, usage)
         if cursor: cursor.close()
         if conn: conn.close()
 
-async def _rephrase_question_with_history(history: list, question: str, lang: str = 'zh') -> str:
+async def _rephrase_question_with_history(history: list, question: str, lang: str = 'zh', summary: str = "") -> str:
     """
     使用對話歷史來重構一個新的、獨立的問題。
+    summary 為較早對話的滾動摘要，history 則只包含尚未併入摘要的最近幾輪。
     """
-    if not history:
+    if not history and not summary:
         return question
 
-    history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history[-8:]])
+    history_lines = [f"{msg['role']}: {msg['content']}" for msg in history[-8:]]
+    if summary:
+        history_lines.insert(0, f"{PROMPTS[lang]['history_summary_label']}:\n{summary}\n")
+    history_str = "\n".join(history_lines)
     system_prompt = PROMPTS[lang]['rephrase_system']
     user_prompt = PROMPTS[lang]['rephrase_user'].format(history_str=history_str, question=question)
 
     try:
-        response = await openai_client.chat.completions.create(
-            model=config.OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.0,
-            max_tokens=150,
-        )
+        # 重構問題的回應很短，延遲長尾由 hedged request 處理 (依模型分開統計延遲)
+        response = await model_router.call("rephrase", lambda model: get_caller("rephrase", model).call(
+            lambda: openai_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.0,
+                max_tokens=150,
+            )
+        ))
         rephrased_question = response.choices[0].message.content.strip()
         if not rephrased_question:
             return question
@@ -228,10 +359,36 @@ async def _rephrase_question_with_history(history: list, question: str, lang: st
         print(f"⚠️ 問題重構失敗: {e}")
         return question
 
-async def generate_answer_stream(question: str, cleaned_contexts: list, lang: str = 'zh'):
-    """
-    把清理過的 Milvus 檢索結果交給 GPT 生成自然語言回答，並以串流形式回傳。
-    """
+async def summarize_conversation(summary: str, turns: list, lang: str = 'zh') -> str:
+    """將較舊的對話輪次併入滾動摘要 (由 session_store 在背景呼叫)。"""
+    turns_str = "\n".join(f"user: {turn['question']}\nassistant: {turn['answer']}" for turn in turns)
+    user_prompt = PROMPTS[lang]['summary_user'].format(summary=summary or "-", turns_str=turns_str)
+    response = await model_router.call("summary", lambda model: openai_client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": PROMPTS[lang]['summary_system']},
+            {"role": "user", "content": user_prompt},
+        ],
+        temperature=0.0,
+        max_tokens=200,
+    ))
+    new_summary = (response.choices[0].message.content or "").strip()
+    print(f"📝 對話摘要更新: {new_summary}")
+    return new_summary
+
+# 伺服器端的對話歷史 (client 只送出 session id)，較舊的輪次在背景併入滾動摘要
+session_store = SessionStore(
+    ttl_seconds=config.SESSION_TTL_SECONDS,
+    max_sessions=config.SESSION_MAX_SESSIONS,
+    max_turns=config.SESSION_MAX_TURNS,
+    answer_chars=config.SESSION_ANSWER_CHARS,
+    summarizer=summarize_conversation,
+    summary_trigger_turns=config.SESSION_SUMMARY_TRIGGER_TURNS,
+    summary_keep_turns=config.SESSION_SUMMARY_KEEP_TURNS,
+)
+
+def build_context_for_llm(cleaned_contexts: list) -> str:
+    """將檢索結果依來源分組，組成提供給 LLM 的檢索內容字串。"""
     from collections import defaultdict
     grouped = defaultdict(list)
     source_url_map = {}
@@ -250,28 +407,181 @@ async def generate_answer_stream(question: str, cleaned_contexts: list, lang: st
             context_for_llm += f"來源網址: {url}\n"
         full_text = "\n".join(texts)
         context_for_llm += f"內容: {full_text}\n"
+    return context_for_llm
+
+async def generate_answer_stream(question: str, cleaned_contexts: list, lang: str = 'zh'):
+    """
+    把清理過的 Milvus 檢索結果交給 GPT 生成自然語言回答，並以串流形式回傳。
+    """
+    context_for_llm = build_context_for_llm(cleaned_contexts)
 
     system_prompt = PROMPTS[lang]['rag_system']
     user_prompt = PROMPTS[lang]['rag_user'].format(question=question, context_for_llm=context_for_llm)
 
-    stream = await openai_client.chat.completions.create(
-        model=config.OPENAI_MODEL_NAME,
+    stream = model_router.stream("answer", lambda model: openai_client.chat.completions.create(
+        model=model,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
         temperature=0.0,
         stream=True,
-    )
+    ))
     async for chunk in stream:
         content = chunk.choices[0].delta.content or ""
         yield content
 
-async def stream_chat_pipeline(question: str, history: list | None = None, lang: str = 'zh'):
+SOURCES_DELIMITER = "|||SOURCES|||"
+
+async def stream_until_sources(llm_stream, raw_chunks: list):
+    """
+    轉送 LLM 串流中分隔符號 |||SOURCES||| 之前的內容。
+    分隔符號可能被切在多個 chunk 之間，因此保留最後 len(delimiter) 個字元直到確認不是分隔符號。
+    所有原始 chunk (包含來源列表) 都會附加到 raw_chunks。
+    """
+    buffer = ""
+    delimiter = SOURCES_DELIMITER
+
+    async for chunk in llm_stream:
+        raw_chunks.append(chunk)
+        buffer += chunk
+
+        if delimiter in buffer:
+            answer_part, _ = buffer.split(delimiter, 1)
+            yield answer_part
+            async for remaining_chunk in llm_stream:
+                raw_chunks.append(remaining_chunk)
+            return
+        else:
+            if len(buffer) > len(delimiter):
+                yield_part = buffer[:-len(delimiter)]
+                yield yield_part
+                buffer = buffer[-len(delimiter):]
+
+    if buffer:
+        yield buffer
+
+async def _answer_events(question: str, lang: str, outcome: dict, deadline: Deadline | None = None):
+    """
+    針對(已重構的)問題執行意圖分類、檢索與生成，以串流形式產生 content 事件。
+    最終的回答、引用的 contexts 與套用的降級會寫入 outcome，供每個請求各自記錄。
+    """
+    outcome["full_answer"] = ""
+    outcome["contexts_for_logging"] = []
+    outcome["contexts"] = []
+    # 共用的 pipeline 另外記錄降級與各階段使用的模型，不會混入第一個請求自己的 (例如問題重構)
+    deadline = deadline.fork() if deadline else None
+    outcome["degradations"] = deadline.degradations if deadline else []
+    outcome["stage_models"] = start_stage_log()
+
+    try:
+        intent = await bounded(deadline, intent_classification(question, lang=lang), INTENT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # 無法判斷時當作獎助學金問題：閒聊被檢索只是多花時間，反過來則會答非所問
+        intent = "scholarship"
+    print(f"意圖: {intent}")
+
+    if intent == "scholarship":
+        cleaned_contexts = await retrieve_context(question, lang=lang, deadline=deadline)
+
+        if not cleaned_contexts:
+            no_result_answer = PROMPTS[lang]['no_result_answer']
+            outcome["full_answer"] = no_result_answer
+            yield {"type": "content", "data": no_result_answer}
+            return
+
+        llm_stream = generate_answer_stream(question, cleaned_contexts, lang=lang)
+        raw_chunks = []
+        async for answer_part in stream_until_sources(llm_stream, raw_chunks):
+            yield {"type": "content", "data": answer_part}
+        full_answer = "".join(raw_chunks)
+
+        answer_part = full_answer
+        cited_source_names = []
+        if SOURCES_DELIMITER in full_answer:
+            parts = full_answer.split(SOURCES_DELIMITER)
+            answer_part = parts[0].strip()
+            source_names_str = parts[1].strip()
+            if source_names_str:
+                cited_source_names = [name.strip() for name in source_names_str.split(',')]
+
+        outcome["full_answer"] = answer_part
+
+        cited_source_names_set = set(cited_source_names)
+        all_cited_contexts = [ctx for ctx in cleaned_contexts if ctx.get('source_file') in cited_source_names_set]
+        outcome["contexts_for_logging"] = all_cited_contexts
+
+        unique_display_contexts = []
+        seen_keys = set()
+        for context in all_cited_contexts:
+            unique_key = context.get('source_url') or context.get('source_file')
+            if unique_key not in seen_keys:
+                unique_display_contexts.append(context)
+                seen_keys.add(unique_key)
+
+        outcome["contexts"] = unique_display_contexts
+
+    else: # Small talk
+        stream = model_router.stream("small_talk", lambda model: openai_client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": PROMPTS[lang]['small_talk_system']},
+                {"role": "user", "content": question}
+            ],
+            temperature=0.7,
+            stream=True,
+        ))
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content or ""
+            outcome["full_answer"] += content
+            yield {"type": "content", "data": content}
+
+async def lookup_faq(question: str, lang: str) -> dict | None:
+    """查詢預先計算的 FAQ 答案；只有 collection 版本與建立時相同才回傳。"""
+    if faq_store is None:
+        return None
+    await faq_store.refresh()
+    entry = faq_store.get(question, lang)
+    if entry is None:
+        return None
+    version = await asyncio.to_thread(collection_version.get)
+    current = faq_store.is_current(version)
+    faq_store.record(current)
+    return entry if current else None
+
+async def _faq_events(entry: dict, outcome: dict):
+    """以預先計算的答案產生與 _answer_events 相同格式的事件與結果。"""
+    outcome["full_answer"] = entry["answer"]
+    outcome["contexts_for_logging"] = entry.get("contexts_for_logging", [])
+    outcome["contexts"] = entry.get("contexts", [])
+    yield {"type": "content", "data": entry["answer"]}
+
+async def _small_talk_events(reply: str, outcome: dict):
+    """寒暄的本地回覆，產生與 _answer_events 相同格式的事件與結果。"""
+    outcome["full_answer"] = reply
+    outcome["contexts_for_logging"] = []
+    outcome["contexts"] = []
+    yield {"type": "content", "data": reply}
+
+async def stream_chat_pipeline(question: str, history: list | None = None, lang: str = 'zh',
+                               session_id: str | None = None):
     """
     Orchestrates the entire RAG pipeline for streaming responses.
+    Concurrent requests with the same final question and language share one pipeline run;
+    each request still logs its own row and receives its own final data.
+    Frequent questions are answered from the precomputed FAQ store when it matches the current collection.
+    Greetings and thanks are answered locally from canned templates without any LLM call.
+    With a session_id the history is read from (and the new turn saved to) the server-side session store;
+    otherwise the caller-supplied history is used.
+    Every stage before answer generation runs against a per-request deadline and degrades
+    (skip rephrase, skip filter extraction, dense-only search, smaller top_k) as the budget runs out.
     """
     start_time = time.time()
+    deadline = Deadline.from_config()
+    flight_degradations = []
+    # 各階段使用的模型與延遲 (問題重構在這裡，其餘在共用的 pipeline 中)
+    stage_models = start_stage_log()
+    flight_stage_models = {}
     full_answer = ""
     original_question = question
     rephrased_question = question
@@ -279,102 +589,81 @@ async def stream_chat_pipeline(question: str, history: list | None = None, lang:
     result_data = {}
 
     try:
-        if history:
-            rephrased_question = await _rephrase_question_with_history(history, question, lang=lang)
+        summary = ""
+        if session_id:
+            summary, history = session_store.get_context(session_id)
+
+        # 寒暄以使用者原本的訊息比對，重構後的句子 (「好的，謝謝你的說明」) 不會命中片語索引
+        canned_reply = small_talk_reply(question, lang)
+        if canned_reply is not None:
+            print("💬 寒暄訊息，使用本地回覆")
+        elif (history or summary) and not needs_rephrasing(question):
+            # 可以獨立理解的問題與寒暄不需要呼叫 LLM 重構
+            print("🔄 問題可獨立理解，略過重構")
+        elif (history or summary) and not degraded(deadline, SKIP_REPHRASE):
+            try:
+                rephrased_question = await bounded(
+                    deadline,
+                    _rephrase_question_with_history(history, question, lang=lang, summary=summary),
+                    SKIP_REPHRASE,
+                )
+            except asyncio.TimeoutError:
+                rephrased_question = question
         
         print(f"\n❓ 最終問題: {rephrased_question} (原始: {original_question})")
 
-        intent = await intent_classification(rephrased_question, lang=lang)
-        print(f"意圖: {intent}")
-
-        if intent == "scholarship":
-            raw_contexts = await retrieve_context(rephrased_question, lang=lang)
-            cleaned_contexts = log_and_clean_contexts(raw_contexts)
-
-            if not cleaned_contexts:
-                no_result_answer = PROMPTS[lang]['no_result_answer']
-                yield {"type": "content", "data": no_result_answer}
-                full_answer = no_result_answer
-                result_data = {"contexts": []}
-                return
-
-            llm_stream = generate_answer_stream(rephrased_question, cleaned_contexts, lang=lang)
-            buffer = ""
-            delimiter = "|||SOURCES|||"
-
-            async for chunk in llm_stream:
-                full_answer += chunk
-                buffer += chunk
-
-                if delimiter in buffer:
-                    answer_part, _ = buffer.split(delimiter, 1)
-                    yield {"type": "content", "data": answer_part}
-                    async for remaining_chunk in llm_stream:
-                        full_answer += remaining_chunk
-                    break
-                else:
-                    if len(buffer) > len(delimiter):
-                        yield_part = buffer[:-len(delimiter)]
-                        yield {"type": "content", "data": yield_part}
-                        buffer = buffer[-len(delimiter):]
-            else:
-                if buffer:
-                    yield {"type": "content", "data": buffer}
-
-            answer_part = full_answer
-            cited_source_names = []
-            if "|||SOURCES|||" in full_answer:
-                parts = full_answer.split("|||SOURCES|||")
-                answer_part = parts[0].strip()
-                source_names_str = parts[1].strip()
-                if source_names_str:
-                    cited_source_names = [name.strip() for name in source_names_str.split(',')]
-            
-            full_answer = answer_part
-
-            cited_source_names_set = set(cited_source_names)
-            all_cited_contexts = [ctx for ctx in cleaned_contexts if ctx.get('source_file') in cited_source_names_set]
-            contexts_for_logging = all_cited_contexts
-
-            unique_display_contexts = []
-            seen_keys = set()
-            for context in all_cited_contexts:
-                unique_key = context.get('source_url') or context.get('source_file')
-                if unique_key not in seen_keys:
-                    unique_display_contexts.append(context)
-                    seen_keys.add(unique_key)
-            
-            result_data = {"contexts": unique_display_contexts}
-        
-        else: # Small talk
-            stream = await openai_client.chat.completions.create(
-                model=config.OPENAI_MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": PROMPTS[lang]['small_talk_system']},
-                    {"role": "user", "content": rephrased_question}
-                ],
-                temperature=0.7,
-                stream=True,
+        faq_entry = None if canned_reply is not None else await lookup_faq(rephrased_question, lang)
+        if canned_reply is not None:
+            outcome = {}
+            async for event in _small_talk_events(canned_reply, outcome):
+                yield event
+        elif faq_entry is not None:
+            print("⚡ 使用預先計算的 FAQ 答案")
+            outcome = {}
+            async for event in _faq_events(faq_entry, outcome):
+                yield event
+        else:
+            flight_key = (normalize_question(rephrased_question), lang)
+            flight = answer_flights.join(
+                flight_key,
+                lambda outcome: _answer_events(rephrased_question, lang, outcome, deadline),
             )
-            async for chunk in stream:
-                content = chunk.choices[0].delta.content or ""
-                full_answer += content
-                yield {"type": "content", "data": content}
-            
-            result_data = {"contexts": []}
+            async with aclosing(flight.stream()) as events:
+                async for event in events:
+                    yield event
+            outcome = flight.result
+            # 與其他請求共用的 pipeline 依第一個請求的 deadline 降級
+            flight_degradations = outcome.get("degradations", [])
+            flight_stage_models = outcome.get("stage_models", {})
+
+        full_answer = outcome.get("full_answer", "")
+        contexts_for_logging = outcome.get("contexts_for_logging", [])
+        result_data = {"contexts": outcome.get("contexts", [])}
+
+        # 寒暄不影響之後的問題重構，不記入對話歷史
+        if session_id and full_answer and canned_reply is None:
+            cited_sources = [
+                ctx['source_file'].replace('.md', '').replace('.txt', '')
+                for ctx in result_data["contexts"] if ctx.get('source_file')
+            ]
+            session_store.append_turn(session_id, rephrased_question, full_answer, cited_sources, lang=lang)
 
     finally:
         end_time = time.time()
         latency_ms = (end_time - start_time) * 1000
         print(f"\n⏱️ 本次問答總耗時: {latency_ms:.2f} ms")
+        degradations = merge_degradations(deadline.degradations if deadline else [], flight_degradations)
+        stage_models = {**stage_models, **flight_stage_models}
         
         try:
-            log_id = await asyncio.to_thread(log_to_db, original_question, rephrased_question, full_answer, contexts_for_logging, latency_ms, None)
+            log_id = await asyncio.to_thread(log_to_db, original_question, rephrased_question, full_answer, contexts_for_logging, latency_ms, None, degradations, stage_models)
         except Exception as e:
             print(f"[ERROR] log_to_db failed in thread: {e}")
             log_id = None
 
         if log_id:
             result_data["log_id"] = log_id
+        if session_id:
+            result_data["session_id"] = session_id
         
-        yield {"type": "final_data", "data": result_data}
+        yield {"type": "final_data", "data": result_data}
\ No newline at end of file
@@ -1,12 +1,15 @@
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI
 from pymilvus import DataType
 import json
 import config
 from prompts import PROMPTS
+from hedging import get_caller
+from model_router import model_router
 
-client = OpenAI(api_key=config.OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
 
-def extract_filters_from_question(question: str, lang: str = 'zh', schema_path: str = "metadata_schema.json"):
+async def extract_filters_from_question(question: str, lang: str = 'zh', schema_path: str = "metadata_schema.json"):
     # 從文件加載 metadata schema
     try:
         with open(schema_path, 'r', encoding='utf-8') as f:
@@ -23,11 +26,12 @@ def extract_filters_from_question(question: str, lang: str = 'zh', schema_path:
         question=question
     )
 
-    resp = client.chat.completions.create(
-        model=config.OPENAI_MODEL_NAME,
+    # 回應很短但延遲長尾明顯，逾時未回應時加送一個相同的請求
+    resp = await model_router.call("filter", lambda model: get_caller("filter", model).call(lambda: client.chat.completions.create(
+        model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=0.0  # 降低隨機性
-    )
+    )))
 
     raw_text = resp.choices[0].message.content.strip()
     print("🔎 原始 LLM 輸出:", raw_text)  # 方便 debug
@@ -61,13 +65,13 @@ def filters_to_expr(filters: dict) -> str:
 
 if __name__ == "__main__":
     question_zh = "有哪些補助適合低收入戶的大學生？"
-    filters_zh = extract_filters_from_question(question_zh, lang='zh')
+    filters_zh = asyncio.run(extract_filters_from_question(question_zh, lang='zh'))
     print("生成的 metadata 過濾條件 (zh):", filters_zh)
     expr_zh = filters_to_expr(filters_zh)
     print("milvus 過濾條件 (zh):", expr_zh)
 
     question_en = "What subsidies are available for low-income university students?"
-    filters_en = extract_filters_from_question(question_en, lang='en')
+    filters_en = asyncio.run(extract_filters_from_question(question_en, lang='en'))
     print("\nGenerated metadata filters (en):", filters_en)
     expr_en = filters_to_expr(filters_en)
     print("milvus filter expression (en):", expr_en)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+由問答紀錄建立預先計算的 FAQ 答案 (faq_store.json)。
+
+1. 讀取紀錄中的問題 (優先使用重構後的問題)，以 faq_key 合併寫法不同的同一個問題。
+2. 以 embedding 的 cosine 相似度將語意相同的問題分群 (由出現次數多的開始貪婪合併)。
+3. 取出現次數最多的群組，對代表問題離線執行完整的 pipeline (意圖分類、檢索、生成)。
+4. 連同引用的 contexts 與目前的 collection 版本寫入 FAQ 檔案；服務會自動重新載入。
+
+分群只用來決定要預先計算哪些問題。只有 faq_key 與代表問題相同的寫法會成為答案的別名；
+相似但不同的問題 (「低收入戶」與「中低收入戶」、「碩士班」與「博士班」) 不會直接共用答案。
+加上 --verify-variants 時，其他寫法各自執行一次檢索，結果與代表問題引用的 contexts 相同才加入別名 (verified_variants)。
+
+重新 ingest 後 collection 版本會改變，舊的答案不會再被使用；ingest 腳本完成後會自動執行本程式重建。
+
+用法:
+    python build_faq_store.py                                        # 使用 Postgres 的問答紀錄
+    python build_faq_store.py --source sqlite --db evaluation.db --min-count 2
+    python build_faq_store.py --top 100 --similarity 0.95 --dry-run
+    python build_faq_store.py --verify-variants
+"""
+import argparse
+import asyncio
+import re
+import sqlite3
+from collections import Counter
+
+import numpy as np
+
+import config
+import answer
+from faq_store import faq_key, write_store
+
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+def load_questions(args) -> list[str]:
+    query = f"""SELECT question, rephrased_question FROM {args.table}
+                WHERE question IS NOT NULL ORDER BY id DESC"""
+    if args.limit:
+        query += f" LIMIT {int(args.limit)}"
+    if args.source == "postgres":
+        import psycopg2
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            dbname=config.DB_NAME,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD
+        )
+    else:
+        conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return [(rephrased_question or question).strip() for question, rephrased_question in rows if (rephrased_question or question).strip()]
+
+
+def group_by_key(questions: list[str]) -> list[dict]:
+    """以 faq_key 合併寫法不同的同一個問題，回傳 [{"question", "count", "variants": Counter}]，依次數排序"""
+    groups: dict[str, dict] = {}
+    for question in questions:
+        key = faq_key(question)
+        if not key:
+            continue
+        group = groups.setdefault(key, {"count": 0, "variants": Counter()})
+        group["count"] += 1
+        group["variants"][question] += 1
+    result = []
+    for group in groups.values():
+        group["question"] = group["variants"].most_common(1)[0][0]
+        result.append(group)
+    return sorted(result, key=lambda g: g["count"], reverse=True)
+
+
+async def embed_questions(texts: list[str], batch_size: int = 256) -> np.ndarray:
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        resp = await answer.openai_client.embeddings.create(input=texts[start:start + batch_size], model=config.EMBEDDING_MODEL)
+        vectors.extend(item.embedding for item in sorted(resp.data, key=lambda item: item.index))
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def cluster_groups(groups: list[dict], embeddings: np.ndarray | None, similarity: float) -> list[dict]:
+    """
+    貪婪分群：依次數由多到少，與已存在群組的代表問題相似度 >= similarity 時併入，否則成為新群組。
+    代表問題固定為群組中最先出現 (次數最多) 的問題，群組不會因為鏈式合併而漂移。
+    """
+    clusters = []
+    centers = []
+    for index, group in enumerate(groups):
+        if embeddings is not None and centers:
+            scores = np.asarray(centers) @ embeddings[index]
+            best = int(np.argmax(scores))
+            if scores[best] >= similarity:
+                cluster = clusters[best]
+                cluster["count"] += group["count"]
+                cluster["variants"].update(group["variants"])
+                continue
+        clusters.append({"question": group["question"], "count": group["count"], "variants": Counter(group["variants"])})
+        if embeddings is not None:
+            centers.append(embeddings[index])
+    return sorted(clusters, key=lambda c: c["count"], reverse=True)
+
+
+def detect_lang(question: str) -> str:
+    return "zh" if _CJK_RE.search(question) else "en"
+
+
+async def verified_variants(variants: list[str], lang: str, contexts: list[dict]) -> list[str]:
+    """檢索結果與代表問題引用的 contexts 完全相同的寫法"""
+    expected = {ctx.get("id") for ctx in contexts}
+    verified = []
+    for variant in variants:
+        retrieved = await answer.retrieve_context(variant, lang)
+        if {ctx.get("id") for ctx in retrieved} == expected:
+            verified.append(variant)
+        else:
+            print(f"    - 別名檢索結果不同，不共用答案: {variant}")
+    return verified
+
+
+async def precompute(cluster: dict, semaphore: asyncio.Semaphore, verify_variants: bool = False) -> dict | None:
+    """
+    對代表問題執行完整的 pipeline；只保存有引用資料來源的獎助學金回答。
+    別名只包含 faq_key 相同的寫法 (與 verify_variants 時檢索結果相同的寫法)。
+    """
+    question = cluster["question"]
+    lang = detect_lang(question)
+    async with semaphore:
+        outcome = {}
+        async for _ in answer._answer_events(question, lang, outcome):
+            pass
+    # 閒聊與查無資料的回答沒有 contexts
+    if not outcome.get("contexts"):
+        print(f"  - 略過 (沒有引用資料來源): {question}")
+        return None
+    key = faq_key(question)
+    others = sorted(set(cluster["variants"]) - {question})
+    same_key = [variant for variant in others if faq_key(variant) == key]
+    verified = []
+    if verify_variants:
+        async with semaphore:
+            verified = await verified_variants([v for v in others if faq_key(v) != key], lang, outcome["contexts"])
+    print(f"  + {question} ({cluster['count']} 次，{len(same_key) + len(verified)}/{len(others)} 種其他寫法可共用答案)")
+    return {
+        "question": question,
+        "lang": lang,
+        "count": cluster["count"],
+        "variants": same_key,
+        "verified_variants": verified,
+        "answer": outcome["full_answer"],
+        "contexts": outcome["contexts"],
+        "contexts_for_logging": outcome["contexts_for_logging"],
+    }
+
+
+async def build(args) -> int:
+    questions = load_questions(args)
+    print(f"讀取 {len(questions)} 筆問題 ({args.source}:{args.table})")
+    groups = group_by_key(questions)
+    print(f"正規化後共有 {len(groups)} 個不同的問題")
+
+    embeddings = None if args.no_embeddings else await embed_questions([g["question"] for g in groups])
+    clusters = [c for c in cluster_groups(groups, embeddings, args.similarity) if c["count"] >= args.min_count][:args.top]
+    print(f"選出 {len(clusters)} 個出現至少 {args.min_count} 次的問題群組")
+    if args.dry_run:
+        for cluster in clusters:
+            print(f"  {cluster['count']:>4}  {cluster['question']}  ({len(cluster['variants'])} 種寫法)")
+        return 0
+
+    version = await asyncio.to_thread(answer.collection_version.get)
+    if version is None:
+        raise SystemExit("無法取得 collection 版本，未寫入 FAQ。")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = await asyncio.gather(*(precompute(cluster, semaphore, args.verify_variants) for cluster in clusters))
+    entries = [entry for entry in results if entry]
+
+    # 建立期間若重新 ingest，答案可能混合新舊資料，不寫入
+    answer.collection_version.invalidate()
+    if await asyncio.to_thread(answer.collection_version.get) != version:
+        raise SystemExit("建立期間 collection 已變更，未寫入 FAQ，請重新執行。")
+
+    write_store(args.output, version, entries)
+    print(f"已寫入 {len(entries)} 筆 FAQ 答案到 {args.output} (collection 版本 {version})")
+    return len(entries)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute answers for the most frequent questions in the QA logs.")
+    parser.add_argument("--source", choices=["postgres", "sqlite"], default="postgres", help="問答紀錄來源")
+    parser.add_argument("--db", default="evaluation.db", help="--source sqlite 時使用的資料庫檔案")
+    parser.add_argument("--table", default=None, help="問答紀錄資料表 (預設 sqlite 為 qa_logs，postgres 為 DB_TABLE_NAME)")
+    parser.add_argument("--limit", type=int, default=None, help="最多使用幾筆紀錄 (由新到舊)")
+    parser.add_argument("--top", type=int, default=50, help="最多預先計算幾個問題")
+    parser.add_argument("--min-count", type=int, default=3, help="問題至少出現幾次才預先計算")
+    parser.add_argument("--similarity", type=float, default=0.93, help="併入同一群組的 cosine 相似度門檻")
+    parser.add_argument("--no-embeddings", action="store_true", help="只合併正規化後完全相同的問題")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時執行的 pipeline 數")
+    parser.add_argument("--output", default=config.FAQ_STORE_FILE)
+    parser.add_argument("--dry-run", action="store_true", help="只列出分群結果，不執行 pipeline")
+    parser.add_argument("--verify-variants", action="store_true",
+                        help="群組中寫法不同的問題各自檢索，結果與代表問題相同才共用答案")
+    args = parser.parse_args()
+    if args.table is None:
+        args.table = config.DB_TABLE_NAME if args.source == "postgres" else "qa_logs"
+    return args
+
+
+def main():
+    asyncio.run(build(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+前端靜態檔案的建置步驟。
+
+1. 將 style.css、index.js、locales/*.json 與圖示複製到 dist/assets/，檔名加上內容雜湊 (例如 style.3f2a9c1e0b7d.css)，
+   內容不變檔名就不變，瀏覽器可以永久快取 (Cache-Control: immutable)。
+2. 可壓縮的檔案另外產生 .gz 與 .br (需要 brotli 套件，沒有安裝時只產生 .gz)，服務直接回傳壓縮好的檔案。
+3. 將 index.html 中的資源路徑改為雜湊後的檔名，並注入 window.ASSET_MANIFEST 供 index.js 載入語系檔與圖片。
+4. 寫入 manifest.json：原始檔名與雜湊檔名的對應、每個檔案的 ETag 與可用的壓縮格式，以及來源檔案的摘要。
+
+服務啟動時若 dist/ 不存在或來源檔案已變更會自動重新建置 (ensure_built)，也可以在部署前手動執行。
+舊的雜湊檔案會保留，已載入舊版 index.html 的頁面仍可取得對應的資源；加上 --clean 會先清空輸出目錄。
+
+用法:
+    python build_static.py
+    python build_static.py --output dist --clean
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件
+    brotli = None
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+ASSETS_DIR = "assets"
+HTML_ENTRY = "index.html"
+SOURCE_PATTERNS = ["style.css", "index.js", "locales/*.json", "school_logo.ico", "school_logo.png"]
+# 只給伺服器使用的檔案 (寒暄回覆範本)
+SERVER_ONLY_FILES = {"locales/small_talk.json"}
+# 已經壓縮過的格式 (png) 再壓縮沒有效果
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".json", ".html", ".ico", ".svg"}
+MIN_COMPRESS_BYTES = 256
+# Accept-Encoding 的名稱 -> 壓縮檔副檔名；依偏好排序
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+_ASSET_ATTR_RE = re.compile(r'(?P<attr>href|src)="/?(?P<path>[^"#?]+)"')
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def source_files(root: str) -> list[str]:
+    """要建置的來源檔案 (相對於 root，使用 / 分隔)"""
+    files = set()
+    for pattern in SOURCE_PATTERNS:
+        for path in glob.glob(os.path.join(root, pattern)):
+            files.add(os.path.relpath(path, root).replace(os.sep, "/"))
+    return sorted(files - SERVER_ONLY_FILES)
+
+
+def source_digest(root: str) -> str:
+    """來源檔案 (含 index.html) 與建置設定的摘要，用來判斷 dist/ 是否需要重新建置"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([FORMAT_VERSION, SOURCE_PATTERNS, brotli is not None]).encode("utf-8"))
+    for rel_path in [*source_files(root), HTML_ENTRY]:
+        digest.update(rel_path.encode("utf-8"))
+        with open(os.path.join(root, rel_path), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def hashed_name(rel_path: str, data: bytes) -> str:
+    stem, suffix = os.path.splitext(rel_path)
+    return f"{ASSETS_DIR}/{stem}.{content_hash(data)}{suffix}"
+
+
+def compress(data: bytes) -> dict[str, bytes]:
+    """回傳比原始檔案小的壓縮版本 {encoding: 壓縮後的內容}"""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def rewrite_html(html: str, assets: dict[str, str]) -> str:
+    """將 href / src 中的原始檔名換成雜湊檔名，並在 </head> 前注入資源對應表"""
+    def replace(match):
+        target = assets.get(match.group("path"))
+        return f'{match.group("attr")}="/{target}"' if target else match.group(0)
+
+    html = _ASSET_ATTR_RE.sub(replace, html)
+    manifest_script = f"<script>window.ASSET_MANIFEST = {json.dumps(assets, ensure_ascii=False)};</script>\n"
+    return html.replace("</head>", manifest_script + "</head>", 1)
+
+
+def _write(path: str, data: bytes):
+    """先寫暫存檔再 os.replace，執行中的服務不會讀到寫到一半的檔案"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _emit(output: str, rel_path: str, data: bytes, files: dict):
+    """寫入檔案與壓縮版本，並在 files 記錄 ETag 與可用的壓縮格式"""
+    _write(os.path.join(output, rel_path), data)
+    encodings = []
+    if os.path.splitext(rel_path)[1] in COMPRESSIBLE_SUFFIXES and len(data) >= MIN_COMPRESS_BYTES:
+        for encoding, body in compress(data).items():
+            _write(os.path.join(output, rel_path + ENCODINGS[encoding]), body)
+            encodings.append(encoding)
+    files[rel_path] = {"etag": content_hash(data), "size": len(data), "encodings": sorted(encodings)}
+
+
+def build(root: str = ".", output: str = "dist", clean: bool = False) -> dict:
+    if clean and os.path.isdir(output):
+        shutil.rmtree(output)
+    if brotli is None:
+        print("⚠️ 未安裝 brotli 套件，只產生 gzip 壓縮檔 (pip install brotli)")
+
+    assets, files = {}, {}
+    for rel_path in source_files(root):
+        with open(os.path.join(root, rel_path), "rb") as f:
+            data = f.read()
+        assets[rel_path] = hashed_name(rel_path, data)
+        _emit(output, assets[rel_path], data, files)
+
+    with open(os.path.join(root, HTML_ENTRY), "r", encoding="utf-8") as f:
+        html = rewrite_html(f.read(), assets)
+    _emit(output, HTML_ENTRY, html.encode("utf-8"), files)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "source_digest": source_digest(root),
+        "assets": assets,
+        "files": files,
+    }
+    # manifest 最後寫入：中途失敗時下次啟動會重新建置
+    _write(os.path.join(output, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+
+def load_manifest(output: str) -> dict | None:
+    try:
+        with open(os.path.join(output, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return manifest if manifest.get("format_version") == FORMAT_VERSION else None
+
+
+def ensure_built(root: str = ".", output: str = "dist") -> dict:
+    """dist/ 不存在或來源檔案已變更時重新建置，回傳 manifest"""
+    manifest = load_manifest(output)
+    if manifest is not None and manifest.get("source_digest") == source_digest(root):
+        return manifest
+    print(f"--- [Static] 建置前端靜態檔案到 {output}/ ---")
+    return build(root, output)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the frontend assets.")
+    parser.add_argument("--root", default=".", help="來源檔案所在目錄")
+    parser.add_argument("--output", default="dist", help="輸出目錄")
+    parser.add_argument("--clean", action="store_true", help="先清空輸出目錄 (移除舊版本的雜湊檔案)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    manifest = build(args.root, args.output, clean=args.clean)
+    for rel_path, info in sorted(manifest["files"].items()):
+        encodings = ", ".join(info["encodings"]) or "-"
+        print(f"  {rel_path:<48} {info['size']:>8} bytes  壓縮: {encodings}")
+    print(f"已建置 {len(manifest['files'])} 個檔案到 {args.output}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Markdown 結構感知的切塊器。
+
+先依標題 (ATX `#` 與 setext `---` / `===`) 分段，再以段落與清單項目為單位組成區塊，
+最後依 chunk_size 打包；只有單一區塊超過 chunk_size 時才退回 RecursiveCharacterTextSplitter (含 overlap)。
+每個 chunk 附上 section_path (例如 "學生清寒獎助金 > 應繳文件")。
+
+多個檔案以 process pool 平行切塊，依檔案順序以 generator 逐筆產生 chunk，供 embedding 階段串流處理。
+"""
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+SECTION_SEPARATOR = " > "
+
+_ATX_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_SETEXT_UNDERLINE_RE = re.compile(r"^\s*(=+|-+)\s*$")
+_LIST_ITEM_RE = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+")
+_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+
+
+def _clean_heading(text: str) -> str:
+    """去掉標題中的連結網址、粗體符號與結尾冒號"""
+    text = _LINK_RE.sub(r"\1", text)
+    text = text.replace("**", "").replace("__", "")
+    return text.strip().rstrip(":：").strip()
+
+
+def _split_sections(text: str) -> list[tuple[list[str], list[str], int]]:
+    """依標題切成 [(heading_path, lines, heading_line_count)]，標題行本身保留在該段落的開頭"""
+    sections = []
+    path: list[tuple[int, str]] = []
+    lines: list[str] = []
+    heading_line_count = 0
+
+    def start_section(level: int, title: str, heading_lines: list[str]):
+        nonlocal lines, heading_line_count
+        if any(line.strip() for line in lines):
+            sections.append(([t for _, t in path], lines, heading_line_count))
+        while path and path[-1][0] >= level:
+            path.pop()
+        path.append((level, title))
+        lines = list(heading_lines)
+        heading_line_count = len(heading_lines)
+
+    raw_lines = text.splitlines()
+    i = 0
+    in_code = False
+    while i < len(raw_lines):
+        line = raw_lines[i]
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        if not in_code:
+            atx = _ATX_HEADING_RE.match(line)
+            if atx:
+                start_section(len(atx.group(1)), _clean_heading(atx.group(2)), [line])
+                i += 1
+                continue
+            # setext 標題：文字行的下一行是 === 或 ---
+            next_line = raw_lines[i + 1] if i + 1 < len(raw_lines) else ""
+            if line.strip() and not _LIST_ITEM_RE.match(line) and _SETEXT_UNDERLINE_RE.match(next_line):
+                level = 1 if next_line.strip().startswith("=") else 2
+                start_section(level, _clean_heading(line), [line, next_line])
+                i += 2
+                continue
+        lines.append(line)
+        i += 1
+
+    if any(line.strip() for line in lines):
+        sections.append(([t for _, t in path], lines, heading_line_count))
+    return sections
+
+
+def _split_blocks(lines: list[str]) -> list[str]:
+    """
+    將段落切成區塊：空行分隔段落；清單以最外層項目為單位，縮排的子項目與續行跟著所屬項目。
+    """
+    blocks = []
+    current: list[str] = []
+    list_indent = None
+
+    def flush():
+        nonlocal current
+        block = "\n".join(current).strip("\n")
+        if block.strip():
+            blocks.append(block)
+        current = []
+
+    for line in lines:
+        if not line.strip():
+            if list_indent is None:
+                flush()
+            else:
+                current.append(line)
+            continue
+
+        item = _LIST_ITEM_RE.match(line)
+        indent = len(line) - len(line.lstrip())
+        if item and (list_indent is None or indent <= list_indent):
+            # 新的最外層清單項目
+            flush()
+            list_indent = indent
+        elif list_indent is not None and indent <= list_indent and not item:
+            # 沒有縮排的一般文字，清單結束
+            flush()
+            list_indent = None
+        current.append(line)
+    flush()
+    return blocks
+
+
+def _section_blocks(lines: list[str], heading_line_count: int) -> list[str]:
+    """段落的區塊；標題後面接空行時標題會自成一個區塊，將它併入第一個內容區塊，標題不會與內容分開"""
+    blocks = _split_blocks(lines)
+    heading = "\n".join(lines[:heading_line_count]).strip("\n")
+    if heading_line_count and len(blocks) > 1 and blocks[0] == heading:
+        blocks[:2] = [f"{blocks[0]}\n\n{blocks[1]}"]
+    return blocks
+
+
+def _common_path(paths: list[list[str]]) -> list[str]:
+    common = paths[0]
+    for path in paths[1:]:
+        size = 0
+        while size < min(len(common), len(path)) and common[size] == path[size]:
+            size += 1
+        common = common[:size]
+    return common
+
+
+def split_markdown(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[dict]:
+    """
+    將 markdown 切成 [{"text", "section_path"}]。
+    相鄰的小段落會合併到同一個 chunk，section_path 為這些段落共同的標題路徑；
+    放不進目前 chunk 剩餘空間的段落從新的 chunk 開始，不會被拆到前一個 chunk 的結尾。
+    """
+    fallback = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    pending: list[str] = []
+    pending_paths: list[list[str]] = []
+    pending_size = 0
+
+    def flush():
+        nonlocal pending, pending_paths, pending_size
+        if pending:
+            chunks.append({
+                "text": "\n\n".join(pending).strip(),
+                "section_path": SECTION_SEPARATOR.join(_common_path(pending_paths)),
+            })
+        pending, pending_paths, pending_size = [], [], 0
+
+    for path, lines, heading_line_count in _split_sections(text):
+        blocks = _section_blocks(lines, heading_line_count)
+        section_size = sum(len(block) for block in blocks) + 2 * (len(blocks) - 1)
+        if pending and pending_size + 2 + section_size > chunk_size:
+            flush()
+        for block in blocks:
+            if len(block) > chunk_size:
+                flush()
+                for piece in fallback.split_text(block):
+                    if piece.strip():
+                        chunks.append({"text": piece.strip(), "section_path": SECTION_SEPARATOR.join(path)})
+                continue
+            # 加上分隔的兩個換行
+            added = len(block) + (2 if pending else 0)
+            if pending_size + added > chunk_size:
+                flush()
+                added = len(block)
+            pending.append(block)
+            pending_paths.append(path)
+            pending_size += added
+    flush()
+    return chunks
+
+
+def chunk_file(file_path: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[dict]:
+    """讀取並切割單一檔案 (在 worker process 中執行)"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return [
+        {
+            "source_file": os.path.basename(file_path),
+            "source_path": file_path,
+            "chunk_index": index,
+            **chunk,
+        }
+        for index, chunk in enumerate(split_markdown(text, chunk_size, chunk_overlap))
+    ]
+
+
+def iter_chunks(file_paths, chunk_size: int = 1000, chunk_overlap: int = 200, workers: int | None = None):
+    """
+    依檔案順序逐筆產生 chunk。
+    workers > 1 時以 process pool 平行切塊，同時最多只有 workers * 4 個檔案在處理或等待輸出，記憶體用量固定。
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for file_path in file_paths:
+            yield from chunk_file(file_path, chunk_size, chunk_overlap)
+        return
+
+    window = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = deque()
+        for file_path in file_paths:
+            futures.append(pool.submit(chunk_file, file_path, chunk_size, chunk_overlap))
+            if len(futures) >= window:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+def collection_identity(info: dict) -> str:
+    """describe_collection 結果中代表 collection 本身的部分：重新建立時改變，寫入資料時不變"""
+    return f"{info.get('collection_id')}:{info.get('created_timestamp')}"
+
+
+def identity_of(version: str | None) -> str | None:
+    """由 CollectionVersion.get() 的版本取出 collection_identity (去掉資料筆數)"""
+    return version.rsplit(":", 1)[0] if version else None
+
+
+class CollectionVersion:
+    """
+    Milvus collection 的版本標記，用來判斷預先計算或快取的結果是否仍然有效。
+    ingest 會重新建立 collection (collection_id 改變)，續傳或 upsert 則會改變資料筆數，兩者都會產生新的版本。
+    describe_collection 是網路呼叫，結果快取 ttl_seconds 秒；查詢失敗時回傳 None，呼叫端應視為無法確認版本。
+    """
+
+    def __init__(self, client, collection_name: str, ttl_seconds: float):
+        self.client = client
+        self.collection_name = collection_name
+        self.ttl_seconds = ttl_seconds
+        self._version: str | None = None
+        self._fetched_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self) -> str | None:
+        """回傳目前的版本 (同步呼叫，請在 asyncio.to_thread 中執行)"""
+        with self._lock:
+            if time.monotonic() - self._fetched_at < self.ttl_seconds:
+                return self._version
+            try:
+                info = self.client.describe_collection(collection_name=self.collection_name)
+                stats = self.client.get_collection_stats(collection_name=self.collection_name)
+                self._version = f"{collection_identity(info)}:{stats.get('row_count')}"
+            except Exception as e:
+                print(f"⚠️ 無法取得 collection 版本: {e}")
+                self._version = None
+            self._fetched_at = time.monotonic()
+            return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = float("-inf")
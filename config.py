@@ -7,16 +7,118 @@ load_dotenv()
 # --- OpenAI ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
+# 每個階段的候選模型 (以逗號分隔，例如 ANSWER_MODELS=gpt-4o-mini,gpt-4.1-mini)，未設定時使用 OPENAI_MODEL_NAME
+# model_router 依最近的延遲與錯誤率在候選中選擇
+STAGE_MODELS = {
+    stage: [model.strip() for model in os.getenv(f"{stage.upper()}_MODELS", OPENAI_MODEL_NAME).split(",") if model.strip()]
+    for stage in ("rephrase", "intent", "filter", "answer", "small_talk", "summary")
+}
+MODEL_ROUTER_WINDOW = int(os.getenv("MODEL_ROUTER_WINDOW", "50"))
+MODEL_ROUTER_MIN_SAMPLES = int(os.getenv("MODEL_ROUTER_MIN_SAMPLES", "5"))
+MODEL_ROUTER_MAX_ERROR_RATE = float(os.getenv("MODEL_ROUTER_MAX_ERROR_RATE", "0.2"))
+MODEL_ROUTER_EXPLORE_RATIO = float(os.getenv("MODEL_ROUTER_EXPLORE_RATIO", "0.05"))
+MODEL_ROUTER_COOLDOWN_SECONDS = float(os.getenv("MODEL_ROUTER_COOLDOWN_SECONDS", "30"))
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# 向量維度與儲存精度 (float32 / float16 / int8)，ingest 與查詢必須使用相同設定
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+VECTOR_PRECISION = os.getenv("VECTOR_PRECISION", "float32")
 
 # --- Zilliz / Milvus ---
 ZILLIZ_API_KEY = os.getenv("ZILLIZ_API_KEY")
 CLUSTER_ENDPOINT = os.getenv("CLUSTER_ENDPOINT")
 MILVUS_COLLECTION = os.getenv("MILVUS_COLLECTION", "rag5_scholarships_hybrid_bm25")
+# index_sweep.py 產生的索引與搜尋參數，檔案不存在時使用預設值 (AUTOINDEX / DAAT_MAXSCORE)
+MILVUS_INDEX_CONFIG = os.getenv("MILVUS_INDEX_CONFIG", "index_config.json")
+# 正式環境的 Milvus 部署 (zilliz-serverless 或 milvus)，決定可使用的索引類型
+MILVUS_INDEX_TARGET = os.getenv("MILVUS_INDEX_TARGET", "zilliz-serverless")
+# ingest 腳本寫入的 partition 配置 (partition key 維度與各 partition 的值)，檔案不存在時搜尋全部 partition
+MILVUS_PARTITION_LAYOUT = os.getenv("MILVUS_PARTITION_LAYOUT", "partition_layout.json")
+
+# collection 版本 (describe_collection) 的快取秒數；重新 ingest 後最多經過這段時間，預先計算或快取的結果才會失效
+COLLECTION_VERSION_TTL_SECONDS = float(os.getenv("COLLECTION_VERSION_TTL_SECONDS", "60"))
+
+# --- Retrieval Cache ---
+# 相同問題、過濾條件與 top_k 的檢索結果快取 (略過 embedding 與 Milvus 檢索)
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1000"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "600"))
+
+# --- Hedged Requests (問題重構 / 意圖分類 / 過濾條件擷取) ---
+# 在最近延遲的 HEDGE_PERCENTILE 內沒有回應時加送一個相同的請求，採用先完成的結果
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "100"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "3000"))
+# 延遲樣本少於 HEDGE_MIN_SAMPLES 時使用的等待時間
+HEDGE_INITIAL_DELAY_MS = float(os.getenv("HEDGE_INITIAL_DELAY_MS", "1000"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# 最近 HEDGE_WINDOW 次呼叫中最多有這個比例加送 hedge
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+# --- Deadline (到開始生成回答的時間預算) ---
+# 每個請求從收到問題到開始生成回答的時間上限 (毫秒)，0 表示不限制
+CHAT_DEADLINE_MS = float(os.getenv("CHAT_DEADLINE_MS", "6000"))
+# 保留給生成回答 (首個 token) 的時間；其他階段的呼叫最多執行到只剩這段時間
+DEADLINE_ANSWER_RESERVE_MS = float(os.getenv("DEADLINE_ANSWER_RESERVE_MS", "1500"))
+# 檢索之前的 LLM 呼叫 (重構、意圖、過濾條件) 另外保留給 embedding 與檢索的時間
+DEADLINE_RETRIEVAL_RESERVE_MS = float(os.getenv("DEADLINE_RETRIEVAL_RESERVE_MS", "800"))
+# 剩餘時間低於門檻時依序降級：略過問題重構 -> 略過 LLM 過濾條件 -> 只做 dense 檢索 -> 縮小 top_k
+DEADLINE_REPHRASE_MIN_MS = float(os.getenv("DEADLINE_REPHRASE_MIN_MS", "5000"))
+DEADLINE_FILTER_MIN_MS = float(os.getenv("DEADLINE_FILTER_MIN_MS", "3500"))
+DEADLINE_HYBRID_MIN_MS = float(os.getenv("DEADLINE_HYBRID_MIN_MS", "2500"))
+DEADLINE_FULL_TOP_K_MIN_MS = float(os.getenv("DEADLINE_FULL_TOP_K_MIN_MS", "2000"))
+DEADLINE_REDUCED_TOP_K = int(os.getenv("DEADLINE_REDUCED_TOP_K", "3"))
+
+# --- Small Talk ---
+# 寒暄、道謝等訊息以 locales/small_talk.json 的範本在本地回覆，不呼叫 LLM
+SMALL_TALK_ENABLED = os.getenv("SMALL_TALK_ENABLED", "true").lower() in ("1", "true", "yes")
+SMALL_TALK_FILE = os.getenv("SMALL_TALK_FILE", "locales/small_talk.json")
+
+# --- FAQ (build_faq_store.py 預先計算的常見問題答案) ---
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "true").lower() in ("1", "true", "yes")
+FAQ_STORE_FILE = os.getenv("FAQ_STORE_FILE", "faq_store.json")
+# 多久檢查一次 FAQ 檔案是否更新 (秒)
+FAQ_RELOAD_SECONDS = float(os.getenv("FAQ_RELOAD_SECONDS", "30"))
+
+# --- Admission Control (/chat) ---
+# 同時執行的 pipeline 上限，以及等待佇列的總上限與每個 client 的上限
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "50"))
+CHAT_MAX_QUEUE_PER_CLIENT = int(os.getenv("CHAT_MAX_QUEUE_PER_CLIENT", "3"))
+# 排隊中的 client 多久收到一次排隊位置更新 (秒)
+CHAT_QUEUE_UPDATE_SECONDS = float(os.getenv("CHAT_QUEUE_UPDATE_SECONDS", "1.0"))
+
+# --- SSE Streaming (/chat) ---
+# 合併連續的 token：第一段文字最多等待的秒數與單一 frame 的字數上限
+SSE_COALESCE_SECONDS = float(os.getenv("SSE_COALESCE_SECONDS", "0.05"))
+SSE_COALESCE_MAX_CHARS = int(os.getenv("SSE_COALESCE_MAX_CHARS", "200"))
+# 沒有任何輸出超過這個秒數時送出 keep-alive 註解
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "10"))
+# 瀏覽器支援時以 gzip 壓縮串流；若前方的 proxy 已經壓縮，請保持關閉
+SSE_GZIP = os.getenv("SSE_GZIP", "false").lower() in ("1", "true", "yes")
+
+# --- Conversation Sessions ---
+# 對話歷史保存在伺服器端：閒置多久後清除 (秒)、最多保留的 session 數、每個 session 保留的輪數
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "4"))
+# 保存的回答最多幾個字 (有引用來源時改存來源名稱)
+SESSION_ANSWER_CHARS = int(os.getenv("SESSION_ANSWER_CHARS", "300"))
+# 未摘要的輪數達到這個數字時，在背景將較舊的輪次併入滾動摘要，只保留最後幾輪原文
+SESSION_SUMMARY_TRIGGER_TURNS = int(os.getenv("SESSION_SUMMARY_TRIGGER_TURNS", "3"))
+SESSION_SUMMARY_KEEP_TURNS = int(os.getenv("SESSION_SUMMARY_KEEP_TURNS", "1"))
 
 # --- Line Bot ---
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+# Webhook 事件先排入佇列再由背景 worker 處理
+LINE_WORKERS = int(os.getenv("LINE_WORKERS", "4"))
+LINE_QUEUE_MAXSIZE = int(os.getenv("LINE_QUEUE_MAXSIZE", "100"))
+# LINE 重送事件的去重視窗 (秒)
+LINE_DEDUP_TTL_SECONDS = float(os.getenv("LINE_DEDUP_TTL_SECONDS", "600"))
+# 關閉服務時等待佇列中 (已回應 200、LINE 不會重送) 的事件處理完的最長秒數
+LINE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("LINE_DRAIN_TIMEOUT_SECONDS", "30"))
 
 # --- PostgreSQL Database ---
 DB_TABLE_NAME = os.getenv("DB_TABLE_NAME", "qa_logs2")
@@ -32,6 +134,10 @@ CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "http://localhost:8000,
 # 將字串轉換為列表
 ALLOWED_ORIGINS_LIST = [origin.strip() for origin in CORS_ALLOWED_ORIGINS.split(',')]
 
+# --- Static Files ---
+# build_static.py 輸出的目錄 (雜湊檔名 + 預先壓縮)；服務啟動時若不存在或來源已變更會自動建置
+STATIC_DIST_DIR = os.getenv("STATIC_DIST_DIR", "dist")
+
 # 簡單檢查以確保關鍵環境變數已設定
 if not OPENAI_API_KEY or not ZILLIZ_API_KEY or not CLUSTER_ENDPOINT:
     raise ValueError("遺失關鍵環境變數： OPENAI_API_KEY, ZILLIZ_API_KEY, 或 CLUSTER_ENDPOINT 必須被設定。")
@@ -48,13 +48,21 @@ def create_database_and_table():
             completion_tokens INTEGER,
             total_tokens INTEGER,
             feedback_type TEXT,
-            feedback_text TEXT
+            feedback_text TEXT,
+            degradations JSONB, -- Deadline degradations applied to this request
+            stage_models JSONB -- Model and latency used by each LLM stage
         );
         """).format(table=sql.Identifier(TABLE_NAME))
 
         # Execute the SQL statement
         cursor.execute(create_table_query)
 
+        # Tables created before these columns existed need them added
+        for column in ("degradations", "stage_models"):
+            cursor.execute(sql.SQL(
+                "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} JSONB;"
+            ).format(table=sql.Identifier(TABLE_NAME), column=sql.Identifier(column)))
+
         # Commit the changes
         conn.commit()
         print(f"Database '{DB_NAME}' and table '{TABLE_NAME}' are set up successfully in PostgreSQL.")
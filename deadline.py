@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import config
+
+# 依序套用的降級：剩餘時間越少，越多項被套用 (門檻由大到小)
+SKIP_REPHRASE = "skip_rephrase"
+SKIP_FILTER = "skip_filter"
+DENSE_ONLY = "dense_only"
+REDUCED_TOP_K = "reduced_top_k"
+DEGRADATION_ORDER = (SKIP_REPHRASE, SKIP_FILTER, DENSE_ONLY, REDUCED_TOP_K)
+# 執行中的階段逾時 (不在上面的順序中，逾時當下才記錄)
+INTENT_TIMEOUT = "intent_timeout"
+SEARCH_TIMEOUT = "search_timeout"
+
+
+class Deadline:
+    """
+    單一請求到開始生成回答 (第一個 token) 的時間預算。
+    每個階段開始前以 degrade() 檢查剩餘時間是否達到該階段的門檻，不足時套用對應的降級：
+    略過問題重構 -> 略過 LLM 過濾條件擷取 (不過濾) -> 只做 dense 檢索 -> 縮小 top_k。
+    執行中的呼叫以 run() 限制在保留給後續階段的時間之前結束，逾時同樣記錄為降級。
+    套用過的降級記錄在 degradations，寫入問答紀錄。
+    """
+
+    def __init__(self, budget_ms: float, answer_reserve_ms: float, retrieval_reserve_ms: float,
+                 thresholds_ms: dict[str, float]):
+        self.budget_ms = budget_ms
+        self.answer_reserve_ms = answer_reserve_ms
+        self.retrieval_reserve_ms = retrieval_reserve_ms
+        self.thresholds_ms = thresholds_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+        self.degradations: list[str] = []
+
+    @classmethod
+    def from_config(cls) -> "Deadline | None":
+        """CHAT_DEADLINE_MS 為 0 時不限制時間"""
+        if config.CHAT_DEADLINE_MS <= 0:
+            return None
+        return cls(
+            config.CHAT_DEADLINE_MS,
+            config.DEADLINE_ANSWER_RESERVE_MS,
+            config.DEADLINE_RETRIEVAL_RESERVE_MS,
+            {
+                SKIP_REPHRASE: config.DEADLINE_REPHRASE_MIN_MS,
+                SKIP_FILTER: config.DEADLINE_FILTER_MIN_MS,
+                DENSE_ONLY: config.DEADLINE_HYBRID_MIN_MS,
+                REDUCED_TOP_K: config.DEADLINE_FULL_TOP_K_MIN_MS,
+            },
+        )
+
+    def fork(self) -> "Deadline":
+        """相同期限、獨立降級紀錄的 Deadline (給與其他請求共用的 single-flight pipeline)"""
+        child = Deadline(self.budget_ms, self.answer_reserve_ms, self.retrieval_reserve_ms, self.thresholds_ms)
+        child.expires_at = self.expires_at
+        return child
+
+    def remaining_ms(self) -> float:
+        return (self.expires_at - time.monotonic()) * 1000
+
+    def record(self, degradation: str):
+        if degradation not in self.degradations:
+            self.degradations.append(degradation)
+            print(f"⏳ 時間預算不足，降級: {degradation} (剩餘 {self.remaining_ms():.0f} ms)")
+
+    def degrade(self, degradation: str) -> bool:
+        """剩餘時間低於 degradation 的門檻時記錄並回傳 True (呼叫端應略過或簡化該階段)"""
+        if self.remaining_ms() < self.thresholds_ms[degradation]:
+            self.record(degradation)
+            return True
+        return False
+
+    async def run(self, awaitable, degradation: str, before_retrieval: bool = True):
+        """
+        執行 awaitable，最多執行到只剩保留給後續階段的時間
+        (檢索之前的 LLM 呼叫保留檢索與生成回答的時間，檢索本身只保留生成回答的時間)。
+        逾時時取消、記錄 degradation 並拋出 TimeoutError，由呼叫端改用降級的結果。
+        """
+        reserve_ms = self.answer_reserve_ms + (self.retrieval_reserve_ms if before_retrieval else 0)
+        timeout = max(0.0, self.remaining_ms() - reserve_ms) / 1000
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.record(degradation)
+            raise
+
+
+def degraded(deadline: Deadline | None, degradation: str) -> bool:
+    """沒有 deadline 時永遠不降級"""
+    return deadline is not None and deadline.degrade(degradation)
+
+
+async def bounded(deadline: Deadline | None, awaitable, degradation: str, before_retrieval: bool = True):
+    """有 deadline 時以 Deadline.run 限制執行時間，否則直接等待"""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, degradation, before_retrieval=before_retrieval)
+
+
+def merge_degradations(*lists) -> list[str]:
+    """合併多個降級清單 (例如請求本身與共用的 single-flight)，依 DEGRADATION_ORDER 排序並去除重複"""
+    merged = []
+    for degradations in lists:
+        for degradation in degradations or []:
+            if degradation not in merged:
+                merged.append(degradation)
+    order = {name: index for index, name in enumerate(DEGRADATION_ORDER)}
+    return sorted(merged, key=lambda name: order.get(name, len(order)))
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+
+from normalization import normalize_question
+
+FORMAT_VERSION = 1
+
+_POLITE_PREFIXES = ("我想請問", "想請問", "請問", "我想問", "please tell me", "can you tell me", "could you tell me")
+_INNER_PUNCTUATION_RE = re.compile(r"[\s?？!！。.,，、~～:：;；\"'「」]+")
+# 常見的異體字與同義寫法
+_VARIANTS = (("甚麼", "什麼"), ("奬", "獎"), ("連絡", "聯絡"))
+
+
+def faq_key(question: str) -> str:
+    """
+    FAQ 比對用的 key：在 normalize_question 之外，再去掉開頭的客套語、句中的標點與空白，並統一常見異體字。
+    只合併寫法不同的同一個問題，語意相近但文字不同的問題由 build_faq_store.py 在建立時分群。
+    """
+    key = normalize_question(question)
+    for prefix in _POLITE_PREFIXES:
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+            break
+    for old, new in _VARIANTS:
+        key = key.replace(old, new)
+    return _INNER_PUNCTUATION_RE.sub("", key)
+
+
+def write_store(path: str, collection_version: str, entries: list[dict]):
+    """寫入 FAQ 檔案 (先寫暫存檔再 os.replace，執行中的服務不會讀到寫到一半的檔案)"""
+    data = {
+        "format_version": FORMAT_VERSION,
+        "collection_version": collection_version,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "entries": entries,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class FaqStore:
+    """
+    預先計算的常見問題答案 (由 build_faq_store.py 產生)。
+    每筆答案記錄建立時的 collection 版本，版本不同 (重新 ingest 後) 的答案不會被使用。
+    檔案更新後會在 reload_seconds 內自動重新載入 (refresh，在 thread 中讀檔)，不需要重新啟動服務。
+    """
+
+    def __init__(self, path: str, reload_seconds: float = 30.0):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.collection_version: str | None = None
+        self._index: dict[tuple[str, str], dict] = {}
+        self._mtime = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "stale": 0, "reloads": 0}
+
+    async def refresh(self):
+        """到了檢查時間時在 thread 中檢查檔案並重新載入，不阻塞 event loop"""
+        if time.monotonic() - self._checked_at >= self.reload_seconds:
+            await asyncio.to_thread(self._maybe_reload)
+
+    def get(self, question: str, lang: str) -> dict | None:
+        """以正規化後的問題查詢，回傳 entry (尚未檢查 collection 版本)；不讀檔，檔案更新由 refresh 處理"""
+        self._counters["lookups"] += 1
+        return self._index.get((lang, faq_key(question)))
+
+    def is_current(self, collection_version: str | None) -> bool:
+        """FAQ 是否與目前的 collection 版本一致；版本無法確認時視為不一致"""
+        return collection_version is not None and collection_version == self.collection_version
+
+    def record(self, hit: bool):
+        """記錄一次查到 entry 的結果：使用 (hit) 或因版本不一致而略過 (stale)"""
+        self._counters["hits" if hit else "stale"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len({id(entry) for entry in self._index.values()}),
+            "keys": len(self._index),
+            "collection_version": self.collection_version,
+            **self._counters,
+        }
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._index, self.collection_version, self._mtime = {}, None, None
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 無法載入 FAQ 檔案 {self.path}: {e}")
+                return
+            if data.get("format_version") != FORMAT_VERSION:
+                print(f"⚠️ FAQ 檔案格式版本不符，略過: {self.path}")
+                return
+
+            index = {}
+            for entry in data.get("entries", []):
+                lang = entry.get("lang", "zh")
+                key = faq_key(entry["question"])
+                index.setdefault((lang, key), entry)
+                # 語意相近但 faq_key 不同的問題可能是不同的問題 (「低收入戶」與「中低收入戶」)，
+                # 只接受建立時以檢索結果確認過的寫法
+                for variant in entry.get("verified_variants", []):
+                    index.setdefault((lang, faq_key(variant)), entry)
+            self._index = index
+            self.collection_version = data.get("collection_version")
+            self._mtime = mtime
+            self._counters["reloads"] += 1
+            print(f"--- [FAQ] 載入 {len(data.get('entries', []))} 筆預先計算的答案 (collection 版本 {self.collection_version}) ---")
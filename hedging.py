@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+
+import config
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class HedgedCaller:
+    """
+    對小型、可重複送出的 LLM 呼叫 (問題重構、意圖分類、過濾條件擷取) 做 hedged request。
+    第一個請求在最近延遲的 percentile 內沒有回應時，送出第二個相同的請求，採用先完成的結果並取消另一個。
+    hedge 的比例以最近 window 次呼叫計算，超過 max_ratio 時不再加送 (provider 整體變慢時避免流量加倍)。
+    任一請求失敗時等待另一個請求，兩個都失敗才拋出例外。
+    """
+
+    def __init__(self, name: str, enabled: bool = True, percentile: float = 95.0, min_delay_ms: float = 100.0,
+                 max_delay_ms: float = 3000.0, initial_delay_ms: float = 1000.0, max_ratio: float = 0.1,
+                 window: int = 200, min_samples: int = 20):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.initial_delay_ms = initial_delay_ms
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        # 每個完成的請求各自的延遲 (毫秒)
+        self._latencies_ms: deque[float] = deque(maxlen=window)
+        # 最近 window 次呼叫是否送出 hedge
+        self._recent_hedges: deque[bool] = deque(maxlen=window)
+        self._counters = {"calls": 0, "hedges_fired": 0, "hedges_won": 0, "hedges_suppressed": 0, "errors": 0}
+
+    def hedge_delay_ms(self) -> float:
+        """送出 hedge 前等待的時間：最近延遲的 percentile，樣本不足時使用 initial_delay_ms"""
+        if len(self._latencies_ms) < self.min_samples:
+            return self.initial_delay_ms
+        delay = _percentile(self._latencies_ms, self.percentile)
+        return min(self.max_delay_ms, max(self.min_delay_ms, delay))
+
+    def _hedge_allowed(self) -> bool:
+        hedges = sum(self._recent_hedges)
+        return hedges + 1 <= max(1.0, self.max_ratio * len(self._recent_hedges))
+
+    async def _timed(self, factory, record_cancelled: bool = False):
+        """
+        執行並記錄延遲。record_cancelled 時被取消的請求 (輸給 hedge 的慢請求) 也記錄已經花費的時間，
+        作為延遲的下限；否則延遲分佈只剩較快的結果，hedge 的等待時間會越來越短。
+        """
+        start = time.perf_counter()
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            if record_cancelled:
+                self._latencies_ms.append((time.perf_counter() - start) * 1000)
+            raise
+        self._latencies_ms.append((time.perf_counter() - start) * 1000)
+        return result
+
+    async def call(self, factory):
+        """
+        factory 為無參數、回傳 awaitable 的函式 (每次呼叫產生一個新的請求)。
+        回傳先完成的請求結果。
+        """
+        self._counters["calls"] += 1
+        if not self.enabled:
+            self._recent_hedges.append(False)
+            return await self._timed(factory)
+
+        # hedge 較晚送出，被取消時花費的時間不代表請求的延遲，只記錄 primary 的
+        primary = asyncio.create_task(self._timed(factory, record_cancelled=True))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay_ms() / 1000)
+            if done or not self._hedge_allowed():
+                if not done:
+                    self._counters["hedges_suppressed"] += 1
+                self._recent_hedges.append(False)
+                return await primary
+
+            self._recent_hedges.append(True)
+            self._counters["hedges_fired"] += 1
+            hedge = asyncio.create_task(self._timed(factory))
+            tasks.add(hedge)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._counters["hedges_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        except Exception:
+            self._counters["errors"] += 1
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        fired = self._counters["hedges_fired"]
+        calls = self._counters["calls"]
+        return {
+            "hedge_delay_ms": round(self.hedge_delay_ms(), 1),
+            "hedge_rate": fired / calls if calls else 0.0,
+            "win_rate": self._counters["hedges_won"] / fired if fired else 0.0,
+            "p50_ms": round(_percentile(self._latencies_ms, 50), 1) if self._latencies_ms else None,
+            "p99_ms": round(_percentile(self._latencies_ms, 99), 1) if self._latencies_ms else None,
+            **self._counters,
+        }
+
+
+_callers: dict[str, HedgedCaller] = {}
+
+
+def get_caller(name: str, model: str | None = None) -> HedgedCaller:
+    """
+    每個 (呼叫種類, 模型) 一個 HedgedCaller，設定來自 config。
+    model_router 會在同一個階段切換模型，不同模型的延遲分佈不能混在同一個 percentile 裡。
+    """
+    key = name if model is None else f"{name}/{model}"
+    caller = _callers.get(key)
+    if caller is None:
+        caller = _callers[key] = HedgedCaller(
+            key,
+            enabled=config.HEDGE_ENABLED,
+            percentile=config.HEDGE_PERCENTILE,
+            min_delay_ms=config.HEDGE_MIN_DELAY_MS,
+            max_delay_ms=config.HEDGE_MAX_DELAY_MS,
+            initial_delay_ms=config.HEDGE_INITIAL_DELAY_MS,
+            max_ratio=config.HEDGE_MAX_RATIO,
+            window=config.HEDGE_WINDOW,
+            min_samples=config.HEDGE_MIN_SAMPLES,
+        )
+    return caller
+
+
+def stats() -> dict:
+    return {name: caller.stats() for name, caller in _callers.items()}
@@ -14,9 +14,15 @@ const feedbackTextarea = document.getElementById('feedback-textarea');
 const languageSwitcher = document.getElementById('language-switcher');
 
 // --- State ---
-let chatHistory = [];
+let sessionId = null; // Conversation history is kept on the server under this id
 let currentFeedbackContext = {};
 let translations = {};
+// Fingerprinted asset names injected into index.html by build_static.py
+const assetManifest = window.ASSET_MANIFEST || {};
+
+function assetUrl(name) {
+    return '/' + (assetManifest[name] || name);
+}
 let currentLang = 'zh';
 
 console.log("index.js script loaded.");
@@ -25,7 +31,7 @@ console.log("index.js script loaded.");
 async function loadLanguage(lang) {
     console.log(`Attempting to load language: ${lang}`);
     try {
-        const response = await fetch(`/locales/${lang}.json`);
+        const response = await fetch(assetUrl(`locales/${lang}.json`));
         if (!response.ok) {
             console.error(`Could not load ${lang}.json. Status: ${response.status}`);
             return;
@@ -95,7 +101,6 @@ async function handleUserSubmit(e) {
     }
 
     addMessage(query, 'user');
-    chatHistory.push({ role: 'user', content: query });
     input.value = '';
     sendButton.disabled = true;
 
@@ -112,11 +117,18 @@ async function handleUserSubmit(e) {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 query: query,
-                history: chatHistory.slice(0, -1),
+                session_id: sessionId,
                 lang: currentLang 
             })
         });
 
+        if (response.status === 429) {
+            const retryAfter = response.headers.get('Retry-After') || '';
+            const busyMsg = (translations['busy_message'] || 'The service is busy right now. Please try again in {seconds} seconds.').replace('{seconds}', retryAfter);
+            const messageEl = document.getElementById(thinkingMessageId)?.querySelector('.bot-message');
+            if (messageEl) messageEl.innerHTML = busyMsg;
+            return;
+        }
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
 
         const reader = response.body.getReader();
@@ -125,25 +137,29 @@ async function handleUserSubmit(e) {
 
         while (true) {
             const { done, value } = await reader.read();
-            if (done) {
-                chatHistory.push({ role: 'assistant', content: fullAnswer });
-                break;
-            }
+            if (done) break;
 
             buffer += decoder.decode(value, { stream: true });
-            const lines = buffer.split('\n\n');
-            buffer = lines.pop(); // Keep the last, possibly incomplete, line
-
-            for (const line of lines) {
-                if (line.startsWith('event: end_stream')) {
-                    const dataLine = line.substring(line.indexOf('data: ') + 6);
-                    const eventData = JSON.parse(dataLine);
-                    const finalData = eventData.data;
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop(); // Keep the last, possibly incomplete, frame
+
+            for (const frame of frames) {
+                const sseEvent = parseSseFrame(frame);
+                if (!sseEvent) continue; // Keep-alive comment
+
+                if (sseEvent.event === 'queue') {
+                    const position = JSON.parse(sseEvent.data).data.position;
+                    const queueText = (translations['queue_message'] || 'Many people are asking right now, you are number {position} in line...').replace('{position}', position);
+                    const messageEl = document.getElementById(thinkingMessageId)?.querySelector('.bot-message');
+                    if (messageEl) messageEl.innerHTML = `<span class="thinking">${queueText}</span>`;
+                } else if (sseEvent.event === 'end_stream') {
+                    const finalData = JSON.parse(sseEvent.data).data;
+                    if (finalData.session_id) sessionId = finalData.session_id;
                     appendBotMessageAddons(thinkingMessageId, finalData.contexts, finalData.log_id);
-                } else if (line.startsWith('data:')) {
-                    const dataLine = line.substring(6);
-                    const eventData = JSON.parse(dataLine);
-                    const chunk = eventData.data;
+                } else if (sseEvent.event === 'error') {
+                    throw new Error('Server-side error during streaming.');
+                } else {
+                    const chunk = JSON.parse(sseEvent.data).data;
 
                     if (isFirstChunk) {
                         const messageEl = document.getElementById(thinkingMessageId)?.querySelector('.bot-message');
@@ -157,8 +173,6 @@ async function handleUserSubmit(e) {
                         messageEl.innerHTML = marked.parse(fullAnswer);
                         msgWindow.scrollTop = msgWindow.scrollHeight;
                     }
-                } else if (line.startsWith('event: error')) {
-                    throw new Error('Server-side error during streaming.');
                 }
             }
         }
@@ -171,17 +185,33 @@ async function handleUserSubmit(e) {
         if (messageEl) {
             messageEl.innerHTML = errorMsg;
         }
-        chatHistory.push({ role: 'assistant', content: errorMsg });
     } finally {
         input.focus();
     }
 }
 
+// Parses one SSE frame into { event, data }; returns null for comment-only frames (keep-alives)
+function parseSseFrame(frame) {
+    let event = 'message';
+    const dataLines = [];
+    for (const line of frame.split(/\r?\n/)) {
+        if (!line || line.startsWith(':')) continue;
+        const colon = line.indexOf(':');
+        const field = colon === -1 ? line : line.substring(0, colon);
+        let value = colon === -1 ? '' : line.substring(colon + 1);
+        if (value.startsWith(' ')) value = value.substring(1);
+        if (field === 'event') event = value;
+        else if (field === 'data') dataLines.push(value);
+    }
+    if (dataLines.length === 0) return null;
+    return { event, data: dataLines.join('\n') };
+}
+
 function handleClearChat() {
     msgWindow.innerHTML = '';
     const initialMessage = translations['initial_bot_message'] || 'Hello! How can I help you?';
     addMessage(initialMessage, 'bot');
-    chatHistory = [{'role': 'assistant', 'content': initialMessage}];
+    sessionId = null; // Start a new server-side conversation
     
     if (!msgWindow.querySelector('.example-questions-container')) {
         const exampleContainer = document.createElement('div');
@@ -227,7 +257,7 @@ function addMessage(text, sender, id = null) {
         contentWrapper.className = 'bot-message-content';
 
         const avatar = document.createElement('img');
-        avatar.src = 'school_logo.png';
+        avatar.src = assetUrl('school_logo.png');
         avatar.alt = 'School Logo';
         avatar.className = 'avatar';
 
@@ -0,0 +1,85 @@
+import json
+import os
+
+# 沒有 index_config.json 時沿用原本的設定
+DEFAULT_INDEX_CONFIG = {
+    "dense": {
+        "index_type": "AUTOINDEX",
+        "metric_type": "COSINE",
+        "params": {},
+        "search_params": {"nprobe": 10},
+    },
+    "sparse": {
+        "index_type": "SPARSE_INVERTED_INDEX",
+        "metric_type": "BM25",
+        "params": {"inverted_index_algo": "DAAT_MAXSCORE"},
+        "search_params": {},
+    },
+}
+
+# 正式環境可建立的 dense 索引類型 (None 表示不限制)；Zilliz Serverless 只支援 AUTOINDEX
+PRODUCTION_TARGETS = {
+    "zilliz-serverless": {"AUTOINDEX"},
+    "milvus": None,
+}
+DEFAULT_TARGET = "zilliz-serverless"
+
+
+def supports(target: str, index_type: str) -> bool:
+    allowed = PRODUCTION_TARGETS.get(target)
+    return allowed is None or index_type in allowed
+
+
+def for_target(index_config: dict, target: str) -> dict:
+    """
+    正式環境不支援設定中的 dense 索引類型時改用預設值 (AUTOINDEX)，
+    ingest 建立的索引與查詢時的搜尋參數 (例如 HNSW 的 ef) 才會一致。
+    """
+    if target not in PRODUCTION_TARGETS:
+        raise ValueError(f"Unknown Milvus target '{target}', expected one of {sorted(PRODUCTION_TARGETS)}")
+    dense = index_config["dense"]
+    if supports(target, dense["index_type"]):
+        return index_config
+    print(f"⚠️ {target} 不支援 {dense['index_type']} 索引，改用 {DEFAULT_INDEX_CONFIG['dense']['index_type']}")
+    return {**index_config, "dense": dict(DEFAULT_INDEX_CONFIG["dense"])}
+
+
+def load_index_config(path: str) -> dict:
+    """
+    讀取 index_sweep.py 產生的索引設定。
+    檔案不存在或格式錯誤時回傳預設值；檔案中缺少的欄位以預設值補齊。
+    """
+    index_config = {field: dict(values) for field, values in DEFAULT_INDEX_CONFIG.items()}
+    if not path or not os.path.exists(path):
+        return index_config
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ 無法讀取索引設定 '{path}'，改用預設值: {e}")
+        return index_config
+
+    for field in index_config:
+        index_config[field].update(loaded.get(field, {}))
+    return index_config
+
+
+def add_indexes(index_params, index_config: dict):
+    """依索引設定為 vector 與 text_sparse 欄位加入索引"""
+    dense = index_config["dense"]
+    index_params.add_index(
+        field_name="vector",
+        index_name="vector_index",
+        index_type=dense["index_type"],
+        metric_type=dense["metric_type"],
+        params=dense["params"],
+    )
+    sparse = index_config["sparse"]
+    index_params.add_index(
+        field_name="text_sparse",
+        index_name="text_sparse_index",
+        index_type=sparse["index_type"],
+        metric_type=sparse["metric_type"],
+        params=sparse["params"],
+    )
+    return index_params
@@ -0,0 +1,440 @@
+"""
+Milvus 索引類型與參數掃描工具。
+
+將正式 collection 的資料複製到測試用的 Milvus (預設為本機 standalone，Zilliz Serverless 只支援 AUTOINDEX)，
+為每個索引設定各建一個 collection 副本，並以問答紀錄中的問題量測：
+  - dense：與 numpy 暴力搜尋 (精確 cosine) 相比的 recall@k
+  - sparse：與 TAAT_NAIVE (窮舉計分，結果精確) 相比的 recall@k
+  - 在指定並行度下的延遲分佈 (p50 / p95 / p99) 與 QPS
+最後在正式環境支援的索引類型中 (--production-target，Zilliz Serverless 只有 AUTOINDEX)
+選出 recall 達標且 p95 最低的設定，寫入 index_config.json，供 ingest 腳本與 answer.py 使用；
+其他索引類型的量測結果只列在報告中，作為改用自架 Milvus 時的參考。
+
+另外比較不同的向量表示 (維度 x 精度，例如 float16:1536、int8:1536、float32:512)：
+以截短 + 重新正規化模擬較短的 text-embedding-3 向量，與目前 float32-1536 的精確結果比較 recall、
+延遲、每個向量的大小與每次查詢送出的資料量。選定後以 EMBEDDING_DIM / VECTOR_PRECISION 設定並重新 ingest。
+
+用法:
+    python index_sweep.py --target-uri http://localhost:19530
+    python index_sweep.py --target-uri http://localhost:19530 --concurrency 16 --min-recall 0.98 --output index_config.json
+    python index_sweep.py --target-uri http://localhost:19530 --production-target milvus
+    python index_sweep.py --representations float32:1536 float16:1536 int8:1536 float32:512
+"""
+import argparse
+import json
+import sqlite3
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from openai import OpenAI
+from pymilvus import DataType, Function, FunctionType, MilvusClient
+
+import config
+import vector_repr
+from index_config import DEFAULT_INDEX_CONFIG, PRODUCTION_TARGETS, supports
+
+SWEEP_PREFIX = "index_sweep"
+
+# 每個 dense 設定建一個 collection，search_params 為同一個索引上要比較的搜尋參數
+DENSE_VARIANTS = [
+    {"name": "flat", "index_type": "FLAT", "params": {}, "search_params": [{}]},
+    *[
+        {
+            "name": f"hnsw_m{m}",
+            "index_type": "HNSW",
+            "params": {"M": m, "efConstruction": 200},
+            "search_params": [{"ef": ef} for ef in (16, 32, 64, 128)],
+        }
+        for m in (8, 16, 32)
+    ],
+    *[
+        {
+            "name": f"ivf_flat_nlist{nlist}",
+            "index_type": "IVF_FLAT",
+            "params": {"nlist": nlist},
+            "search_params": [{"nprobe": nprobe} for nprobe in (1, 4, 8, 16, 32) if nprobe <= nlist],
+        }
+        for nlist in (16, 64, 128)
+    ],
+    {"name": "autoindex", "index_type": "AUTOINDEX", "params": {}, "search_params": [{}]},
+]
+
+# TAAT_NAIVE 會對所有文件計分，作為 sparse 的精確基準
+SPARSE_BASELINE_ALGO = "TAAT_NAIVE"
+SPARSE_ALGOS = [SPARSE_BASELINE_ALGO, "DAAT_WAND", "DAAT_MAXSCORE"]
+
+
+def load_questions(db_path: str, table: str, limit: int) -> list[str]:
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT DISTINCT COALESCE(rephrased_question, question) FROM {table} WHERE question IS NOT NULL LIMIT ?",
+            (limit,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows if row[0]]
+
+
+def embed_questions(questions: list[str], dim: int) -> np.ndarray:
+    client = OpenAI(api_key=config.OPENAI_API_KEY)
+    resp = client.embeddings.create(
+        input=questions,
+        model=config.EMBEDDING_MODEL,
+        **vector_repr.embedding_kwargs(config.EMBEDDING_MODEL, dim),
+    )
+    return np.asarray([item.embedding for item in resp.data], dtype=np.float32)
+
+
+def export_collection(client: MilvusClient, collection_name: str) -> list[dict]:
+    """以 query_iterator 匯出 id / text / vector"""
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=500,
+        filter="id >= 0",
+        output_fields=["id", "text", "vector"],
+    )
+    rows = []
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            rows.extend({"id": r["id"], "text": r["text"], "vector": list(r["vector"])} for r in batch)
+    finally:
+        iterator.close()
+    return rows
+
+
+def create_copy(client: MilvusClient, name: str, dim: int, rows: list[dict], dense: dict, sparse_algo: str,
+                precision: str = "float32"):
+    """建立只含檢索所需欄位的 collection 副本並建立指定索引；rows 的向量必須已是 precision 對應的格式"""
+    if client.has_collection(name):
+        client.drop_collection(name)
+
+    schema = client.create_schema(auto_id=False, enable_dynamic_field=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("text", DataType.VARCHAR, max_length=5000, enable_analyzer=True)
+    schema.add_field("vector", vector_repr.milvus_vector_type(precision), dim=dim)
+    schema.add_field("text_sparse", DataType.SPARSE_FLOAT_VECTOR)
+    schema.add_function(Function(
+        name="text_bm25_emb",
+        input_field_names=["text"],
+        output_field_names=["text_sparse"],
+        function_type=FunctionType.BM25,
+    ))
+    client.create_collection(collection_name=name, schema=schema, consistency_level="Strong")
+
+    for start in range(0, len(rows), 500):
+        client.insert(collection_name=name, data=rows[start:start + 500])
+
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="vector",
+        index_type=dense["index_type"],
+        metric_type="COSINE",
+        params=dense["params"],
+    )
+    index_params.add_index(
+        field_name="text_sparse",
+        index_type="SPARSE_INVERTED_INDEX",
+        metric_type="BM25",
+        params={"inverted_index_algo": sparse_algo},
+    )
+    client.create_index(collection_name=name, index_params=index_params)
+    client.load_collection(collection_name=name)
+
+
+def brute_force_topk(corpus_ids: np.ndarray, corpus_vectors: np.ndarray, query_vectors: np.ndarray, top_k: int) -> list[set]:
+    """以正規化後的內積 (即 cosine) 計算精確的 top-k"""
+    corpus = corpus_vectors / np.linalg.norm(corpus_vectors, axis=1, keepdims=True)
+    queries = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    scores = queries @ corpus.T
+    k = min(top_k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(corpus_ids[row].tolist()) for row in top]
+
+
+def parse_representation(spec: str) -> tuple[str, int]:
+    """解析 "precision:dim" 格式，例如 "float16:1536" """
+    precision, _, dim = spec.partition(":")
+    if precision not in vector_repr.PRECISIONS or not dim.isdigit():
+        raise argparse.ArgumentTypeError(f"無效的向量表示 '{spec}'，格式為 precision:dim，例如 float16:1536")
+    return precision, int(dim)
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def measure(search_one, queries: list, concurrency: int, rounds: int) -> tuple[list, dict]:
+    """
+    以 concurrency 個 thread 同時送出查詢，重複 rounds 輪。
+    回傳第一輪每個查詢的結果 id，以及延遲分佈與 QPS。
+    """
+    def timed(query):
+        start = time.perf_counter()
+        ids = search_one(query)
+        return ids, (time.perf_counter() - start) * 1000
+
+    latencies_ms = []
+    first_results = None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(rounds):
+            outcomes = list(pool.map(timed, queries))
+            if first_results is None:
+                first_results = [ids for ids, _ in outcomes]
+            latencies_ms.extend(latency for _, latency in outcomes)
+    elapsed = time.perf_counter() - start
+    return first_results, {
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "qps": len(latencies_ms) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def recall_at_k(results: list, truth: list[set]) -> float:
+    return statistics.mean(len(set(ids) & expected) / len(expected) for ids, expected in zip(results, truth) if expected)
+
+
+def pick_best(candidates: list, min_recall: float) -> dict:
+    """recall 達標者取 p95 最低；都未達標時取 recall 最高"""
+    qualified = [c for c in candidates if c["recall"] >= min_recall]
+    if qualified:
+        return min(qualified, key=lambda c: c["latency"]["p95_ms"])
+    return max(candidates, key=lambda c: (c["recall"], -c["latency"]["p95_ms"]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sweep Milvus index types and parameters.")
+    parser.add_argument("--source-collection", default=config.MILVUS_COLLECTION)
+    parser.add_argument("--target-uri", default="http://localhost:19530", help="建立索引副本的 Milvus")
+    parser.add_argument("--target-token", default="")
+    parser.add_argument("--db", default="evaluation.db", help="查詢來源的 SQLite 檔案")
+    parser.add_argument("--table", default="qa_logs")
+    parser.add_argument("--queries", type=int, default=200, help="最多使用幾個問題")
+    parser.add_argument("--top-k", type=int, default=7)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3, help="每個設定重複查詢幾輪以取得延遲分佈")
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--production-target", choices=list(PRODUCTION_TARGETS), default=config.MILVUS_INDEX_TARGET,
+                        help="正式環境的 Milvus 部署，建議設定只會使用它支援的索引類型")
+    parser.add_argument("--output", default=config.MILVUS_INDEX_CONFIG, help="建議設定的輸出檔")
+    parser.add_argument("--report", default=None, help="將所有量測結果另存為 JSON 檔")
+    parser.add_argument("--keep", action="store_true", help="保留索引副本 collection")
+    parser.add_argument("--representations", nargs="*", type=parse_representation,
+                        default=[parse_representation(spec) for spec in ("float16:1536", "int8:1536", "float32:768", "float32:512", "float16:512")],
+                        help="要比較的向量表示 precision:dim；不帶參數則略過比較")
+    parser.add_argument("--repr-index", default="hnsw_m16", choices=[v["name"] for v in DENSE_VARIANTS],
+                        help="比較向量表示時使用的索引 (int8 向量只支援 HNSW)")
+    return parser.parse_args()
+
+
+def sweep_representations(args, target: MilvusClient, rows: list[dict], corpus_ids: np.ndarray,
+                          corpus_vectors: np.ndarray, query_vectors: np.ndarray, dense_truth: list[set]) -> list:
+    """
+    以目前 collection 的 float32 向量為基準，比較其他維度與精度。
+    exact_recall 只反映表示法本身的損失 (numpy 精確搜尋)，recall 則包含索引的近似誤差。
+    """
+    variant = next(v for v in DENSE_VARIANTS if v["name"] == args.repr_index)
+    search_params = next((p for p in reversed(variant["search_params"]) if p.get("ef", args.top_k) >= args.top_k), {})
+    full_dim = corpus_vectors.shape[1]
+    results = []
+    for precision, dim in [("float32", full_dim), *args.representations]:
+        if dim > full_dim:
+            print(f"\n略過 {precision}:{dim}，超過目前向量的維度 {full_dim}")
+            continue
+        stored = [vector_repr.to_milvus(v, precision) for v in vector_repr.truncate(corpus_vectors, dim)]
+        queries = [vector_repr.to_milvus(v, precision) for v in vector_repr.truncate(query_vectors, dim)]
+        exact = brute_force_topk(
+            corpus_ids,
+            np.asarray(stored, dtype=np.float32),
+            np.asarray(queries, dtype=np.float32),
+            args.top_k,
+        )
+
+        name = f"{SWEEP_PREFIX}_repr_{precision}_{dim}"
+        print(f"\n建立副本 {name} ({variant['index_type']} {variant['params']})...")
+        create_copy(
+            target, name, dim,
+            [{"id": r["id"], "text": r["text"], "vector": v} for r, v in zip(rows, stored)],
+            variant, DEFAULT_INDEX_CONFIG["sparse"]["params"]["inverted_index_algo"], precision,
+        )
+        try:
+            def dense_search(vector):
+                res = target.search(
+                    collection_name=name,
+                    data=[vector],
+                    anns_field="vector",
+                    search_params={"metric_type": "COSINE", "params": search_params},
+                    limit=args.top_k,
+                )
+                return [hit["id"] for hit in res[0]]
+
+            found, latency = measure(dense_search, queries, args.concurrency, args.rounds)
+        finally:
+            if not args.keep:
+                target.drop_collection(name)
+
+        entry = {
+            "precision": precision,
+            "dim": dim,
+            "exact_recall": recall_at_k([list(ids) for ids in exact], dense_truth),
+            "recall": recall_at_k(found, dense_truth),
+            "bytes_per_vector": vector_repr.bytes_per_vector(dim, precision),
+            "raw_vector_mb": vector_repr.bytes_per_vector(dim, precision) * len(rows) / 2**20,
+            "latency": latency,
+        }
+        results.append(entry)
+        print(f"  {precision}:{dim}: exact recall={entry['exact_recall']:.3f} recall@{args.top_k}={entry['recall']:.3f} "
+              f"{entry['bytes_per_vector']} B/vector p50={latency['p50_ms']:.1f}ms p95={latency['p95_ms']:.1f}ms")
+    return results
+
+
+def main():
+    args = parse_args()
+
+    source = MilvusClient(uri=config.CLUSTER_ENDPOINT, token=config.ZILLIZ_API_KEY)
+    target = MilvusClient(uri=args.target_uri, token=args.target_token)
+
+    print(f"匯出 collection '{args.source_collection}'...")
+    rows = export_collection(source, args.source_collection)
+    if not rows:
+        raise SystemExit("來源 collection 沒有資料。")
+    corpus_ids = np.asarray([r["id"] for r in rows])
+    corpus_vectors = np.asarray([r["vector"] for r in rows], dtype=np.float32)
+    dim = corpus_vectors.shape[1]
+
+    questions = load_questions(args.db, args.table, args.queries)
+    query_vectors = embed_questions(questions, dim)
+    dense_truth = brute_force_topk(corpus_ids, corpus_vectors, query_vectors, args.top_k)
+    print(f"{len(rows)} 筆文件 (dim={dim})，{len(questions)} 個查詢，top_k={args.top_k}")
+
+    dense_results, sparse_results = [], []
+    sparse_truth = None
+    created = []
+    try:
+        # 每個 collection 副本同時測一個 dense 設定與一個 sparse 演算法，減少建立副本的次數
+        for i, dense in enumerate(DENSE_VARIANTS):
+            sparse_algo = SPARSE_ALGOS[i] if i < len(SPARSE_ALGOS) else DEFAULT_INDEX_CONFIG["sparse"]["params"]["inverted_index_algo"]
+            name = f"{SWEEP_PREFIX}_{dense['name']}"
+            print(f"\n建立副本 {name} ({dense['index_type']} {dense['params']}, sparse={sparse_algo})...")
+            create_copy(target, name, dim, rows, dense, sparse_algo)
+            created.append(name)
+
+            for search_params in dense["search_params"]:
+                if search_params.get("ef", args.top_k) < args.top_k:
+                    continue
+
+                def dense_search(vector, search_params=search_params):
+                    res = target.search(
+                        collection_name=name,
+                        data=[vector.tolist()],
+                        anns_field="vector",
+                        search_params={"metric_type": "COSINE", "params": search_params},
+                        limit=args.top_k,
+                    )
+                    return [hit["id"] for hit in res[0]]
+
+                results, latency = measure(dense_search, list(query_vectors), args.concurrency, args.rounds)
+                entry = {
+                    "index_type": dense["index_type"],
+                    "params": dense["params"],
+                    "search_params": search_params,
+                    "recall": recall_at_k(results, dense_truth),
+                    "latency": latency,
+                }
+                dense_results.append(entry)
+                print(f"  dense {search_params}: recall@{args.top_k}={entry['recall']:.3f} "
+                      f"p50={latency['p50_ms']:.1f}ms p95={latency['p95_ms']:.1f}ms qps={latency['qps']:.0f}")
+
+            if i < len(SPARSE_ALGOS):
+                def sparse_search(question):
+                    res = target.search(
+                        collection_name=name,
+                        data=[question],
+                        anns_field="text_sparse",
+                        search_params={"metric_type": "BM25", "params": {}},
+                        limit=args.top_k,
+                    )
+                    return [hit["id"] for hit in res[0]]
+
+                results, latency = measure(sparse_search, questions, args.concurrency, args.rounds)
+                if sparse_algo == SPARSE_BASELINE_ALGO:
+                    sparse_truth = [set(ids) for ids in results]
+                entry = {
+                    "params": {"inverted_index_algo": sparse_algo},
+                    "recall": recall_at_k(results, sparse_truth),
+                    "latency": latency,
+                }
+                sparse_results.append(entry)
+                print(f"  sparse {sparse_algo}: recall@{args.top_k}={entry['recall']:.3f} "
+                      f"p50={latency['p50_ms']:.1f}ms p95={latency['p95_ms']:.1f}ms qps={latency['qps']:.0f}")
+    finally:
+        if not args.keep:
+            for name in created:
+                target.drop_collection(name)
+
+    deployable = [entry for entry in dense_results if supports(args.production_target, entry["index_type"])]
+    if not deployable:
+        raise SystemExit(f"沒有 {args.production_target} 支援的索引類型的量測結果。")
+    best_dense = pick_best(deployable, args.min_recall)
+    fastest = pick_best(dense_results, args.min_recall)
+    if fastest is not best_dense:
+        print(f"\n不限索引類型時的最佳設定: vector={fastest['index_type']} {fastest['params']} search={fastest['search_params']} "
+              f"(p95={fastest['latency']['p95_ms']:.1f}ms，{args.production_target} 不支援)")
+    best_sparse = pick_best(sparse_results, args.min_recall)
+    recommendation = {
+        "target": args.production_target,
+        "dense": {
+            "index_type": best_dense["index_type"],
+            "metric_type": "COSINE",
+            "params": best_dense["params"],
+            "search_params": best_dense["search_params"],
+        },
+        "sparse": {
+            "index_type": "SPARSE_INVERTED_INDEX",
+            "metric_type": "BM25",
+            "params": best_sparse["params"],
+            "search_params": {},
+        },
+        "measured": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "documents": len(rows),
+            "queries": len(questions),
+            "top_k": args.top_k,
+            "concurrency": args.concurrency,
+            "dense": {"recall": best_dense["recall"], **best_dense["latency"]},
+            "sparse": {"recall": best_sparse["recall"], **best_sparse["latency"]},
+        },
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(recommendation, f, ensure_ascii=False, indent=2)
+    print(f"\n建議設定: vector={best_dense['index_type']} {best_dense['params']} search={best_dense['search_params']}, "
+          f"text_sparse={best_sparse['params']}")
+    print(f"已寫入 {args.output}")
+
+    representation_results = []
+    if args.representations:
+        representation_results = sweep_representations(args, target, rows, corpus_ids, corpus_vectors, query_vectors, dense_truth)
+        print(f"\n{'表示':>14} {'exact recall':>12} {'recall':>7} {'B/vector':>9} {'MB':>8} {'p95 ms':>8}")
+        for r in representation_results:
+            print(f"{r['precision'] + ':' + str(r['dim']):>14} {r['exact_recall']:>12.3f} {r['recall']:>7.3f} "
+                  f"{r['bytes_per_vector']:>9} {r['raw_vector_mb']:>8.2f} {r['latency']['p95_ms']:>8.1f}")
+        print("選定後設定 EMBEDDING_DIM / VECTOR_PRECISION 並重新執行 ingest。")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"dense": dense_results, "sparse": sparse_results, "representations": representation_results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"完整量測結果已儲存到 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
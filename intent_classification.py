@@ -1,6 +1,8 @@
 import config
 from openai import AsyncOpenAI
 from prompts import PROMPTS
+from hedging import get_caller
+from model_router import model_router
 
 # 建立 OpenAI client
 client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
@@ -21,11 +23,12 @@ async def intent_classification(question: str, lang: str = 'zh') -> str:
         question=question
     )
 
-    resp = await client.chat.completions.create(
-        model=config.OPENAI_MODEL_NAME,
+    # 依模型分開的 hedge 延遲統計
+    resp = await model_router.call("intent", lambda model: get_caller("intent", model).call(lambda: client.chat.completions.create(
+        model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=0
-    )
+    )))
 
     intent = resp.choices[0].message.content.strip().lower()
 
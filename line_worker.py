@@ -0,0 +1,170 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+
+import aiohttp
+from linebot import AsyncLineBotApi
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient
+from linebot.models import MessageEvent, TextMessage, TextSendMessage
+
+import config
+from answer import stream_chat_pipeline
+from session_store import line_session_id
+
+
+class LineEventDispatcher:
+    """
+    LINE webhook 事件的背景處理器。
+    /callback 只負責驗證與排入佇列並立即回應，實際的 RAG 與回覆由固定數量的 worker 非同步執行。
+    """
+
+    def __init__(self, num_workers: int, max_queue_size: int, dedup_ttl_seconds: float, dedup_max_entries: int = 10000,
+                 drain_timeout_seconds: float = 30.0):
+        self.num_workers = num_workers
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.dedup_max_entries = dedup_max_entries
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._seen_event_ids: OrderedDict[str, float] = OrderedDict()
+        self._workers: list[asyncio.Task] = []
+        self._session: aiohttp.ClientSession | None = None
+        self._line_bot_api: AsyncLineBotApi | None = None
+        self._busy_workers = 0
+        self._stopping = False
+        self._counters = {
+            "received": 0,
+            "enqueued": 0,
+            "duplicates": 0,
+            "redeliveries": 0,
+            "rejected_queue_full": 0,
+            "rejected_stopping": 0,
+            "dropped_on_stop": 0,
+            "processed": 0,
+            "failed": 0,
+        }
+
+    async def start(self):
+        """建立非同步 HTTP client 並啟動 worker。必須在 event loop 內呼叫。"""
+        self._session = aiohttp.ClientSession()
+        self._line_bot_api = AsyncLineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN, AiohttpAsyncHttpClient(self._session))
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        print(f"--- [Line Bot] Started {self.num_workers} webhook workers ---")
+
+    async def stop(self):
+        """
+        停止接收新事件，等待佇列中的事件處理完 (最多 drain_timeout_seconds 秒) 後停止 worker 並關閉 HTTP client。
+        佇列中的事件已回應 200，LINE 不會重送，直接取消會遺失這些訊息並中斷正在產生的回覆。
+        """
+        self._stopping = True
+        if self._workers and (self._queue.qsize() or self._busy_workers):
+            print(f"--- [Line Bot] Draining {self._queue.qsize()} queued and {self._busy_workers} in-flight event(s) ---")
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout_seconds)
+            except asyncio.TimeoutError:
+                self._counters["dropped_on_stop"] += self._queue.qsize() + self._busy_workers
+                print(f"!!!!!! [WARN] Line event drain timed out, dropping {self._queue.qsize()} queued "
+                      f"and {self._busy_workers} in-flight event(s) !!!!!!!")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def submit(self, events: list) -> int:
+        """
+        將事件排入佇列，回傳因佇列已滿 (或服務關閉中) 而無法接收的事件數。
+        已處理過的 webhook event id (LINE 重送) 會被直接略過。
+        """
+        rejected = 0
+        for event in events:
+            self._counters["received"] += 1
+            if self._stopping:
+                # 關閉中不再接收，回應 503 讓 LINE 重送到其他 instance
+                self._counters["rejected_stopping"] += 1
+                rejected += 1
+                continue
+            delivery_context = getattr(event, "delivery_context", None)
+            if delivery_context is not None and getattr(delivery_context, "is_redelivery", False):
+                self._counters["redeliveries"] += 1
+
+            event_id = getattr(event, "webhook_event_id", None)
+            if event_id and self._is_duplicate(event_id):
+                self._counters["duplicates"] += 1
+                print(f"--- [Line Bot] Skipping duplicate webhook event: {event_id} ---")
+                continue
+
+            try:
+                self._queue.put_nowait((event, time.monotonic()))
+            except asyncio.QueueFull:
+                self._counters["rejected_queue_full"] += 1
+                rejected += 1
+                continue
+
+            # 只有成功排入佇列的事件才記錄為已處理，被拒絕的事件在重送時仍可被接收
+            if event_id:
+                self._remember(event_id)
+            self._counters["enqueued"] += 1
+        return rejected
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "workers": self.num_workers,
+            "busy_workers": self._busy_workers,
+            **self._counters,
+        }
+
+    def _is_duplicate(self, event_id: str) -> bool:
+        now = time.monotonic()
+        # OrderedDict 依插入時間排序，過期的項目一定在最前面
+        while self._seen_event_ids:
+            _, seen_at = next(iter(self._seen_event_ids.items()))
+            if now - seen_at <= self.dedup_ttl_seconds:
+                break
+            self._seen_event_ids.popitem(last=False)
+        return event_id in self._seen_event_ids
+
+    def _remember(self, event_id: str):
+        self._seen_event_ids[event_id] = time.monotonic()
+        while len(self._seen_event_ids) > self.dedup_max_entries:
+            self._seen_event_ids.popitem(last=False)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            event, enqueued_at = await self._queue.get()
+            self._busy_workers += 1
+            try:
+                wait_ms = (time.monotonic() - enqueued_at) * 1000
+                await self._handle_event(event, wait_ms)
+                self._counters["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counters["failed"] += 1
+                print(f"Error processing Line event in worker {worker_id}: {e}")
+                traceback.print_exc()
+            finally:
+                self._busy_workers -= 1
+                self._queue.task_done()
+
+    async def _handle_event(self, event, wait_ms: float):
+        if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)):
+            return
+
+        user_msg = event.message.text
+        print(f"--- [Line Bot] Processing: {user_msg} (queued {wait_ms:.0f} ms) ---")
+
+        # 執行 RAG；每個 LINE 使用者各自一段對話 (群組訊息沒有 user_id 時不保留歷史)
+        user_id = getattr(event.source, "user_id", None)
+        session_id = line_session_id(user_id) if user_id else None
+        full_response = ""
+        async for chunk in stream_chat_pipeline(user_msg, history=[], lang='zh', session_id=session_id):
+            if chunk.get("type") == "content":
+                full_response += chunk.get("data", "")
+
+        # 回覆訊息
+        await self._line_bot_api.reply_message(event.reply_token, TextSendMessage(text=full_response))
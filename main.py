@@ -1,28 +1,88 @@
 import os
 import sys
 import config
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 import asyncio
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import psycopg2
 import traceback
-import json
+from contextlib import asynccontextmanager
 from fastapi.responses import StreamingResponse
-from answer import stream_chat_pipeline
+from answer import stream_chat_pipeline, answer_flights, session_store, faq_store, retrieval_cache
+from session_store import new_session_id, is_valid_session_id
+from line_worker import LineEventDispatcher
+from admission import AdmissionController, AdmissionRejected
+from sse import sse_stream, gzip_stream
+from build_static import ensure_built
+import hedging
+from model_router import model_router
+from static_files import PrecompressedStaticFiles
 
 # Add the project root to the Python path to allow imports from other files
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# --- Admission Control ---
+
+admission = AdmissionController(
+    max_concurrency=config.CHAT_MAX_CONCURRENCY,
+    max_queue=config.CHAT_MAX_QUEUE,
+    max_queue_per_client=config.CHAT_MAX_QUEUE_PER_CLIENT,
+)
+
+def _client_key(http_request: Request, session_id: str | None = None) -> str:
+    """
+    Identifies the client for fair queuing.
+    Conversations are keyed by their session id, so users behind the same NAT are queued independently;
+    otherwise the client IP is used, honouring the proxy's X-Forwarded-For header.
+    """
+    if session_id:
+        return f"session:{session_id}"
+    forwarded_for = http_request.headers.get("x-forwarded-for")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return http_request.client.host if http_request.client else "unknown"
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    Streaming response that releases its admission ticket when the response ends.
+    The generator's own finally does not run if the client disconnects before the body is first iterated,
+    and Starlette skips background tasks on disconnect, so the release also happens here.
+    """
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.ticket)
+
+# --- Background Workers ---
+
+line_dispatcher = LineEventDispatcher(
+    num_workers=config.LINE_WORKERS,
+    max_queue_size=config.LINE_QUEUE_MAXSIZE,
+    dedup_ttl_seconds=config.LINE_DEDUP_TTL_SECONDS,
+    drain_timeout_seconds=config.LINE_DRAIN_TIMEOUT_SECONDS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await line_dispatcher.start()
+    yield
+    await line_dispatcher.stop()
+
 # --- API Definition ---
 
 app = FastAPI(
     title="Chatbot RAG API",
     description="An API for the Milvus RAG chatbot.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # --- Middleware ---
@@ -39,6 +99,9 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     """Request model for a user's chat query."""
     query: str
+    # Server-side conversation id; omitted on the first message and returned in the final data
+    session_id: Optional[str] = None
+    # Legacy clients may still send the full history; ignored when session_id is used
     history: List[dict] | None = None
     lang: Optional[str] = 'zh'
 
@@ -51,94 +114,140 @@ class FeedbackRequest(BaseModel):
 # --- API Endpoints ---
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
-    Receives a user query and conversation history, processes it through the RAG pipeline,
+    Receives a user query and session id, processes it through the RAG pipeline,
     and returns a streaming response of the generated answer.
+    The conversation history is kept server-side; the final data carries the session id to send next time.
+    Requests beyond the concurrency cap wait in a fair queue and receive their queue position;
+    once the queue is full the request is rejected with 429.
     """
     print("--- [INFO] Received new chat stream request ---")
+
+    history = None
+    # Only ids issued by this server and still held by the store are reused, so clients cannot pick
+    # or guess an id (LINE sessions live under a "line:" key that never passes is_valid_session_id)
+    if is_valid_session_id(request.session_id) and session_store.has(request.session_id):
+        session_id = request.session_id
+        client_key = _client_key(http_request, session_id)
+    elif request.history:
+        # Legacy clients keep the history themselves
+        session_id = None
+        history = request.history
+        client_key = _client_key(http_request)
+    else:
+        # First message (or an unknown, expired or malformed id) starts a new conversation
+        session_id = new_session_id()
+        client_key = _client_key(http_request)
+
+    try:
+        ticket = admission.enqueue(client_key)
+    except AdmissionRejected as e:
+        print(f"!!!!!! [WARN] Chat queue full, rejecting request (Retry-After: {e.retry_after}s) !!!!!!!")
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     
     async def event_generator():
         try:
+            # Stream the queue position until the request is admitted
+            last_position = None
+            while not ticket.granted.is_set():
+                position = admission.position(ticket)
+                if position != last_position:
+                    yield {"type": "queue", "data": {"position": position + 1}}
+                    last_position = position
+                try:
+                    await asyncio.wait_for(ticket.granted.wait(), timeout=config.CHAT_QUEUE_UPDATE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
             print(f"--- [INFO] Processing query for stream: '{request.query}' in language '{request.lang}' ---")
             # The pipeline now yields events (content chunks or final data)
-            async for event in stream_chat_pipeline(request.query, request.history or [], request.lang):
-                event_type = event.get("type")
-                data = event.get("data")
-
-                if event_type == "content":
-                    # Send a standard message event
-                    # The data is just the text chunk
-                    sse_data = json.dumps({"type": "content", "data": data})
-                    yield f"data: {sse_data}\n\n"
-                
-                elif event_type == "final_data":
-                    # Send a custom named event for the final payload
-                    # The data is the dict with contexts and log_id
-                    sse_data = json.dumps({"type": "final_data", "data": data})
-                    yield f"event: end_stream\ndata: {sse_data}\n\n"
-                    
-                # Yield a small delay to ensure messages are sent separately
-                # await asyncio.sleep(0.01)
+            async for event in stream_chat_pipeline(request.query, history, request.lang, session_id=session_id):
+                yield event
 
         except Exception as e:
             print(f"!!!!!! [ERROR] An exception occurred in stream: {e} !!!!!!!")
             traceback.print_exc()
             # Optionally, send an error event to the client
-            error_message = json.dumps({"type": "error", "data": "An error occurred on the server."})
-            yield f"event: error\ndata: {error_message}\n\n"
+            yield {"type": "error", "data": "An error occurred on the server."}
+        finally:
+            # Frees the slot (or the queue entry if the client disconnected while waiting)
+            admission.release(ticket)
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    # Tokens are coalesced into larger frames and keep-alive comments are sent during slow stages
+    frames = sse_stream(
+        event_generator(),
+        coalesce_seconds=config.SSE_COALESCE_SECONDS,
+        max_chars=config.SSE_COALESCE_MAX_CHARS,
+        keepalive_seconds=config.SSE_KEEPALIVE_SECONDS,
+    )
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if config.SSE_GZIP and "gzip" in http_request.headers.get("accept-encoding", ""):
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return AdmittedStreamingResponse(gzip_stream(frames), ticket, media_type="text/event-stream", headers=headers)
+    return AdmittedStreamingResponse(frames, ticket, media_type="text/event-stream", headers=headers)
 
 # --- Line Bot Setup ---
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
-from fastapi import Request, Header
+from linebot import WebhookHandler
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
+from fastapi import Header
 
-line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(config.LINE_CHANNEL_SECRET)
 
 @app.post("/callback")
 async def callback_endpoint(request: Request, x_line_signature: str = Header(None)):
     """
-    Line Bot Webhook Endpoint
+    Line Bot Webhook Endpoint.
+    Events are validated and queued for the background workers, so LINE gets its 200 immediately.
     """
+    if not x_line_signature:
+        raise HTTPException(status_code=400, detail="Missing X-Line-Signature header")
+
     body = await request.body()
-    body_str = body.decode('utf-8')
-    
+
     try:
+        body_str = body.decode('utf-8')
         # 驗證簽章
         if not handler.parser.signature_validator.validate(body_str, x_line_signature):
              raise InvalidSignatureError
         
         # 解析事件
         events = handler.parser.parse(body_str, x_line_signature)
-        
-        for event in events:
-            if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
-                user_msg = event.message.text
-                reply_token = event.reply_token
-                
-                print(f"--- [Line Bot] Processing: {user_msg} ---")
-                
-                # 執行 RAG
-                full_response = ""
-                async for chunk in stream_chat_pipeline(user_msg, history=[], lang='zh'):
-                    if chunk.get("type") == "content":
-                        full_response += chunk.get("data", "")
-                
-                # 回覆訊息
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=full_response))
-                
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
-    except Exception as e:
-        print(f"Error processing Line event: {e}")
-        traceback.print_exc()
-        return "Error"
+    except (ValueError, KeyError, LineBotApiError) as e:
+        # The signature is valid but the payload is not a webhook body we can parse
+        print(f"!!!!!! [WARN] Malformed Line webhook body: {e!r} !!!!!!!")
+        raise HTTPException(status_code=400, detail="Malformed request body")
+
+    rejected = line_dispatcher.submit(events)
+    if rejected:
+        # Ask LINE to redeliver later (to this or another instance); accepted events are deduplicated on redelivery
+        print(f"!!!!!! [WARN] Line event queue full or shutting down, rejected {rejected} event(s) !!!!!!!")
+        raise HTTPException(status_code=503, detail="Event queue is full or the server is shutting down")
     
     return "OK"
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Returns runtime counters for chat admission and the background workers.
+    """
+    return {
+        "chat_admission": admission.stats(),
+        "single_flight": answer_flights.stats(),
+        "sessions": session_store.stats(),
+        "faq": faq_store.stats() if faq_store else None,
+        "retrieval_cache": retrieval_cache.stats() if retrieval_cache else None,
+        "hedging": hedging.stats(),
+        "model_router": model_router.stats(),
+        "line_webhook": line_dispatcher.stats(),
+    }
+
 @app.post("/feedback")
 async def feedback_endpoint(request: FeedbackRequest):
     """
@@ -187,5 +296,7 @@ async def feedback_endpoint(request: FeedbackRequest):
 
 # --- Static Files ---
 
-# app.mount("/", StaticFiles(directory="static", html=True), name="static")
-app.mount("/", StaticFiles(directory=".", html=True), name="static")
+# Only the built frontend is served: fingerprinted, precompressed copies under STATIC_DIST_DIR.
+# Mounting the repo root would also expose evaluation.db, .env and the source files.
+ensure_built(".", config.STATIC_DIST_DIR)
+app.mount("/", PrecompressedStaticFiles(directory=config.STATIC_DIST_DIR, html=True), name="static")
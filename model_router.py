@@ -0,0 +1,158 @@
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+import config
+
+STAGES = ("rephrase", "intent", "filter", "answer", "small_talk", "summary")
+
+# 目前請求 (task) 各階段使用的模型與延遲，由 start_stage_log 建立，寫入問答紀錄
+_stage_log: ContextVar[dict | None] = ContextVar("model_router_stage_log", default=None)
+
+
+def start_stage_log() -> dict:
+    """為目前的 task 建立新的階段紀錄 {stage: {"model", "latency_ms"}}"""
+    log = {}
+    _stage_log.set(log)
+    return log
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class ModelRouter:
+    """
+    依階段 (問題重構、意圖分類、過濾條件、回答、閒聊、對話摘要) 選擇模型。
+    每個階段在 config 中有自己的候選模型清單，router 記錄每個 (階段, 模型) 最近 window 次呼叫的延遲與成功與否：
+      - 錯誤率超過 max_error_rate 的模型在 cooldown_seconds 內不會被選擇
+      - 樣本不足 min_samples 的模型優先被選擇，以取得延遲資料
+      - 其餘情況選擇延遲中位數最低的模型 (相同時依清單順序)，explore_ratio 的呼叫隨機選擇，讓延遲資料保持更新
+    延遲對一般呼叫是整個請求的時間，對串流呼叫 (回答、閒聊) 是第一個 chunk 的時間。
+    """
+
+    def __init__(self, stage_models: dict[str, list[str]], default_model: str, window: int = 50, min_samples: int = 5,
+                 max_error_rate: float = 0.2, explore_ratio: float = 0.05, cooldown_seconds: float = 30.0):
+        self.stage_models = stage_models
+        self.default_model = default_model
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.explore_ratio = explore_ratio
+        self.cooldown_seconds = cooldown_seconds
+        self._models: dict[tuple[str, str], dict] = {}
+
+    def _entry(self, stage: str, model: str) -> dict:
+        entry = self._models.get((stage, model))
+        if entry is None:
+            entry = self._models[(stage, model)] = {
+                "latencies_ms": deque(maxlen=self.window),
+                "outcomes": deque(maxlen=self.window),
+                "calls": 0,
+                "errors": 0,
+                "unhealthy_until": 0.0,
+            }
+        return entry
+
+    def candidates(self, stage: str) -> list[str]:
+        return self.stage_models.get(stage) or [self.default_model]
+
+    def _error_rate(self, entry: dict) -> float:
+        outcomes = entry["outcomes"]
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def _healthy(self, entry: dict) -> bool:
+        return time.monotonic() >= entry["unhealthy_until"]
+
+    def choose(self, stage: str) -> str:
+        candidates = self.candidates(stage)
+        if len(candidates) == 1:
+            return candidates[0]
+        entries = {model: self._entry(stage, model) for model in candidates}
+        healthy = [model for model in candidates if self._healthy(entries[model])]
+        if not healthy:
+            # 全部都不健康時選錯誤率最低的
+            return min(candidates, key=lambda model: self._error_rate(entries[model]))
+        unmeasured = [model for model in healthy if len(entries[model]["latencies_ms"]) < self.min_samples]
+        if unmeasured:
+            return unmeasured[0]
+        if random.random() < self.explore_ratio:
+            return random.choice(healthy)
+        return min(healthy, key=lambda model: (_percentile(entries[model]["latencies_ms"], 50), candidates.index(model)))
+
+    def record(self, stage: str, model: str, latency_ms: float | None, ok: bool):
+        entry = self._entry(stage, model)
+        entry["calls"] += 1
+        entry["outcomes"].append(ok)
+        if ok:
+            entry["latencies_ms"].append(latency_ms)
+        else:
+            entry["errors"] += 1
+            if len(entry["outcomes"]) >= self.min_samples and self._error_rate(entry) > self.max_error_rate:
+                # 暫停使用，冷卻後以新的樣本重新評估
+                entry["unhealthy_until"] = time.monotonic() + self.cooldown_seconds
+                entry["outcomes"].clear()
+                print(f"⚠️ 模型 {model} 在 {stage} 階段錯誤率過高，暫停使用 {self.cooldown_seconds:.0f} 秒")
+
+        log = _stage_log.get()
+        if log is not None:
+            log[stage] = {"model": model, "latency_ms": round(latency_ms, 1) if latency_ms is not None else None, "ok": ok}
+
+    async def call(self, stage: str, factory):
+        """factory(model) 回傳 awaitable；以選出的模型執行並記錄延遲與錯誤"""
+        model = self.choose(stage)
+        start = time.perf_counter()
+        try:
+            result = await factory(model)
+        except Exception:
+            self.record(stage, model, None, ok=False)
+            raise
+        self.record(stage, model, (time.perf_counter() - start) * 1000, ok=True)
+        return result
+
+    async def stream(self, stage: str, factory):
+        """factory(model) 回傳 awaitable 的串流 (例如 stream=True 的 chat completion)；以第一個 chunk 的時間作為延遲"""
+        model = self.choose(stage)
+        start = time.perf_counter()
+        recorded = False
+        try:
+            stream = await factory(model)
+            async for chunk in stream:
+                if not recorded:
+                    self.record(stage, model, (time.perf_counter() - start) * 1000, ok=True)
+                    recorded = True
+                yield chunk
+        except Exception:
+            if not recorded:
+                self.record(stage, model, None, ok=False)
+            raise
+        if not recorded:
+            self.record(stage, model, (time.perf_counter() - start) * 1000, ok=True)
+
+    def stats(self) -> dict:
+        result = {}
+        for (stage, model), entry in self._models.items():
+            latencies = entry["latencies_ms"]
+            result.setdefault(stage, {})[model] = {
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "error_rate": self._error_rate(entry),
+                "healthy": self._healthy(entry),
+                "p50_ms": round(_percentile(latencies, 50), 1) if latencies else None,
+                "p95_ms": round(_percentile(latencies, 95), 1) if latencies else None,
+            }
+        return result
+
+
+model_router = ModelRouter(
+    config.STAGE_MODELS,
+    default_model=config.OPENAI_MODEL_NAME,
+    window=config.MODEL_ROUTER_WINDOW,
+    min_samples=config.MODEL_ROUTER_MIN_SAMPLES,
+    max_error_rate=config.MODEL_ROUTER_MAX_ERROR_RATE,
+    explore_ratio=config.MODEL_ROUTER_EXPLORE_RATIO,
+    cooldown_seconds=config.MODEL_ROUTER_COOLDOWN_SECONDS,
+)
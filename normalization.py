@@ -0,0 +1,17 @@
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？!！。.,，、~～ "
+
+
+def normalize_question(text: str) -> str:
+    """
+    將問題正規化，用於比對「相同的問題」。
+    全形/半形統一 (NFKC)、英文轉小寫、合併空白，並去掉結尾的標點符號。
+    """
+    if not text:
+        return ""
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip()
+    return normalized.rstrip(_TRAILING_PUNCTUATION)
@@ -0,0 +1,190 @@
+"""
+Partition key 路由的延遲 benchmark。
+
+在測試用的 Milvus (預設為本機 standalone) 為每個資料量建立兩個合成 collection：
+  - plain：與目前正式環境相同，不分區
+  - partitioned：以 --dimension 的主要值作為 partition key (與 ingest 腳本相同的 partition_tag 欄位)
+合成文件的 metadata 依 config.json 中真實文件的組合抽樣，向量為隨機單位向量 (只量測檢索延遲，不需要 embedding)。
+查詢使用與 retrieve_context 相同的 ARRAY_CONTAINS_ANY 過濾條件，比較：
+  - plain：掃描全部 segment
+  - partitioned (未路由)：只有 metadata 過濾，Milvus 仍需搜尋每個 partition
+  - partitioned (路由)：加上 partition_layout.routed_expr 的 partition key 條件
+並確認路由前後的結果相同 (多值 metadata 不會因為分區而漏掉文件)。
+
+用法:
+    python partition_benchmark.py --target-uri http://localhost:19530
+    python partition_benchmark.py --sizes 20000 100000 400000 --dimension edu_system --dim 256
+    python partition_benchmark.py --output partition_benchmark.json --keep
+"""
+import argparse
+import json
+import random
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+import config
+from auto_filter import filters_to_expr
+from index_config import load_index_config
+from index_sweep import measure
+from partition_layout import DEFAULT_NUM_PARTITIONS, DIMENSIONS, PARTITION_FIELD, build_layout, partition_tag, routed_expr
+
+BENCH_PREFIX = "partition_bench"
+INSERT_BATCH = 2000
+
+
+def load_metadata() -> list[dict]:
+    with open("config.json", "r", encoding="utf-8") as f:
+        return list(json.load(f).values())
+
+
+def random_vectors(rng: np.random.Generator, count: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def create_collection(client: MilvusClient, name: str, dim: int, dense: dict, partitioned: bool, num_partitions: int):
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = client.create_schema(auto_id=False, enable_dynamic_field=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dim)
+    for dimension in DIMENSIONS:
+        schema.add_field(dimension, DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
+    if partitioned:
+        schema.add_field(PARTITION_FIELD, DataType.VARCHAR, max_length=200, is_partition_key=True)
+    kwargs = {"num_partitions": num_partitions} if partitioned else {}
+    client.create_collection(collection_name=name, schema=schema, consistency_level="Strong", **kwargs)
+
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_type=dense["index_type"], metric_type="COSINE", params=dense["params"])
+    client.create_index(collection_name=name, index_params=index_params)
+
+
+def populate(client: MilvusClient, names: dict, size: int, dim: int, metadata: list[dict], dimension: str, seed: int):
+    """兩個 collection 寫入相同的合成資料 (同一個 seed)，partitioned 另外寫入 partition_tag"""
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    for start in range(0, size, INSERT_BATCH):
+        count = min(INSERT_BATCH, size - start)
+        vectors = random_vectors(rng, count, dim)
+        rows = []
+        for offset, vector in enumerate(vectors):
+            meta = picker.choice(metadata)
+            row = {"id": start + offset, "vector": vector.tolist()}
+            row.update({field: meta.get(field, []) for field in DIMENSIONS})
+            rows.append(row)
+        client.insert(collection_name=names["plain"], data=rows)
+        for row in rows:
+            row[PARTITION_FIELD] = partition_tag(row, dimension)
+        client.insert(collection_name=names["partitioned"], data=rows)
+        print(f"\r  寫入 {start + count}/{size}", end="", flush=True)
+    print()
+    for name in names.values():
+        client.flush(collection_name=name)
+        client.load_collection(collection_name=name)
+
+
+def make_queries(metadata: list[dict], dimension: str, count: int, dim: int, seed: int) -> list[dict]:
+    """
+    依真實文件的 metadata 產生過濾條件：一定包含分區維度的一個值 (才會路由)，
+    有一半的查詢再加上另一個維度的條件，模擬 extract_filters_from_question 的輸出。
+    """
+    picker = random.Random(seed)
+    vectors = random_vectors(np.random.default_rng(seed + 1), count, dim)
+    queries = []
+    for vector in vectors:
+        meta = picker.choice([m for m in metadata if m.get(dimension)])
+        filters = {dimension: [picker.choice(meta[dimension])]}
+        if picker.random() < 0.5:
+            other = picker.choice([d for d in DIMENSIONS if d != dimension and meta.get(d)])
+            filters[other] = [picker.choice(meta[other])]
+        queries.append({"vector": vector.tolist(), "filters": filters})
+    return queries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark partition-key routing for metadata-filtered search.")
+    parser.add_argument("--target-uri", default="http://localhost:19530", help="測試用 Milvus (會建立與刪除 collection)")
+    parser.add_argument("--token", default="", help="測試用 Milvus 的 token")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000], help="合成 collection 的資料量")
+    parser.add_argument("--dimension", choices=DIMENSIONS, default="subsidy_type", help="作為 partition key 的 metadata 維度")
+    parser.add_argument("--num-partitions", type=int, default=DEFAULT_NUM_PARTITIONS)
+    parser.add_argument("--dim", type=int, default=config.EMBEDDING_DIM, help="合成向量維度")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=7)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="將結果寫入 JSON 檔")
+    parser.add_argument("--keep", action="store_true", help="結束後保留測試 collection")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    metadata = load_metadata()
+    layout = build_layout({str(i): meta for i, meta in enumerate(metadata)}, args.dimension, BENCH_PREFIX)
+    dense = load_index_config(config.MILVUS_INDEX_CONFIG)["dense"]
+    search_params = {"metric_type": "COSINE", "params": dense["search_params"]}
+    client = MilvusClient(uri=args.target_uri, token=args.token)
+
+    queries = make_queries(metadata, args.dimension, args.queries, args.dim, args.seed)
+    for query in queries:
+        query["expr"] = filters_to_expr(query["filters"])
+        query["routed_expr"], query["tags"] = routed_expr(layout, query["filters"], query["expr"])
+    avg_tags = sum(len(q["tags"]) for q in queries) / len(queries)
+    print(f"以 {args.dimension} 分區：{len(layout['partitions'])} 個 partition tag，每個查詢平均路由到 {avg_tags:.1f} 個")
+
+    results = []
+    for size in args.sizes:
+        names = {kind: f"{BENCH_PREFIX}_{kind}_{size}" for kind in ("plain", "partitioned")}
+        print(f"\n=== {size} 筆 ===")
+        create_collection(client, names["plain"], args.dim, dense, False, args.num_partitions)
+        create_collection(client, names["partitioned"], args.dim, dense, True, args.num_partitions)
+        try:
+            populate(client, names, size, args.dim, metadata, args.dimension, args.seed)
+
+            def searcher(name: str, expr_key: str):
+                def search_one(query):
+                    res = client.search(collection_name=name, data=[query["vector"]], anns_field="vector",
+                                        filter=query[expr_key], limit=args.top_k, search_params=search_params,
+                                        output_fields=["id"])
+                    return [hit["id"] for hit in res[0]]
+                return search_one
+
+            variants = [
+                ("plain", names["plain"], "expr"),
+                ("partitioned", names["partitioned"], "expr"),
+                ("partitioned+routed", names["partitioned"], "routed_expr"),
+            ]
+            ids_by_variant = {}
+            for label, name, expr_key in variants:
+                ids, stats = measure(searcher(name, expr_key), queries, args.concurrency, args.rounds)
+                ids_by_variant[label] = ids
+                results.append({"size": size, "variant": label, **stats})
+                print(f"  {label:<20} p50={stats['p50_ms']:7.1f}ms  p95={stats['p95_ms']:7.1f}ms  qps={stats['qps']:7.1f}")
+
+            # 路由只排除不可能符合的 partition，結果應與未路由時相同
+            same = sum(set(a) == set(b) for a, b in zip(ids_by_variant["partitioned"], ids_by_variant["partitioned+routed"]))
+            print(f"  路由前後結果一致: {same}/{len(queries)}")
+            results.append({"size": size, "variant": "routing_consistency", "identical": same, "queries": len(queries)})
+        finally:
+            if not args.keep:
+                for name in names.values():
+                    client.drop_collection(name)
+
+    print("\n=== 路由後 p95 相對於不分區 ===")
+    for size in args.sizes:
+        by_variant = {r["variant"]: r for r in results if r["size"] == size}
+        plain, routed = by_variant["plain"]["p95_ms"], by_variant["partitioned+routed"]["p95_ms"]
+        print(f"  {size:>8} 筆  {plain:7.1f}ms -> {routed:7.1f}ms  ({routed / plain - 1:+.0%})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"dimension": args.dimension, "dim": args.dim, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
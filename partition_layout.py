@@ -0,0 +1,164 @@
+"""
+以 metadata 維度 (例如 subsidy_type 或 edu_system) 作為 Milvus partition key 的資料配置。
+
+每份文件依所選維度的主要值 (config.json 中列出的第一個值) 寫入 partition_tag 欄位，
+Milvus 以 partition key 將相同 tag 的資料放在同一個 partition。
+文件的 metadata 是多值陣列，只用主要值分區時，其他值會散落在別的 partition，
+因此 ingest 時另外記錄每個 tag 下所有文件出現過的值 (partition_layout.json)；
+查詢時只保留值集合與過濾條件有交集的 tag，路由後的結果與掃描全部 partition 完全相同。
+配置記錄建立時的 collection 識別 (collection_id)，collection 重新建立後舊的配置不再使用。
+
+用法:
+    python partition_layout.py            # 比較各維度作為 partition key 時，單一值過濾平均需要掃描的文件比例
+"""
+import json
+import os
+
+PARTITION_FIELD = "partition_tag"
+DIMENSIONS = ("subsidy_type", "edu_system", "status")
+# 所選維度沒有值的文件
+NONE_TAG = "_none"
+# partition key 對應的實體 partition 數 (tag 以 hash 分配到這些 partition)
+DEFAULT_NUM_PARTITIONS = 16
+
+
+def partition_tag(meta: dict, dimension: str) -> str:
+    """文件的 partition tag：所選維度的第一個值"""
+    values = meta.get(dimension) or []
+    return values[0] if values else NONE_TAG
+
+
+def build_layout(metadata: dict, dimension: str, collection_name: str, collection_identity: str | None = None) -> dict:
+    """由 config.json 的 metadata 建立 partition 配置：tag -> 該 tag 下所有文件在此維度出現過的值"""
+    partitions: dict[str, set] = {}
+    documents: dict[str, int] = {}
+    for meta in metadata.values():
+        tag = partition_tag(meta, dimension)
+        partitions.setdefault(tag, set()).update(meta.get(dimension) or [])
+        documents[tag] = documents.get(tag, 0) + 1
+    return {
+        "collection": collection_name,
+        "collection_identity": collection_identity,
+        "field": PARTITION_FIELD,
+        "dimension": dimension,
+        "partitions": {tag: sorted(values) for tag, values in sorted(partitions.items())},
+        "documents": documents,
+    }
+
+
+def save_layout(path: str, layout: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(layout, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def remove_layout(path: str):
+    """collection 改為不分區時移除舊的配置，避免查詢端加上不存在欄位的條件"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_layout(path: str, collection_name: str, collection_identity: str | None = None) -> dict | None:
+    """
+    讀取 ingest 腳本寫入的 partition 配置。
+    檔案不存在、格式錯誤或屬於其他 collection 時回傳 None (不做路由)；
+    有 collection_identity 時，配置必須是為這個 collection 實體建立的。
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ 無法讀取 partition 配置 '{path}'，不做 partition 路由: {e}")
+        return None
+    if layout.get("collection") != collection_name or layout.get("dimension") not in DIMENSIONS:
+        print(f"⚠️ partition 配置 '{path}' 不屬於 collection '{collection_name}'，不做 partition 路由")
+        return None
+    if collection_identity is not None and layout.get("collection_identity") != collection_identity:
+        print(f"⚠️ partition 配置 '{path}' 不是為目前的 collection ({collection_identity}) 建立的，不做 partition 路由")
+        return None
+    return layout
+
+
+class CurrentLayout:
+    """
+    目前 collection 對應的 partition 配置。
+    collection 在服務執行中重新 ingest (改變分區維度或不再分區) 時 collection_identity 會改變，
+    此時重新讀取配置檔；配置不屬於目前的 collection 時不做路由，避免以過期的 tag 過濾而得到空的或不完整的結果。
+    """
+
+    def __init__(self, path: str, collection_name: str):
+        self.path = path
+        self.collection_name = collection_name
+        self._key = None
+        self._layout: dict | None = None
+
+    def get(self, collection_identity: str | None) -> dict | None:
+        """回傳配置；無法確認 collection 版本時不做路由 (同步讀檔，請在 asyncio.to_thread 中執行)"""
+        if collection_identity is None:
+            return None
+        try:
+            mtime = os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            mtime = None
+        # ingest 會先建立 collection 再寫入配置，檔案更新時也要重新讀取
+        key = (collection_identity, mtime)
+        if key != self._key:
+            self._key = key
+            self._layout = load_layout(self.path, self.collection_name, collection_identity)
+        return self._layout
+
+
+def route(layout: dict | None, filters: dict | None) -> list[str] | None:
+    """
+    回傳需要搜尋的 partition tag。
+    沒有配置或過濾條件不含分區維度時回傳 None (搜尋全部 partition)；
+    回傳空 list 表示沒有任何文件符合過濾條件。
+    """
+    if not layout or not filters:
+        return None
+    wanted = filters.get(layout["dimension"])
+    if not isinstance(wanted, list) or not wanted:
+        return None
+    wanted = set(wanted)
+    return [tag for tag, values in layout["partitions"].items() if wanted & set(values)]
+
+
+def partition_expr(tags: list[str], field: str = PARTITION_FIELD) -> str:
+    values_str = ", ".join(json.dumps(tag, ensure_ascii=False) for tag in tags)
+    return f"{field} in [{values_str}]"
+
+
+def routed_expr(layout: dict | None, filters: dict | None, expr: str | None) -> tuple[str | None, list[str] | None]:
+    """在原本的過濾 expr 加上 partition key 條件，Milvus 只會搜尋這些 tag 所在的 partition"""
+    tags = route(layout, filters)
+    if tags is None:
+        return expr, None
+    clause = partition_expr(tags, layout.get("field", PARTITION_FIELD))
+    return (f"{clause} and {expr}" if expr else clause), tags
+
+
+def describe(metadata: dict, schema: dict):
+    """各維度作為 partition key 時，以該維度的每個值單獨過濾平均需要掃描的文件比例 (越低越好)"""
+    total = len(metadata)
+    print(f"共 {total} 份文件")
+    for dimension in DIMENSIONS:
+        layout = build_layout(metadata, dimension, "")
+        fractions = []
+        for value in schema.get(dimension, []):
+            tags = route(layout, {dimension: [value]})
+            fractions.append(sum(layout["documents"][tag] for tag in tags) / total if total else 0.0)
+        average = sum(fractions) / len(fractions) if fractions else 1.0
+        print(f"  {dimension:<13} partitions={len(layout['partitions']):>3}  平均掃描比例={average:.0%}")
+
+
+if __name__ == "__main__":
+    with open("config.json", "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    with open("metadata_schema.json", "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    describe(metadata, schema)
@@ -37,6 +37,23 @@ assistant: 申請流程是...
 {question}
 
 重構後的問題:
+""",
+        'history_summary_label': "先前對話摘要",
+        'summary_system': """你負責維護一段對話的精簡摘要，這份摘要會取代完整的對話紀錄，用來理解使用者之後的追問 (例如「它」、「那個」指的是哪一個獎學金)。
+
+**規則:**
+- 將「目前的摘要」與「新的對話」合併成一份新的摘要。
+- 保留使用者提到或詢問過的獎助學金名稱、學制、身分別等具體實體，以及最近討論的主題。
+- 不要保留回答的細節內容 (金額、流程、文件等)，之後需要時會重新檢索。
+- 以條列方式輸出，總長度不超過 150 字。只輸出摘要本身。
+""",
+        'summary_user': """目前的摘要:
+{summary}
+
+新的對話:
+{turns_str}
+
+新的摘要:
 """,
         'rag_system': """你是一個專業的慈濟大學獎學金問答助理。你的任務是根據提供的「檢索內容」來回答「使用者問題」。
 
@@ -133,6 +150,23 @@ Latest User Question:
 {question}
 
 Rephrased Question:
+""",
+        'history_summary_label': "Summary of earlier conversation",
+        'summary_system': """You maintain a compact summary of a conversation. The summary replaces the full transcript and is used to understand the user's follow-up questions (e.g. which scholarship "it" or "that one" refers to).
+
+**Rules:**
+- Merge the "Current Summary" and the "New Conversation" into a new summary.
+- Keep the concrete entities the user mentioned or asked about: scholarship and grant names, education systems, student status, and the topic most recently discussed.
+- Do not keep the details of the answers (amounts, procedures, documents); they will be retrieved again when needed.
+- Output bullet points, at most 80 words in total. Output only the summary.
+""",
+        'summary_user': """Current Summary:
+{summary}
+
+New Conversation:
+{turns_str}
+
+New Summary:
 """,
         'rag_system': """You are a professional Tzu Chi University scholarship Q&A assistant. Your task is to answer the "User Question" based on the provided "Retrieved Content".
 
@@ -1,193 +1,308 @@
 # ------------------------------- 載入環境變數 -------------------------------
 import os
+import sys
 import json
+import time
+import subprocess
+import hashlib
+from itertools import islice
 
 # ------------------------------- 準備資料 -------------------------------
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from glob import glob
 from openai import OpenAI
 # from pymilvus import model
 from tqdm import tqdm
 from dotenv import load_dotenv
+import vector_repr
+from chunker import iter_chunks
+from partition_layout import PARTITION_FIELD, DEFAULT_NUM_PARTITIONS, DIMENSIONS, partition_tag, build_layout, save_layout, remove_layout
+from collection_version import collection_identity
 
 load_dotenv()
 zilliz_api_key = os.getenv("ZILLIZ_API_KEY")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 # gemini_api_key = os.getenv("GEMINI_API_KEY")
 openai_client = OpenAI(api_key=openai_api_key)
+# 向量維度與儲存精度，必須與查詢端 (config.EMBEDDING_DIM / VECTOR_PRECISION) 一致
+embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+embedding_dim = int(os.getenv("EMBEDDING_DIM", "1536"))
+vector_precision = os.getenv("VECTOR_PRECISION", "float32")
+vector_repr.validate(embedding_model, embedding_dim, vector_precision)
+# 以哪個 metadata 維度作為 partition key (subsidy_type / edu_system / status)，空字串表示不分區
+# 查詢端依 MILVUS_PARTITION_LAYOUT 檔案只搜尋符合過濾條件的 partition
+partition_dimension = os.getenv("MILVUS_PARTITION_DIMENSION", "").strip()
+partition_count = int(os.getenv("MILVUS_NUM_PARTITIONS", str(DEFAULT_NUM_PARTITIONS)))
+partition_layout_file = os.getenv("MILVUS_PARTITION_LAYOUT", "partition_layout.json")
+if partition_dimension and partition_dimension not in DIMENSIONS:
+    raise ValueError(f"MILVUS_PARTITION_DIMENSION 必須是 {', '.join(DIMENSIONS)} 之一: {partition_dimension}")
 # gemini_ef = model.dense.GeminiEmbeddingFunction(
 #     model_name='gemini-embedding-001', # 指定您要的模型
 #     api_key=gemini_api_key,
 # )
 def emb_text(text):
     return (
-        openai_client.embeddings.create(input=text, model="text-embedding-3-small")
+        openai_client.embeddings.create(input=text, model=embedding_model,
+                                        **vector_repr.embedding_kwargs(embedding_model, embedding_dim))
         .data[0]
         .embedding
         # gemini_ef.encode_documents([text])[0]
     )
 
-with open("config.json", "r", encoding="utf-8") as f:
-    config = json.load(f)
-
-data = []
-doc_id = 0
-
-for file_path in glob("milvus_docs/**/*.md", recursive=True):
-    with open(file_path, "r", encoding="utf-8") as file:
-        file_text = file.read()
-    # text_lines = file_text.split("# ")
-    # text_lines = [line.strip() for line in text_lines if line.strip()] # 過濾空白內容
-    
-
-    meta = config.get(os.path.basename(file_path), {})
-
-    # 使用 RecursiveCharacterTextSplitter 進行切割
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_text(file_text)
-    text_lines = [chunk.strip() for chunk in chunks if chunk.strip()] # 過濾空白內容
+def emb_texts(texts, max_retries=3):
+    """一次請求產生整批文字的向量，暫時性錯誤會以指數退避重試"""
+    for attempt in range(max_retries):
+        try:
+            resp = openai_client.embeddings.create(input=texts, model=embedding_model,
+                                                   **vector_repr.embedding_kwargs(embedding_model, embedding_dim))
+            return [item.embedding for item in sorted(resp.data, key=lambda item: item.index)]
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise
+            print(f"⚠️ Embedding 失敗，{2 ** attempt} 秒後重試: {e}")
+            time.sleep(2 ** attempt)
+
+# ------------------------------- 分批與 checkpoint -------------------------------
+# 每批 chunk 一次產生 embedding 並寫入 Milvus，記憶體中最多只有一批資料
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# 記錄已完成的批次；中斷後重新執行會跳過這些批次，不會重新產生 embedding
+CHECKPOINT_FILE = os.getenv("INGEST_CHECKPOINT_FILE", "ingest_checkpoint.json")
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def ingest_fingerprint(file_paths, metadata, collection_name):
+    """
+    文件內容、metadata 與切塊 / 向量設定的雜湊。
+    任何一項改變都會讓 chunk 的 id 或內容不同，舊的 checkpoint 就不能沿用。
+    """
+    digest = hashlib.sha256()
+    settings = [collection_name, CHUNK_SIZE, CHUNK_OVERLAP, BATCH_SIZE, embedding_model, embedding_dim, vector_precision,
+                partition_dimension, partition_count]
+    digest.update(json.dumps([settings, metadata], ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    for file_path in file_paths:
+        digest.update(file_path.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def load_checkpoint(fingerprint):
+    """回傳已完成的批次編號；checkpoint 不存在或屬於不同的輸入時回傳 None"""
+    try:
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("fingerprint") != fingerprint:
+        print("⚠️ 文件或設定已變更，忽略舊的 checkpoint，重新建立 collection。")
+        return None
+    return set(checkpoint.get("completed_batches", []))
+
+def save_checkpoint(fingerprint, completed_batches, total_rows):
+    """先寫入暫存檔再取代，避免中斷時留下不完整的 checkpoint"""
+    tmp_path = CHECKPOINT_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "fingerprint": fingerprint,
+            "batch_size": BATCH_SIZE,
+            "completed_batches": sorted(completed_batches),
+            "rows": total_rows,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+def build_rows(batch, metadata):
+    """為一批 (id, chunk) 產生 embedding 並加入來源資訊"""
+    vectors = emb_texts([chunk["text"] for _, chunk in batch])
+    rows = []
+    for (doc_id, chunk), vector in zip(batch, vectors):
+        meta = metadata.get(chunk["source_file"], {})
+        row = {
+            "id": doc_id,
+            "text": chunk["text"],
+            "source_file": chunk["source_file"], # 檔案名稱
+            "source_path": chunk["source_path"], # 完整路徑
+            "section_path": chunk["section_path"], # 標題路徑 (動態欄位)
+            "source_url": meta.get("source_url", ""),
+            "status": meta.get("status", []),
+            "edu_system": meta.get("edu_system", []),
+            "subsidy_type": meta.get("subsidy_type", []),
+            "vector": vector_repr.to_milvus(vector, vector_precision) # 向量嵌入
+        }
+        if partition_dimension:
+            row[PARTITION_FIELD] = partition_tag(meta, partition_dimension) # partition key
+        rows.append(row)
+    return rows
+
+def create_collection(milvus_client, collection_name, metadata):
+    """重新建立 collection 與索引 (索引在寫入資料前建立，之後寫入的資料會自動建立索引)"""
+    from pymilvus import DataType, Function, FunctionType
+    from index_config import DEFAULT_TARGET, add_indexes, for_target, load_index_config
+
+    # analyzer_params = {
+    #     "tokenizer": {
+    #         "type": "jieba",
+    #         "dict": ["_extend_default_"],
+    #         "mode": "search",
+    #         "hmm": True
+    #     },
+    #     "filter":["cnalphanumonly"]
+    # }
+
+    # 建立 schema
+    schema = milvus_client.create_schema(
+        auto_id=False,
+        enable_dynamic_field=True
+    )
+    # schema.add_field("id", DataType.INT64, is_primary=True, analyzer_params=analyzer_params)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("text", DataType.VARCHAR, max_length=5000, enable_analyzer=True)
+    schema.add_field("source_file", DataType.VARCHAR, max_length=256)
+    schema.add_field("source_path", DataType.VARCHAR, max_length=2048)
+    schema.add_field("source_url", DataType.VARCHAR, max_length=200)
+    schema.add_field("status", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
+    schema.add_field("edu_system", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
+    schema.add_field("subsidy_type", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
+    schema.add_field("vector", vector_repr.milvus_vector_type(vector_precision), dim=embedding_dim)
+    schema.add_field("text_sparse", DataType.SPARSE_FLOAT_VECTOR, description="稀疏向量 text sparse embedding auto-generated by the built in BM25 function")
+    if partition_dimension:
+        # 所選維度的主要值作為 partition key，過濾查詢只需搜尋符合的 partition
+        schema.add_field(PARTITION_FIELD, DataType.VARCHAR, max_length=200, is_partition_key=True)
+
+    bm25_function = Function(
+        name="text_bm25_emb",
+        input_field_names=["text"],
+        output_field_names=["text_sparse"],
+        function_type=FunctionType.BM25,
+    )
+    schema.add_function(bm25_function)
+
+    # 若 collection 已存在則刪除
+    if milvus_client.has_collection(collection_name):
+        milvus_client.drop_collection(collection_name)
+
+    # 創建 collection
+    collection_kwargs = {"num_partitions": partition_count} if partition_dimension else {}
+    milvus_client.create_collection(
+        collection_name=collection_name,
+        schema=schema,
+        consistency_level="Bounded",
+        **collection_kwargs
+    )
 
-    url = meta.get("source_url", "")
-    statuses = meta.get("status", [])
-    edu_systems = meta.get("edu_system", [])
-    subsidy_types = meta.get("subsidy_type", [])
+    # 查詢端依這個檔案決定要搜尋哪些 partition；不分區時移除舊檔，避免引用不存在的欄位
+    if partition_dimension:
+        # 記錄 collection 識別，查詢端只在 collection 未重新建立時使用這份配置
+        info = milvus_client.describe_collection(collection_name=collection_name)
+        layout = build_layout(metadata, partition_dimension, collection_name, collection_identity(info))
+        save_layout(partition_layout_file, layout)
+        print(f"以 {partition_dimension} 分區: {len(layout['partitions'])} 個 partition tag，配置已寫入 {partition_layout_file}")
+    else:
+        remove_layout(partition_layout_file)
+
+    # 為 "vector" 與 "text_sparse" 欄位新增索引
+    # 索引類型與參數來自 index_sweep.py 產生的 index_config.json，沒有時使用 AUTOINDEX / DAAT_MAXSCORE
+    print("正在為 vector 欄位建立索引...")
+    index_params = milvus_client.prepare_index_params()
+    # 正式環境 (預設 Zilliz Serverless) 不支援的索引類型改用 AUTOINDEX
+    index_config = for_target(
+        load_index_config(os.getenv("MILVUS_INDEX_CONFIG", "index_config.json")),
+        os.getenv("MILVUS_INDEX_TARGET", DEFAULT_TARGET),
+    )
+    print(f"索引設定: vector={index_config['dense']['index_type']} {index_config['dense']['params']}, "
+          f"text_sparse={index_config['sparse']['params']}")
+    add_indexes(index_params, index_config)
 
-    # 為每個文字段落加入來源資訊
-    for line in tqdm(text_lines, desc=f"Processing(Creating embeddings) {os.path.basename(file_path)}"):
-        data.append({
-            "id": doc_id,
-            "text": line,
-            "source_file": os.path.basename(file_path), # 檔案名稱
-            "source_path": file_path, # 完整路徑
-            "source_url":url,
-            "status": statuses,
-            "edu_system": edu_systems,
-            "subsidy_type":subsidy_types,
-            "vector": emb_text(line) # 向量嵌入
-        })
-        doc_id += 1
-
-print(f"總共讀取到 {len(data)} 筆文本資料")
-
-# ------------------------------- 嵌入模型 -------------------------------
-
-
-test_embedding = emb_text("Hello, world!")
-embedding_dim = len(test_embedding)
-print(f"Embedding維度: {embedding_dim}, 前10個值: {test_embedding[:10]} ...")
-
-# ------------------------------- 將資料載入Milvus向量資料庫 -------------------------------
-
-# ========建立資料========
-from pymilvus import MilvusClient, DataType, Function, FunctionType
-
-CLUSTER_ENDPOINT="https://in03-a6f08ce2ff778ed.serverless.gcp-us-west1.cloud.zilliz.com:443"
-milvus_client = MilvusClient(
-                    uri=CLUSTER_ENDPOINT,
-                    token=zilliz_api_key,
-                    )
-
-collection_name = "rag5_scholarships_hybrid_bm25"
-
-# analyzer_params = {
-#     "tokenizer": {
-#         "type": "jieba",
-#         "dict": ["_extend_default_"],
-#         "mode": "search",
-#         "hmm": True
-#     },
-#     "filter":["cnalphanumonly"]
-# }
+    milvus_client.create_index(
+        collection_name=collection_name,
+        index_params=index_params
+    )
+    print("索引建立完成。")
+
+def main():
+    with open("config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    # ------------------------------- 將資料載入Milvus向量資料庫 -------------------------------
+    from pymilvus import MilvusClient
+
+    CLUSTER_ENDPOINT="https://in03-a6f08ce2ff778ed.serverless.gcp-us-west1.cloud.zilliz.com:443"
+    milvus_client = MilvusClient(
+                        uri=CLUSTER_ENDPOINT,
+                        token=zilliz_api_key,
+                        )
+
+    collection_name = "rag5_scholarships_hybrid_bm25"
+
+    file_paths = sorted(glob("milvus_docs/**/*.md", recursive=True))
+    fingerprint = ingest_fingerprint(file_paths, config, collection_name)
+    completed_batches = load_checkpoint(fingerprint)
+    if completed_batches is not None and milvus_client.has_collection(collection_name):
+        print(f"從 checkpoint 繼續：已完成 {len(completed_batches)} 批，將跳過這些批次。")
+    else:
+        completed_batches = set()
+        create_collection(milvus_client, collection_name, config)
+        save_checkpoint(fingerprint, completed_batches, 0)
+
+    print(f"Embedding維度: {embedding_dim}, 儲存精度: {vector_precision}, 每批 {BATCH_SIZE} 筆")
+
+    # ========分批建立與插入資料========
+    # 依標題與清單結構切塊，多個檔案以 process pool 平行處理，依檔案順序逐筆產生 chunk
+    # chunk 順序固定，因此 id 與批次編號在重新執行時不變
+    chunks = iter_chunks(file_paths, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    total_rows = 0
+    progress = tqdm(desc="Processing(Creating embeddings)", unit="chunk")
+    for batch_index, batch in enumerate(batched(enumerate(chunks), BATCH_SIZE)):
+        total_rows += len(batch)
+        progress.update(len(batch))
+        if batch_index in completed_batches:
+            continue
+        rows = build_rows(batch, config)
+        # upsert：若上次在寫入後、記錄 checkpoint 前中斷，重做這批也不會產生重複的 id
+        milvus_client.upsert(collection_name=collection_name, data=rows)
+        completed_batches.add(batch_index)
+        save_checkpoint(fingerprint, completed_batches, total_rows)
+    progress.close()
+
+    print(f"總共讀取到 {total_rows} 筆文本資料")
+
+    # ------------------------------- 修正後的流程 -------------------------------
+
+    # 載入集合至記憶體
+    print("正在將集合加載到記憶體...")
+    milvus_client.load_collection(collection_name=collection_name)
+    print("集合已成功載入到記憶體。")
+
+    # 驗證資料是否已存在且可查詢
+    stats = milvus_client.get_collection_stats(collection_name=collection_name)
+    print(f"\n集合 '{collection_name}' 的統計資訊: {stats}")
+
+    # 執行一個簡單的查詢來確認資料可讀取
+    query_res = milvus_client.query(
+        collection_name=collection_name,
+        filter='array_contains(status, "原住民") and array_contains(edu_system, "大學部")',
+        output_fields=["id", "source_file"]
+    )
+    print(f"\n執行查詢驗證，成功取回 {len(query_res)} 筆資料:")
+    print(query_res)
 
+    # 全部完成後移除 checkpoint，下次執行會重新建立 collection
+    os.remove(CHECKPOINT_FILE)
 
-# 建立 schema
-schema = milvus_client.create_schema(
-    auto_id=False,
-    enable_dynamic_field=True
-)
-# schema.add_field("id", DataType.INT64, is_primary=True, analyzer_params=analyzer_params)
-schema.add_field("id", DataType.INT64, is_primary=True)
-schema.add_field("text", DataType.VARCHAR, max_length=5000, enable_analyzer=True)
-schema.add_field("source_file", DataType.VARCHAR, max_length=256)
-schema.add_field("source_path", DataType.VARCHAR, max_length=2048)
-schema.add_field("source_url", DataType.VARCHAR, max_length=200)
-schema.add_field("status", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
-schema.add_field("edu_system", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
-schema.add_field("subsidy_type", DataType.ARRAY, element_type=DataType.VARCHAR, max_capacity=200, max_length=200, nullable=True)
-schema.add_field("vector", DataType.FLOAT_VECTOR, dim=1536)
-schema.add_field("text_sparse", DataType.SPARSE_FLOAT_VECTOR, description="稀疏向量 text sparse embedding auto-generated by the built in BM25 function")
-
-bm25_function = Function(
-    name="text_bm25_emb",
-    input_field_names=["text"],
-    output_field_names=["text_sparse"],
-    function_type=FunctionType.BM25,
-)
-schema.add_function(bm25_function)
-
-# 若 collection 已存在則刪除
-if milvus_client.has_collection(collection_name):
-    milvus_client.drop_collection(collection_name)
-
-# 創建 collection
-milvus_client.create_collection(
-    collection_name=collection_name,
-    schema=schema,
-    consistency_level="Bounded"
-)
-
-# ========插入資料========
-insert_result = milvus_client.insert(collection_name=collection_name, data=data)
-print(f"插入結果: {insert_result}")
-
-# ------------------------------- 修正後的流程 -------------------------------
-
-# 1. 為 vector 欄位建立索引 (必須在 load 之前)
-print("正在為 vector 欄位建立索引...")
-index_params = milvus_client.prepare_index_params()
-
-# 為名為 "vector" 的欄位新增索引
-index_params.add_index(
-    field_name="vector",
-    index_name="vector_index",
-    index_type="AUTOINDEX",  # 讓 Milvus 自動選擇最佳索引類型
-    metric_type="COSINE"      # 設定向量距離的計算方式，L2 (歐氏距離) 是最常用的
-)
-
-index_params.add_index(
-    field_name="text_sparse",
-    index_name="text_sparse_index",
-    index_type="SPARSE_INVERTED_INDEX",
-    metric_type="BM25",
-    params={"inverted_index_algo": "DAAT_MAXSCORE"}
-)
-
-milvus_client.create_index(
-    collection_name=collection_name,
-    index_params=index_params
-    
-)
-print("索引建立完成。")
-
-# 2. 載入集合至記憶體 (現在可以成功了)
-print("正在將集合加載到記憶體...")
-milvus_client.load_collection(collection_name=collection_name)
-print("集合已成功載入到記憶體。")
-
-# 3. 驗證資料是否已存在且可查詢
-stats = milvus_client.get_collection_stats(collection_name=collection_name)
-print(f"\n集合 '{collection_name}' 的統計資訊: {stats}")
-
-# 執行一個簡單的查詢來確認資料可讀取
-query_res = milvus_client.query(
-    collection_name=collection_name,
-    filter='array_contains(status, "原住民") and array_contains(edu_system, "大學部")',
-    output_fields=["id", "source_file"]
-)
-print(f"\n執行查詢驗證，成功取回 {len(query_res)} 筆資料:")
-print(query_res)
+    # 資料已更新，重建預先計算的 FAQ 答案 (舊答案的 collection 版本不同，服務已不會使用)
+    if os.getenv("FAQ_REBUILD_AFTER_INGEST", "true").lower() in ("1", "true", "yes"):
+        print("\n正在重建 FAQ 答案...")
+        result = subprocess.run([sys.executable, "build_faq_store.py"])
+        if result.returncode != 0:
+            print("⚠️ FAQ 重建失敗，可稍後手動執行 python build_faq_store.py")
 
 
+# chunker 使用 process pool，必須以 __main__ 保護避免子行程重新執行整個 ingest
+if __name__ == "__main__":
+    main()
 
 
 # ------------------------------- 建立 RAG -------------------------------
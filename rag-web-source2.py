@@ -4,10 +4,10 @@ import json
 import config
 
 # ------------------------------- 準備資料 -------------------------------
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from glob import glob
 from openai import OpenAI
 from tqdm import tqdm
+from chunker import chunk_file
 
 openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
 # gemini_ef = model.dense.GeminiEmbeddingFunction(
@@ -29,18 +29,10 @@ data = []
 doc_id = 0
 
 for file_path in glob("milvus_docs/**/*.md", recursive=True):
-    with open(file_path, "r", encoding="utf-8") as file:
-        file_text = file.read()
-    # text_lines = file_text.split("# ")
-    # text_lines = [line.strip() for line in text_lines if line.strip()] # 過濾空白內容
-    
-
     meta = config.get(os.path.basename(file_path), {})
 
-    # 使用 RecursiveCharacterTextSplitter 進行切割
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_text(file_text)
-    text_lines = [chunk.strip() for chunk in chunks if chunk.strip()] # 過濾空白內容
+    # 依標題與清單結構切塊 (這個腳本沒有 __main__ 保護，因此不使用 iter_chunks 的 process pool)
+    chunks = chunk_file(file_path, chunk_size=1000, chunk_overlap=200)
 
     url = meta.get("source_url", "")
     statuses = meta.get("status", [])
@@ -48,17 +40,18 @@ for file_path in glob("milvus_docs/**/*.md", recursive=True):
     subsidy_types = meta.get("subsidy_type", [])
 
     # 為每個文字段落加入來源資訊
-    for line in tqdm(text_lines, desc=f"Processing(Creating embeddings) {os.path.basename(file_path)}"):
+    for chunk in tqdm(chunks, desc=f"Processing(Creating embeddings) {os.path.basename(file_path)}"):
         data.append({
             "id": doc_id,
-            "text": line,
+            "text": chunk["text"],
             "source_file": os.path.basename(file_path), # 檔案名稱
             "source_path": file_path, # 完整路徑
+            "section_path": chunk["section_path"], # 標題路徑 (動態欄位)
             "source_url":url,
             "status": statuses,
             "edu_system": edu_systems,
             "subsidy_type":subsidy_types,
-            "vector": emb_text(line) # 向量嵌入
+            "vector": emb_text(chunk["text"]) # 向量嵌入
         })
         doc_id += 1
 
@@ -0,0 +1,306 @@
+"""
+判斷新訊息是否需要依對話歷史重構，可以確定不需要時略過重構的 LLM 呼叫。
+
+規則 (依序):
+1. 寒暄、道謝等非問題訊息 (與本地寒暄回覆共用 locales/small_talk.json 的片語)：不需要 (重構 prompt 也會原樣返回)。
+2. 代名詞、指示詞或省略句型 (「它」、「那...呢」、"what about ..."): 需要。
+3. 提到特定的獎助學金 (已知名稱、或「急難助學金」這類有修飾語的名稱): 不需要。
+4. 泛稱的獎助學金 ("有哪些獎學金"、"any scholarships"): 不需要；
+   但以泛稱當主詞 (「補助會取消嗎」、"the grant") 通常是在指前文提到的那一項，需要。
+5. 完全沒有提到主題的短問題 (「金額是多少」、"when is the deadline"): 需要。
+無法確定時一律交給 LLM，誤判只會多一次呼叫，不會影響回答品質。
+
+離線準確度報告 (與紀錄中 LLM 的重構結果比較):
+標準答案是「LLM 重構後的問題是否比原問題多了實質內容」，與上面的規則無關。
+紀錄中沒有對話歷史，LLM 自行補充的說明 (例如「申請條件和流程」) 也會算成需要重構，false negative 是上限。
+    python rephrase_detector.py --report
+    python rephrase_detector.py --report --source postgres --limit 500 --show-errors
+"""
+import argparse
+import functools
+import json
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+
+from small_talk import is_small_talk
+
+_CJK_RE = re.compile(r"[一-鿿]")
+_PUNCTUATION_RE = re.compile(r"[\s?？!！。.,，、~～:：;；\"'「」()（）]+")
+
+# --- 中文 ---
+# 代名詞與指示詞
+_ZH_REFERENCE_CUES = (
+    "它", "他們", "她", "這個", "那個", "這些", "那些", "這項", "那項", "這筆", "那筆", "該項", "該獎", "該補助",
+    "其中", "上述", "上面", "前面", "剛剛", "剛才", "前者", "後者", "另一個", "第一個", "第二個", "第三個",
+)
+# 承接前文的開頭，例如「那金額大概多少？」「還有呢？」
+_ZH_ELLIPSIS_PREFIXES = ("那", "那麼", "還有", "另外", "至於", "然後", "所以", "而且")
+# 較弱的承接詞，只有在沒有提到特定獎助學金時才視為依賴前文
+_ZH_WEAK_CUES = ("也", "還是", "同時", "一樣", "同樣")
+# 獎助學金的泛稱，需要前面的修飾語才能確定是哪一項
+_ZH_TOPIC_SUFFIXES = ("獎助學金", "獎學金", "助學金", "獎助金", "補助金", "獎勵金", "補助", "津貼", "獎勵", "助學")
+# 本身就是特定項目的名稱
+_ZH_SPECIFIC_TOPICS = ("工讀", "就學貸款", "學貸", "減免", "生活費", "學雜費", "住宿")
+# 泛稱前面出現這些字時是在詢問有哪些 (存在句)，問題本身是完整的
+_ZH_EXISTENTIAL_CHARS = set("有些麼種的適合推薦關類")
+_ZH_TOPIC_RE = re.compile("|".join(_ZH_TOPIC_SUFFIXES))
+# 除了名稱本身，這些修飾語不代表特定的獎助學金
+_ZH_GENERIC_QUALIFIERS = ("大學", "慈濟", "校內", "申請", "相關", "其他", "提供")
+# 連接詞 (「獎助學金或補助」) 不是修飾語
+_ZH_CONJUNCTION_CHARS = set("或和與及跟")
+
+# --- English ---
+_EN_REFERENCE_WORDS = {"it", "its", "they", "them", "their", "this", "these", "those", "former", "latter", "above", "same"}
+_EN_REFERENCE_PHRASES = ("which one", "that one", "this one", "the first one", "the second one", "the other one")
+_EN_ELLIPSIS_PREFIXES = ("and ", "what about", "how about", "so ", "then ", "also ")
+_EN_TOPIC_RE = re.compile(
+    r"\b(scholarships?|grants?|subsid(?:y|ies)|financial aid|aid|loans?|allowances?|stipends?|work[- ]study|bursar(?:y|ies))\b"
+)
+_EN_EXISTENTIAL_WORDS = {"any", "some", "what", "which", "a", "an", "available", "other", "many", "all"}
+_EN_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+@functools.lru_cache(maxsize=1)
+def _known_names(metadata_path: str = "config.json") -> tuple[str, ...]:
+    """由檔案 metadata 的來源名稱產生獎助學金名稱與常見簡稱，例如「學生急難助學金(校內)」→「急難助學金」"""
+    try:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            file_names = list(json.load(f))
+    except (OSError, ValueError):
+        return ()
+    names = set()
+    for file_name in file_names:
+        title = re.sub(r"\.(md|txt)$", "", file_name)
+        title = re.sub(r"[(（][^)）]*[)）]", "", title).replace("奬", "獎")
+        title = re.sub(r"(辦法|資訊|辦理資訊)$", "", title)
+        for part in [title, *title.split("-")]:
+            for prefix in ("", "慈濟大學", "學生", "新北市", "桃園市"):
+                if prefix and not part.startswith(prefix):
+                    continue
+                alias = part[len(prefix):]
+                if len(alias) >= 3:
+                    names.add(alias)
+    return tuple(sorted(names, key=len, reverse=True))
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("奬", "獎")
+    return _PUNCTUATION_RE.sub(" ", text).strip()
+
+
+def _is_specific_qualifier(qualifier: str) -> bool:
+    """泛稱前面的兩個字是否把它限定成特定的一項，例如「急難」助學金、「弱勢」助學"""
+    return (len(qualifier) == 2 and all(_CJK_RE.match(ch) for ch in qualifier)
+            and qualifier[-1] not in _ZH_EXISTENTIAL_CHARS and qualifier[-1] not in _ZH_CONJUNCTION_CHARS
+            and qualifier not in _ZH_GENERIC_QUALIFIERS)
+
+
+def _zh_topic(text: str) -> str | None:
+    """回傳 "specific" / "generic_existential" / "generic_definite"，沒有提到主題時回傳 None"""
+    if any(name in text for name in _known_names()) or any(topic in text for topic in _ZH_SPECIFIC_TOPICS):
+        return "specific"
+    kinds = []
+    for match in _ZH_TOPIC_RE.finditer(text):
+        qualifier = text[max(0, match.start() - 2):match.start()]
+        if _is_specific_qualifier(qualifier):
+            return "specific"
+        if qualifier in _ZH_GENERIC_QUALIFIERS or (
+                qualifier and (qualifier[-1] in _ZH_EXISTENTIAL_CHARS or qualifier[-1] in _ZH_CONJUNCTION_CHARS)):
+            kinds.append("generic_existential")
+        else:
+            kinds.append("generic_definite")
+    if not kinds:
+        return None
+    return "generic_existential" if "generic_existential" in kinds else "generic_definite"
+
+
+def _zh_needs_rephrasing(text: str) -> bool:
+    compact = text.replace(" ", "")
+    if any(cue in compact for cue in _ZH_REFERENCE_CUES):
+        return True
+    if compact.startswith(_ZH_ELLIPSIS_PREFIXES) or compact.endswith("呢"):
+        return True
+    # 保留標點位置的空白，修飾語不會跨越子句
+    topic = _zh_topic(text)
+    if topic == "specific":
+        return False
+    if any(cue in compact for cue in _ZH_WEAK_CUES):
+        return True
+    return topic != "generic_existential"
+
+
+def _en_topic(text: str) -> str | None:
+    words = _EN_WORD_RE.findall(text)
+    kinds = []
+    for match in _EN_TOPIC_RE.finditer(text):
+        previous = _EN_WORD_RE.findall(text[:match.start()])
+        previous_word = previous[-1] if previous else ""
+        if previous_word in ("the", "that", "this"):
+            kinds.append("generic_definite")
+        elif previous_word and previous_word not in _EN_EXISTENTIAL_WORDS and previous_word not in ("for", "of", "to", "apply", "get"):
+            return "specific"
+        else:
+            kinds.append("generic_existential")
+    if not kinds:
+        return None
+    if "generic_definite" in kinds and len(words) < 8:
+        return "generic_definite"
+    return "generic_existential"
+
+
+def _en_needs_rephrasing(text: str) -> bool:
+    words = _EN_WORD_RE.findall(text)
+    if any(word in _EN_REFERENCE_WORDS for word in words) or any(phrase in text for phrase in _EN_REFERENCE_PHRASES):
+        return True
+    if text.startswith(_EN_ELLIPSIS_PREFIXES):
+        return True
+    topic = _en_topic(text)
+    if topic == "specific":
+        return False
+    if any(word in ("also", "too", "either") for word in words):
+        return True
+    return topic != "generic_existential"
+
+
+def needs_rephrasing(question: str) -> bool:
+    """
+    新訊息是否需要依對話歷史重構。只有確定問題可以獨立理解時才回傳 False。
+    含中文時使用中文規則，否則使用英文規則 (英文介面的使用者也可能輸入中文)。
+    """
+    text = _normalize(question)
+    if not text or is_small_talk(question):
+        return False
+    if _CJK_RE.search(text):
+        return _zh_needs_rephrasing(text)
+    return _en_needs_rephrasing(text)
+
+
+# --- 離線準確度報告 ---
+
+# 重構時常見、不代表補上前文資訊的字詞 (語氣、疑問詞、校名)。標準答案只看重構增加了多少內容，不使用上面的偵測規則，
+# 否則報告只是在驗證規則與自己一致
+_LABEL_ZH_FILLERS_RE = re.compile(
+    r"獎助學金或補助|慈濟大學|本校|想請問|請問|作為|身為|根據|可以|能夠|需要|哪些|哪個|什麼|甚麼|如何|怎麼|多少|關於|有關|是否|您|你|我|請|的|了|嗎|呢|吧|是|有|要"
+)
+_LABEL_EN_FILLERS = {
+    "please", "what", "which", "how", "when", "where", "is", "are", "was", "the", "a", "an", "do", "does", "can", "could",
+    "i", "you", "my", "about", "for", "of", "to", "in", "on", "and", "or", "there", "any", "tzu", "chi", "university",
+}
+_LABEL_EN_WORD_RE = re.compile(r"[a-z0-9]+")
+# 增加的內容 (去掉語氣詞後) 至少有這麼多個原問題沒有的中文字或一個英文單字，才算補上了原問題沒有的資訊
+LABEL_MIN_ADDED_CJK = 3
+
+
+def rephrase_was_needed(question: str, rephrased_question: str | None) -> bool:
+    """
+    以紀錄中 LLM 的重構結果作為標準答案：重構後的問題補上了原問題沒有的內容才算需要重構。
+    以字元 (英文以單字) 為單位比較，只改語序、標點、語氣或疑問詞 (例如加上「請問」「是什麼」) 不算。
+    """
+    if not rephrased_question:
+        return False
+    original, rephrased = _normalize(question), _normalize(rephrased_question)
+    added_cjk = Counter(_CJK_RE.findall(_LABEL_ZH_FILLERS_RE.sub("", rephrased))) - Counter(_CJK_RE.findall(original))
+    original_words = set(_LABEL_EN_WORD_RE.findall(original))
+    added_words = [
+        word for word in _LABEL_EN_WORD_RE.findall(rephrased)
+        if word not in original_words and word not in _LABEL_EN_FILLERS
+    ]
+    return sum(added_cjk.values()) >= LABEL_MIN_ADDED_CJK or bool(added_words)
+
+
+def load_rows(args) -> list:
+    query = f"""SELECT question, rephrased_question FROM {args.table}
+                WHERE question IS NOT NULL AND rephrased_question IS NOT NULL ORDER BY id DESC"""
+    if args.limit:
+        query += f" LIMIT {int(args.limit)}"
+    if args.source == "postgres":
+        import psycopg2
+        import config
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            dbname=config.DB_NAME,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD
+        )
+    else:
+        conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    return rows
+
+
+def report(rows: list, show_errors: bool = False) -> dict:
+    counts = {"tp": 0, "fp": 0, "tn": 0, "fn": 0}
+    errors = []
+    for question, rephrased_question in rows:
+        predicted = needs_rephrasing(question)
+        actual = rephrase_was_needed(question, rephrased_question)
+        key = ("t" if predicted == actual else "f") + ("p" if predicted else "n")
+        counts[key] += 1
+        if predicted != actual:
+            errors.append((key, question, rephrased_question))
+
+    total = len(rows)
+    skipped = counts["tn"] + counts["fn"]
+    result = {
+        "rows": total,
+        "accuracy": (counts["tp"] + counts["tn"]) / total if total else 0.0,
+        # 略過的呼叫中，LLM 其實會補上前文資訊的比例 (會影響回答品質的錯誤)
+        "missed_rephrase_rate": counts["fn"] / skipped if skipped else 0.0,
+        "llm_calls_skipped": skipped / total if total else 0.0,
+        **counts,
+    }
+
+    print(f"紀錄筆數: {total}")
+    print(f"準確度: {result['accuracy']:.1%}")
+    print(f"略過的 LLM 呼叫: {skipped} ({result['llm_calls_skipped']:.1%})")
+    print(f"略過但其實需要重構 (false negative): {counts['fn']} ({result['missed_rephrase_rate']:.1%} of skipped)")
+    print(f"多呼叫一次但不需要 (false positive): {counts['fp']}")
+    if show_errors:
+        for key, question, rephrased_question in errors:
+            print(f"  [{key}] {question} -> {rephrased_question}")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline accuracy report for the local needs-rephrasing detector.")
+    parser.add_argument("--report", action="store_true", help="與紀錄中 LLM 的重構結果比較")
+    parser.add_argument("--source", choices=["postgres", "sqlite"], default="sqlite", help="問答紀錄來源")
+    parser.add_argument("--db", default="evaluation.db", help="--source sqlite 時使用的資料庫檔案")
+    parser.add_argument("--table", default=None, help="問答紀錄資料表 (預設 sqlite 為 qa_logs，postgres 為 DB_TABLE_NAME)")
+    parser.add_argument("--limit", type=int, default=None, help="最多使用幾筆紀錄 (由新到舊)")
+    parser.add_argument("--show-errors", action="store_true", help="列出判斷錯誤的問題")
+    parser.add_argument("--json", default=None, help="將結果另存為 JSON 檔")
+    parser.add_argument("questions", nargs="*", help="直接判斷這些問題")
+    args = parser.parse_args()
+    if args.table is None:
+        if args.source == "postgres":
+            import config
+            args.table = config.DB_TABLE_NAME
+        else:
+            args.table = "qa_logs"
+    return args
+
+
+def main():
+    args = parse_args()
+    for question in args.questions:
+        print(f"{'rephrase' if needs_rephrasing(question) else 'skip':>8}  {question}")
+    if not args.report:
+        return
+    result = report(load_rows(args), show_errors=args.show_errors)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存到 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
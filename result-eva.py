@@ -1,6 +1,9 @@
 import sqlite3
 import json
+import hashlib
 import os
+import time
+import argparse
 import config
 import asyncio
 
@@ -15,6 +18,10 @@ from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 # --- Constants ---
 DB_FILE = "evaluation.db"
 TABLE_NAME = config.DB_TABLE_NAME
+# 記錄每個資料表已評估到哪一個 id，下次執行從這裡繼續
+WATERMARK_TABLE = "eval_watermarks"
+# 以內容雜湊快取各指標分數，重複的問答不必再呼叫 LLM
+SCORE_CACHE_FILE = "eval_score_cache.db"
 OPENAI_API_KEY = config.OPENAI_API_KEY
 
 # --- Ragas Components Initialization ---
@@ -34,54 +41,165 @@ faithfulness_metric = Faithfulness(llm=evaluator_llm)
 response_relevancy_metric = ResponseRelevancy(llm=evaluator_llm, embeddings=evaluator_embeddings)
 context_precision_metric = LLMContextPrecisionWithoutReference(llm=evaluator_llm)
 
-def fetch_unevaluated_data():
-    """從資料庫中獲取尚未評估的問答紀錄"""
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_FILE)
+# 指標名稱 -> (ragas metric, 影響分數的評估模型)，模型換了快取就不再適用
+METRICS = {
+    "faithfulness_score": (faithfulness_metric, config.OPENAI_MODEL_NAME),
+    "response_relevancy_score": (
+        response_relevancy_metric,
+        f"{config.OPENAI_MODEL_NAME}+{getattr(evaluator_embeddings, 'model', '')}",
+    ),
+    "context_precision_score": (context_precision_metric, config.OPENAI_MODEL_NAME),
+}
+
+class SqliteStore:
+    """本機 SQLite 評估資料庫 (evaluation.db)"""
+
+    placeholder = "?"
+
+    def __init__(self, db_file: str, table_name: str):
+        self.db_file = db_file
+        self.table_name = table_name
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file)
         # 使用 row_factory 讓每一行都像字典一樣方便存取
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
+        return conn
 
-        # 選擇 faithfulness_score 或新指標為空的紀錄，代表尚未評估
-        # This also handles rows that were partially evaluated before adding the new metric
-        cursor.execute(f"SELECT id, rephrased_question, answer, retrieved_contexts FROM {TABLE_NAME} WHERE faithfulness_score IS NULL")
-        rows = cursor.fetchall()
-        
-        print(f"找到 {len(rows)} 筆尚未評估的紀錄。")
-        return rows
+    def ensure_schema(self):
+        """確保分數欄位 (舊版資料庫沒有 context_precision_score) 與 watermark 資料表存在"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN context_precision_score REAL")
+                print("已成功新增 'context_precision_score' 欄位。")
+            except sqlite3.OperationalError:
+                # Column already exists, which is fine
+                pass
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL, updated_at TEXT)"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def window_condition(self, hours: float):
+        return "timestamp >= datetime('now', ?)", f"-{hours} hours"
+
+    def sample_condition(self, fraction: float):
+        # 以 id 雜湊取樣，同一筆紀錄在每次執行中都會得到相同的結果
+        return "((id * 2654435761) % 4294967296) % 10000 < ?", int(fraction * 10000)
+
+    def upsert_watermark_query(self) -> str:
+        return f"""INSERT INTO {WATERMARK_TABLE} (name, last_id, updated_at) VALUES (?, ?, datetime('now'))
+                   ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at"""
+
+    errors = (sqlite3.Error,)
+
+
+class PostgresStore:
+    """正式環境的 PostgreSQL 問答紀錄 (answer.log_to_db 寫入的資料表)"""
+
+    placeholder = "%s"
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+    def connect(self):
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+        return psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            dbname=config.DB_NAME,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            cursor_factory=RealDictCursor,
+        )
+
+    def ensure_schema(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS context_precision_score REAL")
+            cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                        name TEXT PRIMARY KEY,
+                        last_id BIGINT NOT NULL,
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    )"""
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def window_condition(self, hours: float):
+        return "timestamp >= now() - make_interval(secs => %s)", hours * 3600
+
+    def sample_condition(self, fraction: float):
+        # 以 id 雜湊取樣，同一筆紀錄在每次執行中都會得到相同的結果
+        return "(hashtext(id::text) & 2147483647) % 10000 < %s", int(fraction * 10000)
 
-    except sqlite3.Error as e:
+    def upsert_watermark_query(self) -> str:
+        return f"""INSERT INTO {WATERMARK_TABLE} (name, last_id, updated_at) VALUES (%s, %s, now())
+                   ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = EXCLUDED.updated_at"""
+
+    @property
+    def errors(self):
+        import psycopg2
+        return (psycopg2.Error,)
+
+
+def fetch_unevaluated_page(store, after_id: int, page_size: int, window_hours: float | None = None, sample: float | None = None):
+    """
+    以 keyset pagination 取得一頁尚未評估的問答紀錄 (id > after_id)。
+    每次只讀取一頁，記憶體用量與資料表大小無關。
+    """
+    p = store.placeholder
+    # 選擇 faithfulness_score 為空的紀錄，代表尚未評估
+    conditions = ["faithfulness_score IS NULL", f"id > {p}"]
+    params = [after_id]
+    if window_hours:
+        condition, param = store.window_condition(window_hours)
+        conditions.append(condition)
+        params.append(param)
+    if sample is not None and sample < 1:
+        condition, param = store.sample_condition(sample)
+        conditions.append(condition)
+        params.append(param)
+    params.append(page_size)
+
+    query = f"""SELECT id, rephrased_question, answer, retrieved_contexts FROM {store.table_name}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id LIMIT {p}"""
+
+    conn = None
+    try:
+        conn = store.connect()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+    except store.errors as e:
         print(f"[DB Error] 無法讀取資料庫: {e}")
         return []
     finally:
         if conn:
             conn.close()
 
-def update_scores_in_db(results_list):
-    """將評估分數更新回資料庫"""
+def update_scores_in_db(store, results_list, watermark: int | None = None):
+    """將評估分數更新回資料庫，並在同一個 transaction 中更新 watermark"""
     conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = store.connect()
         cursor = conn.cursor()
+        p = store.placeholder
 
-        # 新增 context_precision_score 欄位
-        # We can try to add the column if it doesn't exist
-        try:
-            cursor.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN context_precision_score REAL")
-            conn.commit()
-            print("已成功新增 'context_precision_score' 欄位。")
-        except sqlite3.OperationalError:
-            # Column already exists, which is fine
-            pass
-        
-
-        update_query = f'''UPDATE {TABLE_NAME} SET 
-                         faithfulness_score = ?,
-                         response_relevancy_score = ?,
-                         context_precision_score = ?
-                         WHERE id = ?'''
+        update_query = f'''UPDATE {store.table_name} SET 
+                         faithfulness_score = {p},
+                         response_relevancy_score = {p},
+                         context_precision_score = {p}
+                         WHERE id = {p}'''
         
         # results_list is a list of dicts: [{'id': 1, 'faithfulness_score': 1.0, ...}, ...]
         records_to_update = [
@@ -94,77 +212,344 @@ def update_scores_in_db(results_list):
             for res in results_list
         ]
 
-        cursor.executemany(update_query, records_to_update)
+        if records_to_update:
+            cursor.executemany(update_query, records_to_update)
+        if watermark is not None:
+            cursor.execute(store.upsert_watermark_query(), (store.table_name, watermark))
         conn.commit()
-        print(f"\n成功將 {len(records_to_update)} 筆評估分數更新至資料庫。")
+        if records_to_update:
+            print(f"[Checkpoint] 已將 {len(records_to_update)} 筆評估分數寫入資料庫。")
+        return True
 
-    except sqlite3.Error as e:
+    except store.errors as e:
         print(f"\n[DB Error] 更新分數時出錯: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def load_watermark(store) -> int:
+    """讀取上次執行完成到的 id，沒有紀錄時從頭開始"""
+    conn = None
+    try:
+        conn = store.connect()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT last_id FROM {WATERMARK_TABLE} WHERE name = {store.placeholder}", (store.table_name,))
+        row = cursor.fetchone()
+        return row["last_id"] if row else 0
     finally:
         if conn:
             conn.close()
 
 
-async def main():
-    """主執行函式"""
-    # 1. 從資料庫獲取資料
-    unevaluated_rows = fetch_unevaluated_data()
-    if not unevaluated_rows:
-        print("沒有需要評估的新資料。程式結束。")
-        return
+class AsyncRateLimiter:
+    """Token bucket：限制每分鐘開始評估的紀錄數，所有 worker 共用。"""
 
-    all_results = []
-    print(f"\n準備對 {len(unevaluated_rows)} 筆資料進行評估...")
+    def __init__(self, rows_per_minute: float):
+        self.rate = rows_per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
 
-    # 2. 迭代並評估每一筆紀錄
-    for i, row in enumerate(unevaluated_rows):
-        try:
-            # 準備單一樣本的資料
-            contexts_list_of_dicts = json.loads(row['retrieved_contexts'])
-            context_text_list = [doc["text"] for doc in contexts_list_of_dicts]
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
 
-            if not row['answer'] or not context_text_list:
-                print(f"跳過紀錄 ID {row['id']}，因為答案或上下文為空。")
-                continue
 
-            # Using the SingleTurnSample object as intended by the new API.
-            sample = SingleTurnSample(
-                user_input=row["rephrased_question"],
-                response=row["answer"],
-                retrieved_contexts=context_text_list
-            )
+class ScoreCache:
+    """
+    本機 SQLite 分數快取。
+    key 為 (問題, 回答, 上下文, 指標, 評估模型) 的 SHA-256，啟動時整份載入記憶體，新分數立即寫回檔案。
+    同一個 key 正在評估時，其他 worker 會等待同一個結果，不會重複呼叫 LLM。
+    """
 
-            print(f"正在評估紀錄 ID {row['id']} ({i+1}/{len(unevaluated_rows)})...")
+    def __init__(self, cache_file: str | None):
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self._scores = {}
+        self._in_flight = {}
+        if cache_file:
+            conn = sqlite3.connect(cache_file)
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS score_cache (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+                self._scores = dict(conn.execute("SELECT key, score FROM score_cache").fetchall())
+            finally:
+                conn.close()
 
-            # 3. 非同步評估所有指標
-            # Use 'single_turn_ascore' as recommended, with the SingleTurnSample object.
-            faithfulness_score, response_relevancy_score, context_precision_score = await asyncio.gather(
-                faithfulness_metric.single_turn_ascore(sample),
-                response_relevancy_metric.single_turn_ascore(sample),
-                context_precision_metric.single_turn_ascore(sample)
-            )
+    @staticmethod
+    def make_key(question: str, answer: str, contexts: list, metric: str, model: str) -> str:
+        payload = json.dumps([question, answer, contexts, metric, model], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-            # 儲存結果
-            result = {
-                "id": row["id"],
-                "faithfulness_score": faithfulness_score,
-                "response_relevancy_score": response_relevancy_score,
-                "context_precision_score": context_precision_score,
-            }
-            all_results.append(result)
-            print(f"  - Faithfulness: {faithfulness_score:.2f}, Response Relevancy: {response_relevancy_score:.2f}, Context Precision: {context_precision_score:.2f}")
+    def contains(self, key: str) -> bool:
+        return key in self._scores or key in self._in_flight
 
+    async def get_or_compute(self, key: str, compute):
+        """回傳快取的分數，沒有時執行 compute() 並存入快取"""
+        if key in self._scores:
+            self.hits += 1
+            return self._scores[key]
+        if key in self._in_flight:
+            self.hits += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            score = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as e:
-            print(f"評估紀錄 ID {row['id']} 時發生錯誤: {e}")
+            future.set_exception(e)
+            # 沒有其他等待者時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+        future.set_result(score)
+        # NaN 代表評估失敗 (例如 LLM 輸出無法解析)，不寫入快取以便下次重試
+        if score is not None and score == score:
+            self._scores[key] = score
+            if self.cache_file:
+                await asyncio.to_thread(self._save, key, score)
+        return score
+
+    def _save(self, key: str, score: float):
+        conn = sqlite3.connect(self.cache_file)
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO score_cache (key, score) VALUES (?, ?)", (key, score))
+        finally:
+            conn.close()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CheckpointWriter:
+    """
+    累積評估結果並分批寫回資料庫。
+    每滿 batch_size 筆或距離上次寫入超過 flush_seconds 就寫入一次，中斷時最多只損失一批。
+    同時追蹤仍在處理中的 id，watermark 只會推進到所有更小的 id 都已完成 (寫入或跳過) 的位置；
+    評估失敗 (多半是暫時性的 429 或逾時) 的 id 會一直擋住 watermark，下次執行時重新評估。
+    """
+
+    def __init__(self, store, batch_size: int, flush_seconds: float, save_watermark: bool):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.save_watermark = save_watermark
+        self.written = 0
+        self.watermark = None
+        self._pending = []
+        self._in_progress = set()
+        self._failed = set()
+        self._max_fetched_id = 0
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def track(self, row_id: int):
+        """紀錄已讀取、尚未完成的 id"""
+        self._in_progress.add(row_id)
+        self._max_fetched_id = max(self._max_fetched_id, row_id)
+
+    def finish(self, row_id: int):
+        """不需要寫入分數的紀錄 (答案或上下文為空而跳過) 直接視為完成"""
+        self._in_progress.discard(row_id)
+
+    def fail(self, row_id: int):
+        """評估失敗的紀錄不算完成，watermark 停在它之前"""
+        self._in_progress.discard(row_id)
+        self._failed.add(row_id)
+
+    async def add(self, result: dict):
+        self._pending.append(result)
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_seconds:
+            await self.flush()
+
+    def _safe_watermark(self, batch: list) -> int:
+        unfinished = (self._in_progress | self._failed) - {res["id"] for res in batch}
+        return min(unfinished) - 1 if unfinished else self._max_fetched_id
 
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            watermark = self._safe_watermark(batch) if self.save_watermark else None
+            if not batch and (watermark is None or watermark == self.watermark):
+                return
+            ok = await asyncio.to_thread(update_scores_in_db, self.store, batch, watermark)
+            if ok:
+                self.written += len(batch)
+                for res in batch:
+                    self._in_progress.discard(res["id"])
+                if watermark is not None:
+                    self.watermark = watermark
+            else:
+                # 寫入失敗時保留這批，下次再試
+                self._pending = batch + self._pending
+            self._last_flush = time.monotonic()
 
-    if not all_results:
-        print("\n沒有成功評估的紀錄。程式結束。")
+
+async def evaluate_row(row, cache: ScoreCache, limiter: AsyncRateLimiter):
+    """評估單一紀錄，回傳分數 dict；答案或上下文為空時回傳 None。"""
+    # 準備單一樣本的資料
+    # SQLite 存的是 JSON 字串，PostgreSQL 的 JSONB 欄位會直接回傳 list
+    contexts_list_of_dicts = row['retrieved_contexts'] or []
+    if isinstance(contexts_list_of_dicts, str):
+        contexts_list_of_dicts = json.loads(contexts_list_of_dicts)
+    context_text_list = [doc["text"] for doc in contexts_list_of_dicts]
+
+    if not row['answer'] or not context_text_list:
+        print(f"跳過紀錄 ID {row['id']}，因為答案或上下文為空。")
+        return None
+
+    # Using the SingleTurnSample object as intended by the new API.
+    sample = SingleTurnSample(
+        user_input=row["rephrased_question"],
+        response=row["answer"],
+        retrieved_contexts=context_text_list
+    )
+    keys = {
+        name: ScoreCache.make_key(row["rephrased_question"], row["answer"], context_text_list, name, model)
+        for name, (_, model) in METRICS.items()
+    }
+
+    # 全部指標都已快取的紀錄不需要呼叫 LLM，也不佔用速率限制
+    if not all(cache.contains(key) for key in keys.values()):
+        await limiter.acquire()
+
+    # 非同步評估所有指標
+    # Use 'single_turn_ascore' as recommended, with the SingleTurnSample object.
+    scores = await asyncio.gather(*[
+        cache.get_or_compute(keys[name], lambda metric=metric: metric.single_turn_ascore(sample))
+        for name, (metric, _) in METRICS.items()
+    ])
+    result = dict(zip(METRICS, scores))
+
+    print(f"  - ID {row['id']}: Faithfulness: {result['faithfulness_score']:.2f}, Response Relevancy: {result['response_relevancy_score']:.2f}, Context Precision: {result['context_precision_score']:.2f}")
+    return {"id": row["id"], **result}
+
+
+async def main(args):
+    """主執行函式"""
+    if args.source == "postgres":
+        store = PostgresStore(args.table)
+    else:
+        store = SqliteStore(args.db, args.table)
+    store.ensure_schema()
+
+    # 時間窗或取樣模式只看部分紀錄，不能推進 watermark，否則會略過範圍外的紀錄
+    full_scan = not args.window_hours and (args.sample is None or args.sample >= 1)
+    start_id = 0 if args.rescan else await asyncio.to_thread(load_watermark, store)
+    if start_id:
+        print(f"從 watermark id > {start_id} 繼續評估。")
+
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    limiter = AsyncRateLimiter(args.rows_per_minute)
+    cache = ScoreCache(None if args.no_cache else args.cache_file)
+    writer = CheckpointWriter(store, args.batch_size, args.flush_seconds, save_watermark=full_scan)
+    stats = {"fetched": 0, "scored": 0, "skipped": 0, "failed": 0}
+    start_time = time.monotonic()
+
+    def rows_per_minute():
+        elapsed = time.monotonic() - start_time
+        return stats["scored"] / elapsed * 60 if elapsed > 0 else 0.0
+
+    async def producer():
+        # 1. 從資料庫分頁讀取資料，佇列有上限所以記憶體用量固定
+        last_id = start_id
+        while args.max_rows is None or stats["fetched"] < args.max_rows:
+            page_size = args.page_size
+            if args.max_rows is not None:
+                page_size = min(page_size, args.max_rows - stats["fetched"])
+            rows = await asyncio.to_thread(fetch_unevaluated_page, store, last_id, page_size, args.window_hours, args.sample)
+            if not rows:
+                break
+            for row in rows:
+                writer.track(row["id"])
+                await queue.put(row)
+            stats["fetched"] += len(rows)
+            last_id = rows[-1]["id"]
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def worker():
+        # 2. 每個 worker 持續取出紀錄並評估
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            try:
+                result = await evaluate_row(row, cache, limiter)
+            except Exception as e:
+                stats["failed"] += 1
+                writer.fail(row["id"])
+                print(f"評估紀錄 ID {row['id']} 時發生錯誤: {e}")
+                continue
+            if result is None:
+                stats["skipped"] += 1
+                writer.finish(row["id"])
+                continue
+            stats["scored"] += 1
+            # 3. 分批寫回資料庫
+            await writer.add(result)
+            if stats["scored"] % args.batch_size == 0:
+                print(f"[Progress] 已評估 {stats['scored']} 筆，{rows_per_minute():.1f} rows/min")
+
+    print(f"\n開始評估 {args.source}:{args.table} (concurrency={args.concurrency}, rate limit={args.rows_per_minute} rows/min, batch={args.batch_size})...")
+    try:
+        await asyncio.gather(producer(), *[worker() for _ in range(args.concurrency)])
+    finally:
+        # 中斷時也寫入已完成的分數與 watermark，下次執行會從尚未評估的紀錄繼續
+        await writer.flush()
+
+    if stats["fetched"] == 0:
+        print("沒有需要評估的新資料。程式結束。")
         return
 
-    # 4. 更新資料庫
+    elapsed = time.monotonic() - start_time
     print("\n所有評估完成！")
-    update_scores_in_db(all_results)
+    print(f"讀取 {stats['fetched']} 筆，成功評估 {stats['scored']} 筆 (已寫入 {writer.written} 筆)，"
+          f"跳過 {stats['skipped']} 筆，失敗 {stats['failed']} 筆。")
+    if stats["failed"]:
+        print("失敗的紀錄不會推進 watermark，下次執行時會重新評估。")
+    if writer.watermark is not None:
+        print(f"Watermark 已更新為 id {writer.watermark}。")
+    print(f"耗時 {elapsed:.1f} 秒，吞吐量 {rows_per_minute():.1f} rows/min。")
+    print(f"分數快取命中 {cache.hits}/{cache.hits + cache.misses} 次 ({cache.hit_rate():.1%})，省下 {cache.hits} 次指標評估。")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="使用 Ragas 評估尚未評分的問答紀錄")
+    parser.add_argument("--source", choices=["postgres", "sqlite"], default="postgres", help="問答紀錄來源")
+    parser.add_argument("--db", default=DB_FILE, help="--source sqlite 時使用的資料庫檔案")
+    parser.add_argument("--table", default=TABLE_NAME, help="問答紀錄資料表")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時評估的紀錄數")
+    parser.add_argument("--rows-per-minute", type=float, default=60, help="每分鐘最多開始評估的紀錄數 (0 代表不限制)")
+    parser.add_argument("--batch-size", type=int, default=10, help="每累積多少筆分數就寫回資料庫")
+    parser.add_argument("--flush-seconds", type=float, default=30, help="最長多久寫回一次資料庫")
+    parser.add_argument("--page-size", type=int, default=100, help="每次從資料庫讀取的紀錄數")
+    parser.add_argument("--window-hours", type=float, default=None, help="只評估最近 N 小時內的紀錄")
+    parser.add_argument("--sample", type=float, default=None, help="只評估這個比例的紀錄 (0~1)，以 id 雜湊取樣")
+    parser.add_argument("--max-rows", type=int, default=None, help="本次最多評估的紀錄數")
+    parser.add_argument("--rescan", action="store_true", help="忽略 watermark，從頭掃描尚未評估的紀錄")
+    parser.add_argument("--cache-file", default=SCORE_CACHE_FILE, help="分數快取的 SQLite 檔案")
+    parser.add_argument("--no-cache", action="store_true", help="不讀寫分數快取 (每筆都重新評估)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
@@ -172,4 +557,4 @@ if __name__ == "__main__":
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     # 使用 asyncio.run() 來執行 async main 函式
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
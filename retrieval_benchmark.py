@@ -0,0 +1,207 @@
+"""
+離線檢索 benchmark：比較 dense / sparse / hybrid、有無 metadata 過濾與不同 top_k、nprobe 的檢索品質與成本。
+
+Ground truth 來自問答紀錄中已引用的 contexts (qa_logs2 或 evaluation.db 的 retrieved_contexts)，
+對每個設定計算 recall@k、MRR、每次查詢的檢索延遲，以及檢索結果組成 prompt 後的 token 數。
+
+用法:
+    python retrieval_benchmark.py                                  # 使用 evaluation.db
+    python retrieval_benchmark.py --source postgres --limit 200
+    python retrieval_benchmark.py --modes dense hybrid --top-k 3 5 7 --json retrieval_report.json
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import statistics
+import time
+
+import tiktoken
+
+import config
+import answer
+from auto_filter import extract_filters_from_question, filters_to_expr
+from partition_layout import routed_expr
+from prompts import PROMPTS
+
+
+def load_queries(args) -> list:
+    """讀取有引用 contexts 的問答紀錄，回傳 [{"id", "question", "relevant_ids"}]"""
+    query = f"""SELECT id, question, rephrased_question, retrieved_contexts FROM {args.table}
+                WHERE retrieved_contexts IS NOT NULL ORDER BY id DESC"""
+    if args.source == "postgres":
+        import psycopg2
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            dbname=config.DB_NAME,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD
+        )
+    else:
+        conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    queries = []
+    for row_id, question, rephrased_question, contexts in rows:
+        if isinstance(contexts, str):
+            contexts = json.loads(contexts)
+        relevant_ids = {ctx["id"] for ctx in contexts or [] if ctx.get("id") is not None}
+        if not relevant_ids:
+            continue
+        queries.append({
+            "id": row_id,
+            "question": rephrased_question or question,
+            "relevant_ids": relevant_ids,
+        })
+        if args.limit and len(queries) >= args.limit:
+            break
+    return queries
+
+
+def get_encoding():
+    try:
+        return tiktoken.encoding_for_model(config.OPENAI_MODEL_NAME)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_prompt_tokens(encoding, question: str, raw_results: list, lang: str) -> int:
+    """計算檢索結果組成 RAG prompt (system + user) 後的 token 數"""
+    cleaned_contexts = [
+        {
+            "id": res.get("id"),
+            "text": res.get("entity", {}).get("text", ""),
+            "source_file": res.get("entity", {}).get("source_file", "").replace(".md", ""),
+            "source_url": res.get("entity", {}).get("source_url"),
+        }
+        for res in raw_results
+    ]
+    context_for_llm = answer.build_context_for_llm(cleaned_contexts)
+    user_prompt = PROMPTS[lang]['rag_user'].format(question=question, context_for_llm=context_for_llm)
+    return len(encoding.encode(PROMPTS[lang]['rag_system'])) + len(encoding.encode(user_prompt))
+
+
+def score(retrieved_ids: list, relevant_ids: set) -> tuple[float, float]:
+    """回傳 (recall, reciprocal rank)"""
+    hits = relevant_ids.intersection(retrieved_ids)
+    recall = len(hits) / len(relevant_ids)
+    reciprocal_rank = 0.0
+    for rank, doc_id in enumerate(retrieved_ids, 1):
+        if doc_id in relevant_ids:
+            reciprocal_rank = 1.0 / rank
+            break
+    return recall, reciprocal_rank
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def prepare_queries(queries: list, lang: str, use_filters: bool):
+    """每個問題只產生一次 embedding 與過濾條件，所有設定共用"""
+    for i, q in enumerate(queries, 1):
+        q["embedding"] = await answer.get_embedding(q["question"])
+        if use_filters:
+            filters = await extract_filters_from_question(q["question"], lang)
+            q["expr"] = filters_to_expr(filters) if filters else None
+            # 與 retrieve_context 相同的 partition 路由 (沒有 partition 符合時保留原本的條件，結果同樣為空)
+            _, layout = await asyncio.to_thread(answer.current_partition_layout)
+            routed, tags = routed_expr(layout, filters, q["expr"])
+            if tags:
+                q["expr"] = routed
+        print(f"\r準備查詢 {i}/{len(queries)}", end="", flush=True)
+    print()
+
+
+def run_setting(queries: list, encoding, mode: str, use_filter: bool, top_k: int, nprobe: int | None, lang: str) -> dict:
+    """nprobe 為 None 時使用索引設定 (index_config.json) 的搜尋參數"""
+    recalls, reciprocal_ranks, latencies_ms, prompt_tokens = [], [], [], []
+    for q in queries:
+        expr = q.get("expr") if use_filter else None
+        start = time.perf_counter()
+        results, _ = answer.search_milvus(q["question"], q["embedding"], mode=mode, top_k=top_k, expr=expr,
+                                       dense_params=None if nprobe is None else {"nprobe": nprobe})
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+
+        recall, reciprocal_rank = score([res.get("id") for res in results], q["relevant_ids"])
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+        prompt_tokens.append(count_prompt_tokens(encoding, q["question"], results, lang))
+
+    return {
+        "mode": mode,
+        "filter": use_filter,
+        "top_k": top_k,
+        "nprobe": nprobe if nprobe is not None else "config",
+        "recall": statistics.mean(recalls),
+        "mrr": statistics.mean(reciprocal_ranks),
+        "latency_p50_ms": percentile(latencies_ms, 50),
+        "latency_p95_ms": percentile(latencies_ms, 95),
+        "prompt_tokens_mean": statistics.mean(prompt_tokens),
+    }
+
+
+def print_report(report: list):
+    print(f"\n{'mode':>7} {'filter':>6} {'top_k':>5} {'nprobe':>6} {'recall@k':>9} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8} {'prompt tok':>10}")
+    for r in report:
+        print(f"{r['mode']:>7} {str(r['filter']):>6} {r['top_k']:>5} {r['nprobe']:>6} {r['recall']:>9.3f} {r['mrr']:>6.3f} "
+              f"{r['latency_p50_ms']:>8.1f} {r['latency_p95_ms']:>8.1f} {r['prompt_tokens_mean']:>10.0f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark against logged citations.")
+    parser.add_argument("--source", choices=["postgres", "sqlite"], default="sqlite", help="問答紀錄來源")
+    parser.add_argument("--db", default="evaluation.db", help="--source sqlite 時使用的資料庫檔案")
+    parser.add_argument("--table", default=None, help="問答紀錄資料表 (預設 sqlite 為 qa_logs，postgres 為 DB_TABLE_NAME)")
+    parser.add_argument("--limit", type=int, default=None, help="最多使用幾筆紀錄 (由新到舊)")
+    parser.add_argument("--lang", default="zh")
+    parser.add_argument("--modes", nargs="+", choices=answer.SEARCH_MODES, default=list(answer.SEARCH_MODES))
+    parser.add_argument("--top-k", nargs="+", type=int, default=[3, 5, 7, 10])
+    parser.add_argument("--nprobe", nargs="+", type=int, default=None,
+                        help="覆寫 IVF 索引的 nprobe；預設使用索引設定的搜尋參數")
+    parser.add_argument("--no-filters", action="store_true", help="不比較 LLM 擷取的 metadata 過濾條件")
+    parser.add_argument("--json", default=None, help="將結果另存為 JSON 檔")
+    args = parser.parse_args()
+    if args.table is None:
+        args.table = config.DB_TABLE_NAME if args.source == "postgres" else "qa_logs"
+    return args
+
+
+def main():
+    args = parse_args()
+    queries = load_queries(args)
+    if not queries:
+        print("沒有含引用 contexts 的紀錄可作為 ground truth。")
+        return
+    print(f"使用 {len(queries)} 筆紀錄作為 ground truth ({args.source}:{args.table})")
+
+    asyncio.run(prepare_queries(queries, args.lang, use_filters=not args.no_filters))
+    encoding = get_encoding()
+
+    filter_options = [False] if args.no_filters else [False, True]
+    report = []
+    for mode in args.modes:
+        for use_filter in filter_options:
+            # sparse 檢索不使用 nprobe
+            nprobes = args.nprobe or [None]
+            for nprobe in (nprobes[:1] if mode == "sparse" else nprobes):
+                for top_k in args.top_k:
+                    report.append(run_setting(queries, encoding, mode, use_filter, top_k, nprobe, args.lang))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(queries), "results": report}, f, ensure_ascii=False, indent=2)
+        print(f"結果已儲存到 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+
+from normalization import normalize_question
+
+
+class RetrievalCache:
+    """
+    檢索結果的快取 (TTL + LRU)。
+    key 為 (正規化後的問題, 過濾條件 expr, top_k, collection 版本)；重新 ingest 後版本改變，舊的結果不會再被命中。
+    值為清理過的 contexts，命中時可以略過 embedding 與 Milvus 檢索。
+    每筆記錄當初檢索花費的時間，用來統計快取省下的延遲。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (stored_at, contexts, retrieval_ms)；依最後使用時間排序
+        self._entries: OrderedDict[tuple, tuple[float, list, float]] = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        self._saved_ms = 0.0
+        self._miss_ms = 0.0
+        self._stored = 0
+
+    @staticmethod
+    def make_key(question: str, expr: str | None, top_k: int, collection_version: str) -> tuple:
+        return (normalize_question(question), expr or "", top_k, collection_version)
+
+    def get(self, key: tuple) -> list | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        stored_at, contexts, retrieval_ms = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self._counters["expired"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        self._saved_ms += retrieval_ms
+        return list(contexts)
+
+    def put(self, key: tuple, contexts: list, retrieval_ms: float):
+        self._miss_ms += retrieval_ms
+        self._stored += 1
+        self._entries[key] = (time.monotonic(), list(contexts), retrieval_ms)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evicted"] += 1
+
+    def stats(self) -> dict:
+        hits, misses = self._counters["hits"], self._counters["misses"]
+        lookups = hits + misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            # 命中時省下的檢索時間 (以該筆結果當初的 embedding + 檢索耗時估算)
+            "saved_ms_total": round(self._saved_ms, 1),
+            "avg_miss_retrieval_ms": round(self._miss_ms / self._stored, 1) if self._stored else 0.0,
+            **self._counters,
+        }
@@ -0,0 +1,169 @@
+import asyncio
+import re
+import secrets
+import time
+from collections import OrderedDict
+
+# 由 client 傳入的 session id 只接受 new_session_id() 的字元 (不含 ":")，避免任意長字串佔用記憶體
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+# LINE 使用者的 session key 前綴；含有 ":"，網頁端傳入的 session id 不可能對應到
+LINE_SESSION_PREFIX = "line:"
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def line_session_id(user_id: str) -> str:
+    return f"{LINE_SESSION_PREFIX}{user_id}"
+
+
+def is_valid_session_id(session_id: str | None) -> bool:
+    """網頁端傳入的 session id 格式是否正確 (LINE 的 session key 不會通過)"""
+    return bool(session_id) and bool(_SESSION_ID_RE.match(session_id))
+
+
+def compact_answer(answer: str, cited_sources: list[str], max_chars: int) -> str:
+    """
+    將回答壓縮成重構問題所需的最小資訊。
+    有引用來源時以來源名稱取代回答內容 (只保留開頭一小段)，否則截斷到 max_chars 字。
+    """
+    answer = (answer or "").strip()
+    if cited_sources:
+        head = answer[: max_chars // 3].strip()
+        sources = "、".join(cited_sources)
+        return f"{head}…（引用來源：{sources}）" if head else f"（引用來源：{sources}）"
+    if len(answer) > max_chars:
+        return answer[:max_chars].rstrip() + "…"
+    return answer
+
+
+class SessionStore:
+    """
+    伺服器端的對話歷史，以 session id 為 key。
+    每個 session 保存一份滾動摘要與尚未併入摘要的最近幾輪精簡紀錄 (問題 + 壓縮後的回答)。
+    未摘要的輪數達到 summary_trigger_turns 時，在背景呼叫 summarizer 將較舊的輪次併入摘要，只保留最後 summary_keep_turns 輪原文，
+    因此重構問題的 prompt 大小不會隨對話長度增加。max_turns 是未摘要輪數的硬上限 (摘要失敗或尚未完成時)。
+    超過 ttl_seconds 未使用的 session 會被移除，session 數量超過 max_sessions 時淘汰最久未使用的。
+    資料只存在目前的 process 內，重新啟動後對話會從頭開始。
+    """
+
+    def __init__(self, ttl_seconds: float, max_sessions: int, max_turns: int, answer_chars: int,
+                 summarizer=None, summary_trigger_turns: int = 3, summary_keep_turns: int = 1):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.answer_chars = answer_chars
+        # async (summary, turns, lang) -> 新的摘要；None 時不做摘要，只保留最近 max_turns 輪
+        self.summarizer = summarizer
+        self.summary_trigger_turns = summary_trigger_turns
+        self.summary_keep_turns = summary_keep_turns
+        # session_id -> session dict；依最後使用時間排序
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+        self._counters = {
+            "created": 0, "expired": 0, "evicted": 0, "turns_stored": 0,
+            "summaries": 0, "summary_failures": 0,
+        }
+
+    def has(self, session_id: str) -> bool:
+        """session 是否存在 (未過期)；client 傳入的 id 只有在伺服器已保存時才沿用"""
+        self._expire()
+        return session_id in self._sessions
+
+    def get_context(self, session_id: str) -> tuple[str, list[dict]]:
+        """回傳 (摘要, 尚未摘要的歷史訊息 [{"role", "content"}])，供 _rephrase_question_with_history 使用"""
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            return "", []
+        session["last_used"] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+        history = []
+        for turn in session["turns"]:
+            history.append({"role": "user", "content": turn["question"]})
+            history.append({"role": "assistant", "content": turn["answer"]})
+        return session["summary"], history
+
+    def append_turn(self, session_id: str, question: str, answer: str, cited_sources: list[str] | None = None,
+                    lang: str = 'zh'):
+        """
+        記錄一輪對話。question 應為重構後的獨立問題，之後的重構不必再回頭解析更早的代名詞。
+        必須在 event loop 內呼叫，需要摘要時會建立背景 task，不會延遲目前的回應。
+        """
+        self._expire()
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            session = {"summary": "", "turns": [], "next_seq": 0, "summarizing": False}
+            self._counters["created"] += 1
+
+        session["turns"].append({
+            "seq": session["next_seq"],
+            "question": question,
+            "answer": compact_answer(answer, cited_sources or [], self.answer_chars),
+        })
+        session["next_seq"] += 1
+        del session["turns"][:-self.max_turns]
+        session["last_used"] = time.monotonic()
+        session["lang"] = lang
+        self._sessions[session_id] = session
+        self._counters["turns_stored"] += 1
+
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._counters["evicted"] += 1
+
+        if (self.summarizer and not session["summarizing"]
+                and len(session["turns"]) >= self.summary_trigger_turns):
+            session["summarizing"] = True
+            task = asyncio.create_task(self._summarize(session))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session: dict):
+        """將最後 summary_keep_turns 輪以前的紀錄併入摘要。期間新增的輪次不受影響。"""
+        to_fold = session["turns"][:-self.summary_keep_turns] if self.summary_keep_turns else list(session["turns"])
+        try:
+            if not to_fold:
+                return
+            summary = await self.summarizer(session["summary"], to_fold, session["lang"])
+            if not summary:
+                return
+            last_seq = to_fold[-1]["seq"]
+            session["summary"] = summary
+            session["turns"] = [turn for turn in session["turns"] if turn["seq"] > last_seq]
+            self._counters["summaries"] += 1
+        except Exception as e:
+            # 保留原始輪次，下一輪再試
+            self._counters["summary_failures"] += 1
+            print(f"⚠️ 對話摘要失敗: {e}")
+        finally:
+            session["summarizing"] = False
+
+    def clear(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        self._expire()
+        stored_chars = sum(
+            len(session["summary"]) + sum(len(turn["question"]) + len(turn["answer"]) for turn in session["turns"])
+            for session in self._sessions.values()
+        )
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "stored_chars": stored_chars,
+            "pending_summaries": len(self._tasks),
+            **self._counters,
+        }
+
+    def _expire(self):
+        now = time.monotonic()
+        # OrderedDict 依最後使用時間排序，過期的項目一定在最前面
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session["last_used"] <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._counters["expired"] += 1
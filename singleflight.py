@@ -0,0 +1,95 @@
+import asyncio
+
+
+class _Flight:
+    """一次正在執行的 pipeline。產生的事件會被保留，讓較晚加入的訂閱者也能收到完整內容。"""
+
+    def __init__(self, group: "SingleFlight", key, factory):
+        self.key = key
+        self.events: list = []
+        # 由 factory 填入的最終結果 (回答全文、引用的 contexts 等)
+        self.result: dict = {}
+        self.done = False
+        self.error: BaseException | None = None
+        self._group = group
+        self._subscribers = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(factory))
+
+    async def _run(self, factory):
+        try:
+            async for event in factory(self.result):
+                self.events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._group._finish(self)
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self):
+        """依序產生 pipeline 的事件；producer 失敗時拋出同一個例外。"""
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    break
+                await self._changed.wait()
+            if self.error is not None:
+                raise self.error
+        finally:
+            self._subscribers -= 1
+            # 所有訂閱者都離開 (例如連線中斷) 時停止 pipeline，避免浪費 token；
+            # 同時移除 key，取消完成前加入的相同請求會啟動新的 pipeline，而不是訂閱到被取消的這一個
+            if self._subscribers == 0 and not self.done:
+                self._group._finish(self)
+                self._task.cancel()
+
+
+class SingleFlight:
+    """
+    將同時發生的相同請求合併為一次執行。
+    第一個請求啟動 pipeline，其餘相同 key 的請求訂閱它的事件串流。
+    pipeline 結束後 key 即被移除，之後的請求會重新執行。
+    """
+
+    def __init__(self):
+        self._flights: dict = {}
+        self._counters = {
+            "started": 0,
+            "coalesced": 0,
+        }
+
+    def join(self, key, factory) -> _Flight:
+        """
+        加入 key 對應的執行中 pipeline，若沒有則以 factory(result) 啟動一個新的。
+        factory 必須回傳 async generator，並把最終結果寫入傳入的 result dict。
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(self, key, factory)
+            self._counters["started"] += 1
+        else:
+            self._counters["coalesced"] += 1
+        flight._subscribers += 1
+        return flight
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            **self._counters,
+        }
+
+    def _finish(self, flight: _Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
@@ -0,0 +1,118 @@
+"""
+寒暄與道謝的本地回覆。
+
+「謝謝」、「你好」、"thanks" 這類訊息原本要經過意圖分類與一次串流的 chat completion，
+這裡以 locales/small_talk.json 中的多語言片語索引比對，命中時直接以介面語系的範本回覆，不呼叫 LLM。
+訊息必須完全由已知的片語 (與語氣詞) 組成才算命中，例如「好的謝謝」、"ok thanks!"；
+其他開放式的閒聊 (「今天天氣如何」) 仍交給 LLM。
+
+用法:
+    python small_talk.py 謝謝 "ok thanks" 你好嗎
+"""
+import functools
+import json
+import random
+import re
+import sys
+import unicodedata
+
+import config
+
+# 同一則訊息包含多種片語時，以較前面的類別回覆 (「好的謝謝」→ thanks)
+CATEGORY_PRIORITY = ("identity", "goodbye", "thanks", "greeting", "acknowledge")
+# 超過這個長度的訊息不會只是寒暄
+MAX_MESSAGE_CHARS = 30
+
+_STRIP_RE = re.compile(r"[\s?？!！。.,，、~～:：;；\"'「」()（）…]+")
+
+
+def _normalize(text: str) -> str:
+    """NFKC、小寫，去掉標點、空白與 emoji"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(ch for ch in text if not unicodedata.category(ch).startswith("S"))
+    return _STRIP_RE.sub("", text)
+
+
+class SmallTalkResponder:
+    """以片語索引比對寒暄訊息，回傳對應語系的範本回覆"""
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # 正規化後的片語 -> 類別
+        self.phrases: dict[str, str] = {}
+        for category in CATEGORY_PRIORITY:
+            for phrase in data["phrases"].get(category, []):
+                self.phrases.setdefault(_normalize(phrase), category)
+        self.fillers = {_normalize(filler) for filler in data.get("fillers", [])}
+        self.templates: dict[str, dict[str, list[str]]] = data["templates"]
+        self._max_phrase_len = max(map(len, [*self.phrases, *self.fillers]), default=0)
+
+    def classify(self, message: str) -> str | None:
+        """訊息完全由已知片語與語氣詞組成時回傳類別，否則回傳 None"""
+        text = _normalize(message)
+        if not text or len(text) > MAX_MESSAGE_CHARS:
+            return None
+        categories = self._segment(text)
+        if not categories:
+            return None
+        return min(categories, key=CATEGORY_PRIORITY.index)
+
+    @functools.lru_cache(maxsize=4096)
+    def _segment(self, text: str) -> frozenset | None:
+        """
+        將 text 切成片語與語氣詞 (動態規劃，優先較長的片語)，回傳出現的類別；無法完整切分時回傳 None。
+        只有語氣詞 (例如「喔」) 沒有片語時也回傳 None。
+        """
+        # best[i]: text[:i] 可切分時出現的類別
+        best: list[frozenset | None] = [None] * (len(text) + 1)
+        best[0] = frozenset()
+        for end in range(1, len(text) + 1):
+            for start in range(max(0, end - self._max_phrase_len), end):
+                if best[start] is None:
+                    continue
+                piece = text[start:end]
+                if piece in self.phrases:
+                    best[end] = best[start] | {self.phrases[piece]}
+                    break
+                if piece in self.fillers:
+                    best[end] = best[start]
+                    break
+        return best[-1] or None
+
+    def reply(self, message: str, lang: str = 'zh') -> str | None:
+        category = self.classify(message)
+        if category is None:
+            return None
+        templates = self.templates.get(lang) or self.templates["zh"]
+        choices = templates.get(category)
+        return random.choice(choices) if choices else None
+
+
+@functools.lru_cache(maxsize=1)
+def _responder() -> SmallTalkResponder | None:
+    try:
+        return SmallTalkResponder(config.SMALL_TALK_FILE)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ 無法載入寒暄回覆 '{config.SMALL_TALK_FILE}'，改由 LLM 回覆: {e}")
+        return None
+
+
+def is_small_talk(message: str) -> bool:
+    """訊息是否只是寒暄 (不論本地回覆是否開啟)"""
+    responder = _responder()
+    return responder is not None and responder.classify(message) is not None
+
+
+def small_talk_reply(message: str, lang: str = 'zh') -> str | None:
+    """寒暄訊息的本地回覆；不是寒暄、或功能關閉時回傳 None (交給 LLM)"""
+    if not config.SMALL_TALK_ENABLED:
+        return None
+    responder = _responder()
+    return responder.reply(message, lang) if responder else None
+
+
+if __name__ == "__main__":
+    responder = SmallTalkResponder(config.SMALL_TALK_FILE)
+    for message in sys.argv[1:]:
+        print(f"{message!r}: {responder.classify(message)} -> {responder.reply(message)}")
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import time
+import zlib
+
+KEEPALIVE_FRAME = ": keep-alive\n\n"
+
+
+# 中文直接輸出 UTF-8 (每字 3 bytes)，不轉成 \uXXXX (每字 6 bytes)。
+# 共用同一個 encoder；json.dumps 帶參數時每次呼叫都會重新建立 encoder
+_dumps = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def encode_event(event: dict) -> str | None:
+    """
+    將 pipeline 事件轉成 SSE frame。
+    content 為一般 data frame；final_data 使用具名事件 end_stream；queue / error 使用同名事件；其他事件類型回傳 None。
+    """
+    event_type = event.get("type")
+    data = event.get("data")
+
+    if event_type == "content":
+        # The data is just the text chunk
+        sse_data = _dumps({"type": "content", "data": data})
+        return f"data: {sse_data}\n\n"
+
+    if event_type == "final_data":
+        # The data is the dict with contexts and log_id
+        sse_data = _dumps({"type": "final_data", "data": data})
+        return f"event: end_stream\ndata: {sse_data}\n\n"
+
+    if event_type in ("queue", "error"):
+        sse_data = _dumps({"type": event_type, "data": data})
+        return f"event: {event_type}\ndata: {sse_data}\n\n"
+
+    return None
+
+
+_END = object()
+
+
+async def sse_stream(events, coalesce_seconds: float, max_chars: int, keepalive_seconds: float):
+    """
+    將事件串流轉成 SSE frame 串流。
+    - 連續的 content 事件會合併成一個 frame：第一段文字進入緩衝後等待 coalesce_seconds，或累積到 max_chars 字就送出
+    - 超過 keepalive_seconds 沒有送出任何 frame (例如檢索中) 時送出 keep-alive 註解，避免 proxy 或瀏覽器中斷連線
+    - 其他事件送出前會先送出緩衝中的文字，維持原本的順序
+    上游事件由背景 task 放入佇列，這裡每個 frame 只喚醒一次，而不是每個 token 喚醒一次。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    pump_task = asyncio.create_task(pump())
+    buffer: list[str] = []
+    buffered_chars = 0
+    flush_deadline = None
+    last_sent = time.monotonic()
+    # 等待時已從佇列取出、尚未處理的事件
+    pending: list = []
+
+    def flush_buffer():
+        nonlocal buffer, buffered_chars, flush_deadline
+        frame = encode_event({"type": "content", "data": "".join(buffer)})
+        buffer, buffered_chars, flush_deadline = [], 0, None
+        return frame
+
+    try:
+        finished = False
+        while not finished:
+            # 取出目前已到達的所有事件
+            while pending or not queue.empty():
+                item = pending.pop() if pending else queue.get_nowait()
+                if item is _END:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                if item.get("type") == "content":
+                    text = item.get("data") or ""
+                    if not text:
+                        continue
+                    if not buffer:
+                        flush_deadline = time.monotonic() + coalesce_seconds
+                    buffer.append(text)
+                    buffered_chars += len(text)
+                    if buffered_chars >= max_chars:
+                        yield flush_buffer()
+                        last_sent = time.monotonic()
+                    continue
+
+                frame = encode_event(item)
+                if frame is None:
+                    continue
+                if buffer:
+                    yield flush_buffer()
+                yield frame
+                last_sent = time.monotonic()
+
+            if finished:
+                break
+
+            now = time.monotonic()
+            if buffer:
+                # 合併視窗內不因新 token 喚醒，時間到再一次取出
+                if now < flush_deadline:
+                    await asyncio.sleep(flush_deadline - now)
+                    continue
+                yield flush_buffer()
+                last_sent = time.monotonic()
+                continue
+
+            timeout = last_sent + keepalive_seconds - now
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_FRAME
+                last_sent = time.monotonic()
+                continue
+            # 交給上方的迴圈處理
+            pending.append(item)
+
+        if buffer:
+            yield flush_buffer()
+    finally:
+        # 連線中斷時停止上游的 pipeline
+        if not pump_task.done():
+            pump_task.cancel()
+        try:
+            await pump_task
+        except BaseException:
+            pass
+        await events.aclose()
+
+
+async def gzip_stream(frames):
+    """
+    以 gzip 壓縮 SSE 串流。每個 frame 之後 Z_SYNC_FLUSH，讓瀏覽器能立即解壓並處理該 frame；
+    壓縮器的字典跨 frame 共用，重複的 JSON 欄位名稱與事件名稱幾乎不佔空間。
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush(zlib.Z_FINISH)
+    finally:
+        await frames.aclose()
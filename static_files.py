@@ -0,0 +1,82 @@
+import mimetypes
+import os
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from build_static import ASSETS_DIR, ENCODINGS, MANIFEST_NAME, load_manifest
+
+# 雜湊檔名的內容不會改變，可以永久快取；index.html 每次都要以 ETag 重新驗證
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """解析 Accept-Encoding，排除 q=0 的格式"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    提供 build_static.py 建置的 dist/ 目錄。
+    client 接受 br / gzip 時直接回傳預先壓縮的檔案 (不在請求時壓縮)，
+    ETag 使用 manifest 中的內容雜湊，多台伺服器或重新部署後仍然一致。
+    manifest 更新 (重新建置) 時自動重新載入。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._manifest_mtime = None
+        self._files: dict[str, dict] = {}
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        info = self._file_info(rel_path)
+        if info is None or status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if rel_path.startswith(f"{ASSETS_DIR}/") else REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        path, etag = full_path, info["etag"]
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, suffix in ENCODINGS.items():
+            if encoding in info["encodings"] and encoding in accepted:
+                path, etag = f"{full_path}{suffix}", f"{etag}-{encoding}"
+                headers["Content-Encoding"] = encoding
+                break
+        headers["ETag"] = f'"{etag}"'
+
+        # media_type 依原始檔名判斷 (壓縮檔的副檔名是 .br / .gz)
+        media_type, _ = mimetypes.guess_type(str(full_path))
+        response = FileResponse(path, status_code=status_code, headers=headers,
+                                media_type=media_type or "application/octet-stream")
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _file_info(self, rel_path: str) -> dict | None:
+        try:
+            mtime = os.stat(os.path.join(self.directory, MANIFEST_NAME)).st_mtime
+        except OSError:
+            return None
+        if mtime != self._manifest_mtime:
+            manifest = load_manifest(str(self.directory))
+            self._files = manifest["files"] if manifest else {}
+            self._manifest_mtime = mtime
+        return self._files.get(rel_path)
@@ -0,0 +1,320 @@
+"""
+Pipeline CPU 熱點的 micro-benchmark。
+量測每次操作的吞吐量與 tracemalloc 記憶體峰值，可儲存結果並與 baseline 比較，
+吞吐量或記憶體退步超過門檻時以 exit code 1 結束。
+
+用法:
+    python tests/benchmarks.py --save-baseline          # 建立 baseline
+    python tests/benchmarks.py                          # 與 baseline 比較
+    python tests/benchmarks.py --only sse --threshold 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, TESTS_DIR)
+
+RESULTS_DIR = os.path.join(ROOT_DIR, ".benchmarks")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+DEFAULT_RESULTS = os.path.join(RESULTS_DIR, "latest.json")
+
+NUM_CONTEXTS = 7
+CONTEXT_CHARS = 1000
+ANSWER_TOKENS = 800
+
+BENCHMARKS = {}
+# 每個 benchmark 量測完後執行的清理 (關閉 event loop 與檔案)
+_TEARDOWN = contextlib.ExitStack()
+
+
+def benchmark(name: str):
+    """註冊 benchmark。被裝飾的函式負責準備 fixture，並回傳一個無參數的操作函式。"""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    """建立 benchmark 使用的 event loop，量測完後由 main 關閉"""
+    loop = asyncio.new_event_loop()
+
+    def close():
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+    _TEARDOWN.callback(close)
+    return loop
+
+
+def _import_pipeline():
+    # answer 在匯入時會建立 OpenAI / Milvus client，這裡改用離線替身
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    os.environ.setdefault("ZILLIZ_API_KEY", "stub")
+    os.environ.setdefault("CLUSTER_ENDPOINT", "http://127.0.0.1:19530")
+    import pymilvus
+    from stub_services import StubMilvusClient
+    pymilvus.MilvusClient = StubMilvusClient
+    import answer
+    return answer
+
+
+# --- Fixtures ---
+
+def make_raw_results() -> list:
+    """模擬 Milvus 回傳的 7 筆檢索結果，每筆約 1000 字。"""
+    with open(os.path.join(ROOT_DIR, "config.json"), "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    file_names = list(metadata)[:5]
+    paragraph = "申請同學應於每年9月30日前，上校務行政系統填寫弱勢助學申請，並繳交戶口名簿或3個月內申請之其他戶籍資料證明文件。"
+    results = []
+    for i in range(NUM_CONTEXTS):
+        file_name = file_names[i % len(file_names)]
+        meta = metadata[file_name]
+        results.append({
+            "id": 1000 + i,
+            "distance": 0.9 - i * 0.05,
+            "entity": {
+                "id": 1000 + i,
+                "text": (paragraph * (CONTEXT_CHARS // len(paragraph) + 1))[:CONTEXT_CHARS],
+                "source_file": file_name,
+                "source_url": meta.get("source_url", ""),
+                "status": list(meta.get("status", [])),
+                "subsidy_type": list(meta.get("subsidy_type", [])),
+                "edu_system": list(meta.get("edu_system", [])),
+            },
+        })
+    return results
+
+
+def make_answer_tokens(delimiter: str) -> list[str]:
+    """模擬 800 個 token 的串流回答，分隔符號被切在兩個 chunk 之間，最後附上來源列表。"""
+    text = "**學生急難助學金(校內)**\n- 補助對象：家庭發生意外變故，致經濟發生困難者。\n- 申請條件：需提供三個月內的戶籍謄本正本。\n"
+    sizes = [1, 2, 3, 2]
+    tokens = []
+    position = 0
+    for i in range(ANSWER_TOKENS):
+        size = sizes[i % len(sizes)]
+        start = position % (len(text) - size)
+        tokens.append(text[start:start + size])
+        position += size
+    half = len(delimiter) // 2
+    tokens.extend([delimiter[:half], delimiter[half:], "學生急難助學金(校內),", "學生清寒獎助金"])
+    return tokens
+
+
+# --- Benchmarks ---
+
+@benchmark("filters_to_expr")
+def bench_filters_to_expr():
+    _import_pipeline()
+    from auto_filter import filters_to_expr
+    filters = {
+        "status": ["低收入戶", "中低收入戶", "清寒"],
+        "edu_system": ["大學部", "碩士班"],
+        "subsidy_type": ["獎學金", "助學金"],
+    }
+    return lambda: filters_to_expr(filters)
+
+
+@benchmark("log_and_clean_contexts")
+def bench_log_and_clean_contexts():
+    answer = _import_pipeline()
+    raw_results = make_raw_results()
+    devnull = _TEARDOWN.enter_context(open(os.devnull, "w", encoding="utf-8"))
+
+    def op():
+        # 包含逐筆 print 的成本，輸出導向 devnull
+        with contextlib.redirect_stdout(devnull):
+            answer.log_and_clean_contexts(raw_results)
+    return op
+
+
+@benchmark("build_context_for_llm")
+def bench_build_context_for_llm():
+    answer = _import_pipeline()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        cleaned_contexts = answer.log_and_clean_contexts(make_raw_results())
+    return lambda: answer.build_context_for_llm(cleaned_contexts)
+
+
+@benchmark("stream_until_sources")
+def bench_stream_until_sources():
+    answer = _import_pipeline()
+    tokens = make_answer_tokens(answer.SOURCES_DELIMITER)
+    loop = _new_event_loop()
+
+    async def llm_stream():
+        for token in tokens:
+            yield token
+
+    async def consume():
+        raw_chunks = []
+        async for _ in answer.stream_until_sources(llm_stream(), raw_chunks):
+            pass
+        return "".join(raw_chunks)
+
+    return lambda: loop.run_until_complete(consume())
+
+
+@benchmark("sse_encode_stream")
+def bench_sse_encode_stream():
+    from sse import encode_event
+    answer = _import_pipeline()
+    tokens = make_answer_tokens(answer.SOURCES_DELIMITER)[:ANSWER_TOKENS]
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        contexts = answer.log_and_clean_contexts(make_raw_results())[:3]
+    events = [{"type": "content", "data": token} for token in tokens]
+    events.append({"type": "final_data", "data": {"contexts": contexts, "log_id": 1}})
+
+    def op():
+        for event in events:
+            encode_event(event)
+    return op
+
+
+@benchmark("sse_coalesced_stream")
+def bench_sse_coalesced_stream():
+    from sse import sse_stream
+    answer = _import_pipeline()
+    tokens = make_answer_tokens(answer.SOURCES_DELIMITER)[:ANSWER_TOKENS]
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        contexts = answer.log_and_clean_contexts(make_raw_results())[:3]
+    events = [{"type": "content", "data": token} for token in tokens]
+    events.append({"type": "final_data", "data": {"contexts": contexts, "log_id": 1}})
+    loop = _new_event_loop()
+
+    async def pipeline():
+        for event in events:
+            yield event
+
+    async def consume():
+        # 所有 token 同時到達，量測合併後的 frame 編碼成本 (以字數上限切分)
+        async for _ in sse_stream(pipeline(), coalesce_seconds=0.05, max_chars=200, keepalive_seconds=10):
+            pass
+
+    return lambda: loop.run_until_complete(consume())
+
+
+# --- Runner ---
+
+def measure(op, min_time: float, repeat: int) -> dict:
+    """以多輪量測取最佳值作為每次操作的時間，並以 tracemalloc 量測單次操作的記憶體峰值。"""
+    op()  # warm-up
+
+    # 校準每輪的迭代次數，讓每輪至少執行 min_time / repeat 秒
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        iterations *= 2
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            op()
+        timings.append((time.perf_counter() - start) / iterations)
+
+    tracemalloc.start()
+    try:
+        baseline_current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(timings)
+    return {
+        "ops_per_sec": 1.0 / best if best > 0 else float("inf"),
+        "us_per_op": best * 1e6,
+        "peak_alloc_kib": max(0, peak - baseline_current) / 1024,
+        "iterations": iterations,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float, alloc_threshold: float) -> list[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if current["ops_per_sec"] < previous["ops_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {current['ops_per_sec']:.0f} ops/s vs baseline {previous['ops_per_sec']:.0f} ops/s"
+            )
+        # 記憶體峰值很小時，少量波動不視為退步
+        if current["peak_alloc_kib"] > previous["peak_alloc_kib"] * (1 + alloc_threshold) + 1:
+            regressions.append(
+                f"{name}: peak allocation {current['peak_alloc_kib']:.1f} KiB vs baseline {previous['peak_alloc_kib']:.1f} KiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for pipeline hot paths.")
+    parser.add_argument("--only", nargs="*", default=None, help="只執行名稱包含這些字串的 benchmark")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每個 benchmark 的量測時間 (秒)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", default=DEFAULT_RESULTS)
+    parser.add_argument("--save-baseline", action="store_true", help="將本次結果存為 baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允許的吞吐量下降比例")
+    parser.add_argument("--alloc-threshold", type=float, default=0.10, help="允許的記憶體峰值增加比例")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.only or any(key in name for key in args.only)]
+    results = {}
+    for name in names:
+        with _TEARDOWN:
+            op = BENCHMARKS[name]()
+            results[name] = measure(op, args.min_time, args.repeat)
+        r = results[name]
+        print(f"{name:>24}: {r['ops_per_sec']:12.1f} ops/s  {r['us_per_op']:10.2f} us/op  peak {r['peak_alloc_kib']:8.1f} KiB")
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold, args.alloc_threshold)
+    if regressions:
+        print("\nRegressions detected:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+離線壓力測試：以本機替身服務取代 OpenAI 與 Milvus，啟動 main.app，
+依指定速率重播 evaluation.db 中的真實問題，並回報 TTFT、完整回答延遲、吞吐量與 event loop 延遲。
+
+用法:
+    python tests/load_test.py --rate 5 --duration 60
+    python tests/load_test.py --rate 20 --requests 500 --chat-ttft 800:0.6 --tokens-per-second 40 --json report.json
+    python tests/load_test.py --rate 10 --requests 200 --clients 5     # 少數使用者大量送出，觀察每個 client 的排隊上限
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, TESTS_DIR)
+
+from stub_services import LatencyDistribution, StubMilvusClient, StubSettings, create_openai_app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the /chat endpoint.")
+    parser.add_argument("--rate", type=float, default=5.0, help="平均每秒送出的請求數 (Poisson 到達)")
+    parser.add_argument("--duration", type=float, default=30.0, help="送出請求的時間長度 (秒)")
+    parser.add_argument("--requests", type=int, default=None, help="送出固定數量的請求 (優先於 --duration)")
+    parser.add_argument("--db", default=os.path.join(ROOT_DIR, "evaluation.db"), help="問題來源的 SQLite 檔案")
+    parser.add_argument("--table", default="qa_logs", help="問題來源的資料表")
+    parser.add_argument("--lang", default="zh")
+    parser.add_argument("--timeout", type=float, default=120.0, help="單一請求的逾時 (秒)")
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--stub-port", type=int, default=18001)
+    parser.add_argument("--max-concurrency", type=int, default=None, help="覆寫 CHAT_MAX_CONCURRENCY")
+    parser.add_argument("--max-queue", type=int, default=None, help="覆寫 CHAT_MAX_QUEUE")
+    parser.add_argument("--clients", type=int, default=None,
+                        help="模擬的使用者數 (各自的 X-Forwarded-For)；預設每個請求都是不同的使用者")
+    # 替身服務的延遲分佈，格式為 "median_ms[:sigma]"
+    parser.add_argument("--classify-latency", default="300:0.4", help="rephrase / intent / filter 呼叫的延遲")
+    parser.add_argument("--chat-ttft", default="500:0.4", help="串流回答的首個 token 延遲")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--token-jitter", type=float, default=0.3)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--embedding-latency", default="150:0.3")
+    parser.add_argument("--milvus-latency", default="80:0.3")
+    parser.add_argument("--small-talk-ratio", type=float, default=0.0)
+    parser.add_argument("--json", default=None, help="將報告另存為 JSON 檔")
+    return parser.parse_args()
+
+
+def load_questions(db_path: str, table: str) -> list[str]:
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT question FROM {table} WHERE question IS NOT NULL AND question != ''").fetchall()
+    finally:
+        conn.close()
+    questions = [row[0] for row in rows]
+    if not questions:
+        raise SystemExit(f"No questions found in {db_path}:{table}")
+    return questions
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else float("nan"),
+    }
+
+
+class ServerThread(threading.Thread):
+    """在獨立的 thread 與 event loop 中執行 uvicorn，另外可在同一個 loop 上執行背景 coroutine。"""
+
+    def __init__(self, app, port: int, background=None):
+        super().__init__(daemon=True)
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        self.background = background
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        tasks = [asyncio.create_task(coro) for coro in (self.background or [])]
+        await self.server.serve()
+        for task in tasks:
+            task.cancel()
+
+    def wait_started(self, timeout: float = 15.0):
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.is_alive():
+                raise SystemExit("Server failed to start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+
+class LoopLagMonitor:
+    """定期量測 event loop 的排程延遲 (實際喚醒時間 - 預期喚醒時間)。"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples_ms: list[float] = []
+        self.recording = False
+
+    async def run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            if self.recording:
+                self.samples_ms.append(max(0.0, (time.perf_counter() - expected) * 1000))
+
+
+def client_address(index: int) -> str:
+    """第 index 個模擬使用者的 IP，放在 X-Forwarded-For，admission 以它區分 client"""
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+async def send_request(client, url: str, question: str, lang: str, timeout: float, client_ip: str) -> dict:
+    result = {"question": question, "status": None, "ttft_ms": None, "latency_ms": None, "error": None, "queued": False}
+    start = time.perf_counter()
+    # 所有請求都從 127.0.0.1 送出，不加上這個 header 時會共用同一個 client 的排隊上限 (CHAT_MAX_QUEUE_PER_CLIENT)
+    headers = {"X-Forwarded-For": client_ip}
+    try:
+        async with client.stream("POST", url, json={"query": question, "history": [], "lang": lang},
+                                 headers=headers, timeout=timeout) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                return result
+            buffer = ""
+            async for text in response.aiter_text():
+                buffer += text
+                while "\n\n" in buffer:
+                    frame, buffer = buffer.split("\n\n", 1)
+                    if frame.startswith("event: queue"):
+                        result["queued"] = True
+                    elif frame.startswith("event: error"):
+                        result["error"] = "server error event"
+                    elif frame.startswith("event: end_stream"):
+                        result["latency_ms"] = (time.perf_counter() - start) * 1000
+                    elif frame.startswith("data:") and result["ttft_ms"] is None:
+                        result["ttft_ms"] = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def generate_load(args, questions: list[str], lag_monitor: LoopLagMonitor) -> tuple[list[dict], float]:
+    import httpx
+
+    url = f"http://127.0.0.1:{args.app_port}/chat"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    tasks = []
+    async with httpx.AsyncClient(limits=limits) as client:
+        lag_monitor.recording = True
+        start = time.perf_counter()
+        sent = 0
+        while True:
+            if args.requests is not None and sent >= args.requests:
+                break
+            if args.requests is None and time.perf_counter() - start >= args.duration:
+                break
+            question = random.choice(questions)
+            client_ip = client_address(sent % args.clients if args.clients else sent)
+            tasks.append(asyncio.create_task(send_request(client, url, question, args.lang, args.timeout, client_ip)))
+            sent += 1
+            await asyncio.sleep(random.expovariate(args.rate))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        lag_monitor.recording = False
+    return results, elapsed
+
+
+def build_report(args, results: list[dict], elapsed: float, lag_samples: list[float], hedging_stats: dict | None = None,
+                 model_stats: dict | None = None) -> dict:
+    completed = [r for r in results if r["status"] == 200 and r["latency_ms"] is not None and not r["error"]]
+    status_counts = {}
+    for r in results:
+        key = str(r["status"]) if r["status"] is not None else "no_response"
+        status_counts[key] = status_counts.get(key, 0) + 1
+    return {
+        "settings": {
+            "rate": args.rate,
+            "requests_sent": len(results),
+            "elapsed_s": elapsed,
+        },
+        "status_counts": status_counts,
+        "errors": sum(1 for r in results if r["error"]),
+        "queued": sum(1 for r in results if r["queued"]),
+        "throughput_rps": len(completed) / elapsed if elapsed > 0 else 0.0,
+        "ttft_ms": summarize([r["ttft_ms"] for r in completed if r["ttft_ms"] is not None]),
+        "latency_ms": summarize([r["latency_ms"] for r in completed]),
+        "event_loop_lag_ms": summarize(lag_samples),
+        "hedging": hedging_stats or {},
+        "models": model_stats or {},
+    }
+
+
+def print_report(report: dict):
+    print("\n=== Load test report ===")
+    settings = report["settings"]
+    print(f"Sent {settings['requests_sent']} requests at ~{settings['rate']}/s over {settings['elapsed_s']:.1f}s")
+    print(f"Status codes: {report['status_counts']}  errors: {report['errors']}  queued: {report['queued']}")
+    print(f"Throughput: {report['throughput_rps']:.2f} completed req/s")
+    for name in ("ttft_ms", "latency_ms", "event_loop_lag_ms"):
+        s = report[name]
+        print(f"{name:>18}: p50 {s['p50']:8.1f}  p95 {s['p95']:8.1f}  p99 {s['p99']:8.1f}  max {s['max']:8.1f}  (n={s['count']})")
+    for name, h in report["hedging"].items():
+        print(f"{'hedge ' + name:>30}: delay {h['hedge_delay_ms']:8.1f}  fired {h['hedges_fired']}/{h['calls']}  "
+              f"won {h['hedges_won']}  suppressed {h['hedges_suppressed']}")
+    for stage, models in report["models"].items():
+        for model, m in models.items():
+            print(f"{stage + ' ' + model:>18}: p50 {m['p50_ms'] or 0:8.1f}  p95 {m['p95_ms'] or 0:8.1f}  "
+                  f"calls {m['calls']}  errors {m['errors']}")
+
+
+def main():
+    args = parse_args()
+
+    settings = StubSettings(
+        classify_latency=LatencyDistribution.parse(args.classify_latency),
+        chat_ttft=LatencyDistribution.parse(args.chat_ttft),
+        tokens_per_second=args.tokens_per_second,
+        token_jitter=args.token_jitter,
+        answer_tokens=args.answer_tokens,
+        embedding_latency=LatencyDistribution.parse(args.embedding_latency),
+        milvus_latency=LatencyDistribution.parse(args.milvus_latency),
+        small_talk_ratio=args.small_talk_ratio,
+    )
+
+    # 必須在匯入 config / answer / main 之前設定，讓所有 client 指向本機替身
+    os.environ["OPENAI_API_KEY"] = "sk-stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}/v1"
+    os.environ["ZILLIZ_API_KEY"] = "stub"
+    os.environ["CLUSTER_ENDPOINT"] = "http://127.0.0.1:19530"
+    os.environ.setdefault("LINE_CHANNEL_SECRET", "stub")
+    os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "stub")
+    if args.max_concurrency is not None:
+        os.environ["CHAT_MAX_CONCURRENCY"] = str(args.max_concurrency)
+    if args.max_queue is not None:
+        os.environ["CHAT_MAX_QUEUE"] = str(args.max_queue)
+
+    import pymilvus
+    StubMilvusClient.settings = settings
+    pymilvus.MilvusClient = StubMilvusClient
+
+    os.chdir(ROOT_DIR)
+    import answer
+    import auto_filter
+    import hedging
+    from model_router import model_router
+    import main as app_main
+
+    # 沒有 PostgreSQL，記錄改為只產生遞增的 log id
+    log_ids = iter(range(1, 10**9))
+    answer.log_to_db = lambda *a, **k: next(log_ids)
+    # 避免大量的 console 輸出影響量測
+    for module in (answer, auto_filter, app_main):
+        module.print = lambda *a, **k: None
+
+    questions = load_questions(args.db, args.table)
+    lag_monitor = LoopLagMonitor()
+
+    stub_thread = ServerThread(create_openai_app(settings), args.stub_port)
+    app_thread = ServerThread(app_main.app, args.app_port, background=[lag_monitor.run()])
+    stub_thread.start()
+    stub_thread.wait_started()
+    app_thread.start()
+    app_thread.wait_started()
+
+    try:
+        results, elapsed = asyncio.run(generate_load(args, questions, lag_monitor))
+    finally:
+        app_thread.stop()
+        stub_thread.stop()
+
+    report = build_report(args, results, elapsed, lag_monitor.samples_ms, hedging.stats(), model_router.stats())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
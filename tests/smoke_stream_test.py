@@ -1,11 +1,12 @@
+import os
 import sys
 import asyncio
-sys.path.append('d:/git_sourcetree/milvus_rag')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import answer
 
 # Monkeypatch intent_classification to always return 'other'
-async def fake_intent(question: str) -> str:
+async def fake_intent(question: str, lang: str = 'zh') -> str:
     await asyncio.sleep(0)
     return 'other'
 
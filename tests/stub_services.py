@@ -0,0 +1,219 @@
+"""
+本機離線替身服務：模擬 OpenAI (chat completions / embeddings) 與 Milvus 搜尋。
+延遲與串流速度皆可設定，供壓力測試與 benchmark 在沒有網路的環境下使用。
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import struct
+import time
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILLER_TEXT = (
+    "本校學生前一學期學業成績六十分以上，操行成績七十分以上，且屬於經濟弱勢之學生，"
+    "得於每年九月三十日前上校務行政系統填寫申請，並繳交戶口名簿或三個月內申請之戶籍資料證明文件。"
+)
+
+
+@dataclass
+class LatencyDistribution:
+    """對數常態分佈的延遲 (毫秒)，median 為中位數，sigma 控制長尾。"""
+    median_ms: float
+    sigma: float = 0.0
+
+    def sample_seconds(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * math.exp(self.sigma * random.gauss(0.0, 1.0)) / 1000
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """解析 "median_ms[:sigma]" 格式，例如 "400:0.5"。"""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma) if sigma else 0.0)
+
+
+@dataclass
+class StubSettings:
+    # 非串流 chat (rephrase / intent / filter) 的回應時間
+    classify_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution(300, 0.4))
+    # 串流 chat 的首個 token 時間
+    chat_ttft: LatencyDistribution = field(default_factory=lambda: LatencyDistribution(500, 0.4))
+    # 每秒產生的 token 數 (中位數) 與抖動
+    tokens_per_second: float = 60.0
+    token_jitter: float = 0.3
+    answer_tokens: int = 300
+    small_talk_tokens: int = 30
+    embedding_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution(150, 0.3))
+    embedding_dim: int = 1536
+    milvus_latency: LatencyDistribution = field(default_factory=lambda: LatencyDistribution(80, 0.3))
+    # intent 回傳 "other" (閒聊) 的比例
+    small_talk_ratio: float = 0.0
+
+
+def _load_source_metadata() -> dict:
+    with open(os.path.join(ROOT_DIR, "config.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _answer_tokens(count: int) -> list[str]:
+    tokens = []
+    text = FILLER_TEXT
+    for i in range(count):
+        start = (i * 2) % (len(text) - 2)
+        tokens.append(text[start:start + 2])
+    return tokens
+
+
+def create_openai_app(settings: StubSettings) -> FastAPI:
+    """建立與 OpenAI REST API 相容的替身 app (base_url 指向 http://host:port/v1)。"""
+    from prompts import PROMPTS
+
+    app = FastAPI()
+    rag_systems = {PROMPTS[lang]["rag_system"] for lang in PROMPTS}
+    source_names = [name.replace(".md", "") for name in _load_source_metadata()]
+    answer_tokens = _answer_tokens(settings.answer_tokens)
+    small_talk_tokens = _answer_tokens(settings.small_talk_tokens)
+
+    def _completion_text(messages: list) -> str:
+        content = messages[-1].get("content", "")
+        if "Schema:" in content:
+            return "{}"
+        if "scholarship" in content and '"other"' in content:
+            return "other" if random.random() < settings.small_talk_ratio else "scholarship"
+        # rephrase：原樣回傳最新的問題
+        lines = [line for line in content.strip().splitlines() if line.strip()]
+        return lines[-2] if len(lines) >= 2 else content
+
+    def _chunk(model: str, content: str | None, finish_reason: str | None = None) -> str:
+        delta = {"content": content} if content is not None else {}
+        payload = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        messages = body.get("messages", [])
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.classify_latency.sample_seconds())
+            return JSONResponse({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": _completion_text(messages)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105},
+            })
+
+        is_rag = bool(messages) and messages[0].get("content") in rag_systems
+        tokens = answer_tokens if is_rag else small_talk_tokens
+
+        async def stream():
+            await asyncio.sleep(settings.chat_ttft.sample_seconds())
+            yield _chunk(model, "")
+            mean_delay = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+            for token in tokens:
+                yield _chunk(model, token)
+                if mean_delay:
+                    await asyncio.sleep(mean_delay * max(0.0, random.gauss(1.0, settings.token_jitter)))
+            if is_rag:
+                yield _chunk(model, "|||SOURCES|||")
+                yield _chunk(model, ",".join(source_names[:2]))
+            yield _chunk(model, None, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = body.get("dimensions") or settings.embedding_dim
+        await asyncio.sleep(settings.embedding_latency.sample_seconds())
+
+        data = []
+        for i, text in enumerate(inputs):
+            rng = random.Random(hash(str(text)))
+            vector = [rng.uniform(-1, 1) for _ in range(dim)]
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            vector = [v / norm for v in vector]
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode()
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": 10, "total_tokens": 10},
+        })
+
+    return app
+
+
+class StubMilvusClient:
+    """
+    取代 pymilvus.MilvusClient 的替身。
+    pymilvus 透過 gRPC 連線，因此在 client 物件層級替換；
+    搜尋以 time.sleep 模擬阻塞式的網路呼叫 (與真實 client 一樣在 asyncio.to_thread 中執行)。
+    """
+
+    settings = StubSettings()
+
+    def __init__(self, *args, **kwargs):
+        metadata = _load_source_metadata()
+        self._documents = []
+        for doc_id, (file_name, meta) in enumerate(metadata.items()):
+            text = (f"{file_name.replace('.md', '')}：" + FILLER_TEXT * 12)[:1000]
+            self._documents.append({
+                "id": doc_id,
+                "text": text,
+                "source_file": file_name,
+                "source_url": meta.get("source_url", ""),
+                "status": meta.get("status", []),
+                "subsidy_type": meta.get("subsidy_type", []),
+                "edu_system": meta.get("edu_system", []),
+            })
+
+    def _results(self, limit: int) -> list:
+        time.sleep(self.settings.milvus_latency.sample_seconds())
+        hits = []
+        for rank, doc in enumerate(random.sample(self._documents, min(limit, len(self._documents)))):
+            hits.append({"id": doc["id"], "distance": 1.0 / (rank + 1), "entity": dict(doc)})
+        return [hits]
+
+    def hybrid_search(self, collection_name, reqs, ranker, limit=10, output_fields=None, **kwargs):
+        return self._results(limit)
+
+    def search(self, collection_name, data, limit=10, **kwargs):
+        return self._results(limit)
+
+    def describe_collection(self, collection_name, **kwargs):
+        return {"collection_name": collection_name, "collection_id": 1, "created_timestamp": 0}
+
+    def get_collection_stats(self, collection_name, **kwargs):
+        return {"row_count": len(self._documents)}
@@ -0,0 +1,73 @@
+import numpy as np
+from pymilvus import DataType
+
+# 各 embedding 模型的原生維度；text-embedding-3 系列可透過 dimensions 參數取得較短的向量
+NATIVE_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+PRECISIONS = ("float32", "float16", "int8")
+
+_MILVUS_TYPES = {
+    "float32": DataType.FLOAT_VECTOR,
+    "float16": DataType.FLOAT16_VECTOR,
+    "int8": DataType.INT8_VECTOR,
+}
+
+_BYTES_PER_VALUE = {"float32": 4, "float16": 2, "int8": 1}
+
+
+def validate(model: str, dim: int, precision: str):
+    """檢查維度與精度設定，ingest 與查詢都應該在啟動時呼叫"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"VECTOR_PRECISION 必須是 {', '.join(PRECISIONS)} 之一，目前為 '{precision}'。")
+    native_dim = NATIVE_DIMS.get(model)
+    if native_dim and dim > native_dim:
+        raise ValueError(f"EMBEDDING_DIM={dim} 超過 {model} 的原生維度 {native_dim}。")
+    if native_dim and dim < native_dim and model == "text-embedding-ada-002":
+        raise ValueError("text-embedding-ada-002 不支援縮短維度，請改用 text-embedding-3 系列。")
+
+
+def embedding_kwargs(model: str, dim: int) -> dict:
+    """
+    embeddings.create 的額外參數。
+    只有在需要比原生維度短的向量時才傳 dimensions，維持原設定時的請求內容不變。
+    """
+    native_dim = NATIVE_DIMS.get(model)
+    if native_dim is None or dim < native_dim:
+        return {"dimensions": dim}
+    return {}
+
+
+def milvus_vector_type(precision: str):
+    return _MILVUS_TYPES[precision]
+
+
+def to_milvus(vector, precision: str):
+    """
+    將 embedding 轉成 Milvus 欄位需要的格式 (寫入與查詢共用)。
+    float16 以 numpy float16 陣列傳送；int8 先正規化再乘上 127 量化 (cosine 與向量長度無關)。
+    """
+    if precision == "float32":
+        return vector if isinstance(vector, list) else np.asarray(vector, dtype=np.float32).tolist()
+    array = np.asarray(vector, dtype=np.float32)
+    if precision == "float16":
+        return array.astype(np.float16)
+    if precision == "int8":
+        norm = np.linalg.norm(array) or 1.0
+        return np.clip(np.rint(array / norm * 127), -127, 127).astype(np.int8)
+    raise ValueError(f"Unknown vector precision: {precision}")
+
+
+def truncate(vector, dim: int) -> np.ndarray:
+    """截短並重新正規化，與 text-embedding-3 的 dimensions 參數結果相同，用於離線比較不同維度"""
+    array = np.asarray(vector, dtype=np.float32)[..., :dim]
+    norm = np.linalg.norm(array, axis=-1, keepdims=True)
+    return array / np.where(norm == 0, 1.0, norm)
+
+
+def bytes_per_vector(dim: int, precision: str) -> int:
+    """每個向量的原始資料大小 (不含索引)，也等於每次查詢送出的向量大小"""
+    return dim * _BYTES_PER_VALUE[precision]